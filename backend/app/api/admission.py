@@ -0,0 +1,32 @@
+"""
+Load shedding for the LLM-backed endpoints.
+
+Turns admission-control rejections into fast 429/503 responses with a
+Retry-After header, before any generation (or stream) starts. Requests the
+response caches can answer are never shed: check the caches first
+(``LLM.alookup``) and admit on a miss.
+"""
+
+from fastapi import HTTPException
+
+from app.core.admission import OverloadedError
+from app.core.llm import LLM, ResponseLookup
+
+
+def admit_or_reject(llm: LLM, priority: str):
+    """Raise a 429/503 HTTPException if ``llm`` can't take the request in time."""
+    try:
+        llm.admit(priority)
+    except OverloadedError as e:
+        print(f"[ADMISSION] Rejected {priority} request: {e}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+def admit_unless_cached(llm: LLM, lookup: ResponseLookup, priority: str):
+    """Like ``admit_or_reject``, but a cache hit (next to free to serve) always goes through."""
+    if lookup.response is None:
+        admit_or_reject(llm, priority)
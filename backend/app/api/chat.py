@@ -1,21 +1,25 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from typing import Optional
 
-from app.core.llm import LLM
+from app.api.admission import admit_unless_cached
+from app.api.deadlines import DeadlineFields
+from app.api.streaming import cancel_on_disconnect, with_truncation_trailer
+from app.core.llm import get_llm
+from app.core.request_queue import PRIORITY_INTERACTIVE, PRIORITY_STANDARD
 
 router = APIRouter()
-llm = LLM()
 
 
-class ChatRequest(BaseModel):
+class ChatRequest(DeadlineFields):
     prompt: Optional[str] = None
     message: Optional[str] = None
 
 
 @router.post("/")
-def chat(request: ChatRequest):
+async def chat(request: ChatRequest):
+    session = request.session()
     prompt = request.prompt or request.message
 
     if not prompt:
@@ -24,12 +28,20 @@ def chat(request: ChatRequest):
             detail="Either 'prompt' or 'message' must be provided"
         )
 
-    response = llm.generate(prompt)
-    return {"response": response}
+    llm = await run_in_threadpool(get_llm)
+    lookup = await llm.alookup(prompt, session=session)
+    admit_unless_cached(llm, lookup, PRIORITY_STANDARD)
+    response = await llm.agenerate(prompt, session=session, lookup=lookup)
+    return {
+        "response": response,
+        "truncated": session.truncated,
+        "input_tokens_dropped": session.input_tokens_dropped,
+    }
 
 
 @router.post("/stream")
-def chat_stream(request: ChatRequest):
+async def chat_stream(request: ChatRequest, http_request: Request):
+    session = request.session()
     prompt = request.prompt or request.message
 
     if not prompt:
@@ -38,8 +50,19 @@ def chat_stream(request: ChatRequest):
             detail="Either 'prompt' or 'message' must be provided"
         )
 
-    def generator():
-        for chunk in llm.stream_generate(prompt):
+    # First call loads the model; keep that off the event loop
+    llm = await run_in_threadpool(get_llm)
+    # Fitting the prompt here also puts the dropped-token count in a header
+    # (the body is plain text)
+    lookup = await llm.alookup(prompt, session=session)
+    admit_unless_cached(llm, lookup, PRIORITY_INTERACTIVE)
+
+    async def generator():
+        async for chunk in llm.astream_generate(prompt, session=session, lookup=lookup):
             yield chunk
 
-    return StreamingResponse(generator(), media_type="text/plain")
+    return StreamingResponse(
+        cancel_on_disconnect(http_request, session, with_truncation_trailer(session, generator())),
+        media_type="text/plain",
+        headers={"X-Input-Tokens-Dropped": str(session.input_tokens_dropped)},
+    )
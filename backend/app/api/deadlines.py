@@ -0,0 +1,34 @@
+"""
+Per-request deadlines for the LLM-backed endpoints.
+
+Callers can give a latency budget (milliseconds from when the request
+arrives) and/or an absolute deadline (Unix time). The earlier one wins.
+Generation stops when it passes, queue wait included, and the endpoint
+returns the partial answer with ``truncated`` set.
+"""
+
+import time
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from app.core.llm import GenerationSession
+
+
+class DeadlineFields(BaseModel):
+    """Optional deadline fields shared by the chat request models."""
+    latency_budget_ms: Optional[int] = Field(
+        None, gt=0, description="Time allowed for the answer, from when the request arrives"
+    )
+    deadline: Optional[float] = Field(
+        None, description="Unix time (seconds) by which the answer is needed"
+    )
+
+    def session(self) -> GenerationSession:
+        """A generation session carrying this request's deadline. Call on arrival."""
+        budgets = []
+        if self.latency_budget_ms is not None:
+            budgets.append(self.latency_budget_ms / 1000)
+        if self.deadline is not None:
+            budgets.append(self.deadline - time.time())
+        return GenerationSession.with_budget(min(budgets) if budgets else None)
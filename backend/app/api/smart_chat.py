@@ -3,45 +3,42 @@ Smart Chat API Endpoint.
 
 Combines intent detection with RAG retrieval to provide
 intelligent responses for data structure learning queries.
+
+Multi-turn conversations: create a session with ``POST /sessions`` and pass
+its ``session_id`` with each message. Earlier turns are then part of the
+prompt, and their KV state stays on the server between turns, so each
+follow-up only prefills the new message.
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Optional, List
+import asyncio
 import json
 
-from app.core.llm import LLM
+from app.api.admission import admit_unless_cached
+from app.api.deadlines import DeadlineFields
+from app.api.streaming import cancel_on_disconnect, with_truncation_trailer
+from app.core.llm import LLM, GenerationSession, LLMSettings, ResponseLookup, get_llm, get_loaded_llm
+from app.core.generation_profiles import GENERAL_PROFILE, GenerationProfile, profile_for_intent
 from app.core.intent_detector import detect_intent, Intent
 from app.core.code_extractor import get_code_extractor
+from app.core.conversations import Conversation, get_conversation_store
+from app.core.explanation_store import get_explanation_store
 from app.core.rag_pipeline import get_rag_pipeline
+from app.utils.prompts import build_ds_prompt
+from app.core.request_queue import PRIORITY_INTERACTIVE, PRIORITY_STANDARD
 
 
 router = APIRouter()
 
-# Shared LLM instance
-_llm: Optional[LLM] = None
-
-
-def preload_llm() -> LLM:
-    """Preload and cache the LLM instance. Call this at startup."""
-    global _llm
-    if _llm is None:
-        _llm = LLM()
-    return _llm
-
 
-def get_llm() -> LLM:
-    """Get the shared LLM instance (loads if not already loaded)."""
-    global _llm
-    if _llm is None:
-        _llm = LLM()
-    return _llm
-
-
-class SmartChatRequest(BaseModel):
+class SmartChatRequest(DeadlineFields):
     """Request model for smart chat."""
     message: str = Field(..., description="User's message", min_length=1)
+    session_id: Optional[str] = Field(None, description="Conversation session from POST /sessions")
 
 
 class SmartChatResponse(BaseModel):
@@ -51,37 +48,116 @@ class SmartChatResponse(BaseModel):
     visualizer_code: Optional[str] = Field(None, description="HTML/CSS/JS visualizer code")
     data_structure: Optional[str] = Field(None, description="Detected data structure name")
     operations: Optional[List[str]] = Field(None, description="Specific operations requested")
+    truncated: bool = Field(False, description="True if the deadline cut the answer short")
+    input_tokens_dropped: int = Field(0, description="Tokens cut from the middle of an oversized message")
+
+
+class SessionResponse(BaseModel):
+    """Response model for a new conversation session."""
+    session_id: str = Field(..., description="Pass with each message of the conversation")
+    idle_timeout_seconds: float = Field(..., description="The session closes after this long unused")
+    max_tokens: int = Field(..., description="Transcript budget; older turns are dropped beyond it")
+
+
+@router.post("/sessions", response_model=SessionResponse)
+async def create_session():
+    """Open a multi-turn conversation session."""
+    store = get_conversation_store()
+    conversation = store.create()
+    return SessionResponse(
+        session_id=conversation.id,
+        idle_timeout_seconds=store.idle_seconds,
+        max_tokens=LLMSettings().conversation_max_tokens,
+    )
 
 
-# Prompt for generating explanations about data structures
-DS_EXPLANATION_PROMPT = """You are an expert teacher explaining data structures.
-
-The user wants to learn about: {data_structure}
-{operations_context}
-
-Provide a clear, concise explanation that:
-1. Explains what this data structure is
-2. Describes how the operations work
-3. Mentions time complexity if relevant
-4. Keep it brief (2-3 paragraphs max)
-
-User's question: {user_message}
-
-Your explanation:"""
-
-DS_OPERATION_EXPLANATION_PROMPT = """You are an expert teacher explaining data structures.
-
-The user wants to learn specifically about the {operations} operation(s) in {data_structure}.
-
-Provide a focused explanation that:
-1. Explains how these specific operations work
-2. Describes the step-by-step process
-3. Mentions time complexity
-4. Keep it concise (1-2 paragraphs)
+@router.delete("/sessions/{session_id}")
+async def close_session(session_id: str) -> Dict[str, Any]:
+    """Close a conversation session and free its server-side KV state."""
+    if not get_conversation_store().close(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return {"session_id": session_id, "closed": True}
+
+
+def _conversation(request: SmartChatRequest) -> Optional[Conversation]:
+    """The request's conversation, or None for a one-off message."""
+    if request.session_id is None:
+        return None
+    conversation = get_conversation_store().get(request.session_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session; create a new one")
+    return conversation
+
+
+def _in_conversation(
+    llm: LLM,
+    conversation: Optional[Conversation],
+    prompt: str,
+    message: str,
+    session: GenerationSession,
+) -> str:
+    """Put ``prompt`` after the conversation's earlier turns and keep this turn's KV state."""
+    if conversation is None:
+        return prompt
+    session.conversation_id = conversation.id
+    return llm.conversation_prompt(conversation.turns, prompt, message, session)
+
+
+def _record_turn(
+    conversation: Optional[Conversation],
+    prompt: str,
+    answer: str,
+    session: GenerationSession,
+):
+    """
+    Add a completed turn to the conversation (answers cut short are left out).
 
-User's question: {user_message}
+    The prompt is recorded as the model saw it (fitted to the input budget),
+    so the next turn's prompt starts with the tokens of the kept KV state.
+    """
+    if conversation is None or not answer or session.truncated or session.finish_reason == "cancelled":
+        return
+    conversation.add_turn(session.turn_prompt or prompt, answer)
+
+
+async def _lookup_stream(
+    conversation: Optional[Conversation],
+    prompt: str,
+    message: str,
+    session: GenerationSession,
+    profile: GenerationProfile = GENERAL_PROFILE,
+) -> Optional[ResponseLookup]:
+    """
+    Check the response caches for a stream, and shed it on a miss, before its response starts.
 
-Your explanation:"""
+    Overload is then a proper 429/503, cache hits are never shed, and the
+    dropped-token count is known in time for the metadata. Streams load the
+    model inside their generator (falling back to a canned answer if that
+    fails), so this only happens once the model is already up; otherwise
+    it returns None and the generation does its own lookup.
+    """
+    llm = get_loaded_llm()
+    if llm is None:
+        return None
+    model_prompt = await run_in_threadpool(_in_conversation, llm, conversation, prompt, message, session)
+    lookup = await llm.alookup(model_prompt, profile, message, session)
+    admit_unless_cached(llm, lookup, PRIORITY_INTERACTIVE)
+    return lookup
+
+
+async def _record_stream(
+    conversation: Optional[Conversation],
+    prompt: str,
+    session: GenerationSession,
+    chunks: AsyncIterable[str],
+) -> AsyncIterator[str]:
+    """Pass a response stream through, then record its text as a conversation turn."""
+    answer = []
+    async for chunk in chunks:
+        if not chunk.startswith("__METADATA__"):
+            answer.append(chunk)
+        yield chunk
+    _record_turn(conversation, prompt, "".join(answer).strip(), session)
 
 
 @router.post("/", response_model=SmartChatResponse)
@@ -92,21 +168,27 @@ async def smart_chat(request: SmartChatRequest):
     For DS learning queries: Returns AI explanation + visualizer code
     For other queries: Returns normal AI response
     """
+    session = request.session()
     message = request.message.strip()
+    conversation = _conversation(request)
     
     # Step 1: Detect intent
     intent = detect_intent(message)
     
     # Step 2: Handle based on intent
     if intent.is_ds_query and intent.data_structure:
-        return await _handle_ds_query(message, intent)
+        return await _handle_ds_query(message, intent, session, conversation)
     else:
-        return await _handle_general_query(message)
+        return await _handle_general_query(message, session, conversation)
 
 
-async def _handle_ds_query(message: str, intent: Intent) -> SmartChatResponse:
+async def _handle_ds_query(
+    message: str,
+    intent: Intent,
+    session: GenerationSession,
+    conversation: Optional[Conversation] = None,
+) -> SmartChatResponse:
     """Handle a data structure learning query."""
-    llm = get_llm()
     rag = get_rag_pipeline()
     extractor = get_code_extractor()
     
@@ -125,74 +207,102 @@ async def _handle_ds_query(message: str, intent: Intent) -> SmartChatResponse:
                     intent.operations
                 )
     
-    # Generate explanation
-    if intent.operations:
-        prompt = DS_OPERATION_EXPLANATION_PROMPT.format(
-            data_structure=intent.data_structure,
-            operations=", ".join(intent.operations),
-            user_message=message
-        )
-    else:
-        operations_context = ""
-        if intent.operations:
-            operations_context = f"Specifically about: {', '.join(intent.operations)}"
-        prompt = DS_EXPLANATION_PROMPT.format(
-            data_structure=intent.data_structure,
-            operations_context=operations_context,
-            user_message=message
+    # Precomputed explanations cost no LLM call; generate the rest
+    prompt, prompt_prefix = build_ds_prompt(message, intent.data_structure, intent.operations)
+    explanation = get_explanation_store().get(intent.data_structure, intent.operations)
+    if explanation is None:
+        llm = await run_in_threadpool(get_llm)
+        model_prompt = await run_in_threadpool(_in_conversation, llm, conversation, prompt, message, session)
+        profile = profile_for_intent(intent)
+        lookup = await llm.alookup(model_prompt, profile, message, session)
+        admit_unless_cached(llm, lookup, PRIORITY_STANDARD)
+        explanation = await llm.agenerate(
+            model_prompt,
+            session=session,
+            cacheable_prefix=prompt_prefix,
+            profile=profile,
+            question=message,
+            lookup=lookup,
         )
     
-    explanation = llm.generate(prompt)
-    
     # Add note if visualizer not found
     if not visualizer_code:
         explanation += f"\n\n(Note: Interactive visualizer for {intent.data_structure} is not available yet.)"
+    _record_turn(conversation, prompt, explanation, session)
     
     return SmartChatResponse(
         response_type="visualization" if visualizer_code else "text_only",
         text=explanation,
         visualizer_code=visualizer_code,
         data_structure=intent.data_structure,
-        operations=intent.operations
+        operations=intent.operations,
+        truncated=session.truncated,
+        input_tokens_dropped=session.input_tokens_dropped,
     )
 
 
-async def _handle_general_query(message: str) -> SmartChatResponse:
+async def _handle_general_query(
+    message: str,
+    session: GenerationSession,
+    conversation: Optional[Conversation] = None,
+) -> SmartChatResponse:
     """Handle a general (non-DS) query."""
-    llm = get_llm()
-    response = llm.generate(message)
+    llm = await run_in_threadpool(get_llm)
+    model_prompt = await run_in_threadpool(_in_conversation, llm, conversation, message, message, session)
+    lookup = await llm.alookup(model_prompt, question=message, session=session)
+    admit_unless_cached(llm, lookup, PRIORITY_STANDARD)
+    response = await llm.agenerate(
+        model_prompt,
+        session=session,
+        question=message,
+        lookup=lookup,
+    )
+    _record_turn(conversation, message, response, session)
     
     return SmartChatResponse(
         response_type="text_only",
         text=response,
         visualizer_code=None,
         data_structure=None,
-        operations=None
+        operations=None,
+        truncated=session.truncated,
+        input_tokens_dropped=session.input_tokens_dropped,
     )
 
 
 @router.post("/stream")
-async def smart_chat_stream(request: SmartChatRequest):
+async def smart_chat_stream(request: SmartChatRequest, http_request: Request):
     """
     Streaming version of smart chat.
     
     Returns a stream where:
     - First, a JSON header with metadata (response_type, visualizer_code, etc.)
-    - Then, the streamed AI response text
+    - Then, the streamed AI response text (ends early if the deadline passes)
+    - Finally, if the deadline cut the answer short, a trailer block
+      (``{"type": "trailer", "truncated": true}``) in the same framing
     """
+    session = request.session()
     message = request.message.strip()
+    conversation = _conversation(request)
     
     # Detect intent
     intent = detect_intent(message)
     
     if intent.is_ds_query and intent.data_structure:
-        return await _stream_ds_query(message, intent)
+        return await _stream_ds_query(message, intent, http_request, session, conversation)
     else:
-        return await _stream_general_query(message)
+        return await _stream_general_query(message, http_request, session, conversation)
 
 
-async def _stream_ds_query(message: str, intent: Intent):
+async def _stream_ds_query(
+    message: str,
+    intent: Intent,
+    http_request: Request,
+    session: GenerationSession,
+    conversation: Optional[Conversation] = None,
+):
     """Stream a data structure learning response with LLM explanation."""
+    stored = get_explanation_store().get(intent.data_structure, intent.operations)
     rag = get_rag_pipeline()
     extractor = get_code_extractor()
     
@@ -211,59 +321,136 @@ async def _stream_ds_query(message: str, intent: Intent):
                 )
     
     # Build prompt for LLM explanation
-    if intent.operations:
-        prompt = DS_OPERATION_EXPLANATION_PROMPT.format(
-            data_structure=intent.data_structure,
-            operations=", ".join(intent.operations),
-            user_message=message
-        )
-    else:
-        prompt = DS_EXPLANATION_PROMPT.format(
-            data_structure=intent.data_structure,
-            operations_context="",
-            user_message=message
-        )
+    prompt, prompt_prefix = build_ds_prompt(message, intent.data_structure, intent.operations)
+    profile = profile_for_intent(intent)
+    lookup = None
+    if stored is None:
+        lookup = await _lookup_stream(conversation, prompt, message, session, profile)
     
-    def generator():
+    async def generator():
         # Send metadata with visualizer code IMMEDIATELY
         metadata = {
             "type": "metadata",
             "response_type": "visualization" if visualizer_code else "text_only",
             "data_structure": intent.data_structure,
             "operations": intent.operations,
-            "visualizer_code": visualizer_code
+            "visualizer_code": visualizer_code,
+            "input_tokens_dropped": session.input_tokens_dropped,
         }
         yield f"__METADATA__{json.dumps(metadata)}__END_METADATA__"
         
-        # Stream explanation from LLM
-        try:
-            print(f"[DEBUG] Starting LLM generation for {intent.data_structure}...")
-            llm = get_llm()
-            print("[DEBUG] LLM loaded, starting generation...")
-            has_output = False
-            for chunk in llm.stream_generate(prompt):
-                has_output = True
-                yield chunk
+        if stored is not None:
+            # Precomputed explanation: no LLM call at all
+            yield stored
+        else:
+            # Stream explanation from LLM
+            try:
+                print(f"[DEBUG] Starting LLM generation for {intent.data_structure}...")
+                llm = await run_in_threadpool(get_llm)
+                print("[DEBUG] LLM loaded, starting generation...")
+                if lookup is None:
+                    model_prompt = await run_in_threadpool(
+                        _in_conversation, llm, conversation, prompt, message, session
+                    )
+                else:
+                    model_prompt = lookup.prompt
+                stream = llm.astream_generate(
+                    model_prompt,
+                    session=session,
+                    cacheable_prefix=prompt_prefix,
+                    profile=profile,
+                    question=message,
+                    lookup=lookup,
+                )
+
+                # Hedge: don't leave the learner looking at a blank pane while
+                # the model is busy; the precomputed explanation goes out instead.
+                # Only worth it with a real explanation, not the placeholder line
+                first = asyncio.ensure_future(stream.__anext__())
+                budget = llm.settings.hedge_first_token_seconds
+                if not _has_static_explanation(intent.data_structure):
+                    budget = 0
+                done, _ = await asyncio.wait({first}, timeout=budget if budget > 0 else None)
+                if not done:
+                    print(f"[HEDGE] No LLM token within {budget}s for {intent.data_structure}, sending the precomputed explanation")
+                    # The transcript gets the precomputed text, so the model's
+                    # answer must not become the conversation's KV state
+                    session.drop_conversation()
+                    yield _get_static_explanation(intent.data_structure, intent.operations)
+                    # Finishing for the cache is optional work: not while others wait
+                    if llm.settings.hedge_cache_fill and llm.response_cache is not None and llm.has_spare_capacity():
+                        _finish_in_background(first, stream, session.detach())
+                    else:
+                        # astream_generate cancels the session as it unwinds
+                        first.cancel()
+                    has_output = True
+                else:
+                    has_output = False
+                    try:
+                        yield first.result()
+                        has_output = True
+                    except StopAsyncIteration:
+                        pass
+                    else:
+                        async for chunk in stream:
+                            yield chunk
             
-            print(f"[DEBUG] LLM generation complete. has_output={has_output}")
+                print(f"[DEBUG] LLM generation complete. has_output={has_output}")
             
-            if not has_output:
-                # LLM produced no output, use fallback
-                print("[DEBUG] Using fallback explanation (no LLM output)")
-                yield _get_static_explanation(intent.data_structure, intent.operations)
+                if not has_output:
+                    # LLM produced no output, use fallback
+                    print("[DEBUG] Using fallback explanation (no LLM output)")
+                    yield _get_static_explanation(intent.data_structure, intent.operations)
                 
-        except Exception as e:
-            print(f"[DEBUG] LLM error for DS query: {e}")
-            import traceback
-            traceback.print_exc()
-            # Fallback to static explanation
-            yield _get_static_explanation(intent.data_structure, intent.operations)
+            except Exception as e:
+                print(f"[DEBUG] LLM error for DS query: {e}")
+                import traceback
+                traceback.print_exc()
+                # Fallback to static explanation
+                yield _get_static_explanation(intent.data_structure, intent.operations)
         
         # Add note if no visualizer
         if not visualizer_code:
             yield f"\n\n(Note: Interactive visualizer for {intent.data_structure} is not available yet.)"
     
-    return StreamingResponse(generator(), media_type="text/plain")
+    return StreamingResponse(
+        cancel_on_disconnect(
+            http_request,
+            session,
+            with_truncation_trailer(session, _record_stream(conversation, prompt, session, generator())),
+        ),
+        media_type="text/plain",
+    )
+
+
+# Hedged generations finishing for the response cache, with the sessions
+# that control them (referenced until done)
+_background_generations: Dict["asyncio.Task", GenerationSession] = {}
+
+
+def cancel_background_generations():
+    """Stop the hedged generations still finishing for the cache (e.g. on shutdown)."""
+    for task, session in list(_background_generations.items()):
+        session.cancel()
+        task.cancel()
+
+
+def _finish_in_background(first: "asyncio.Future", stream, session: GenerationSession):
+    """Let a hedged generation run to completion so its answer lands in the response cache."""
+    async def drain():
+        try:
+            await first
+            async for _ in stream:
+                pass
+            print("[HEDGE] Background generation finished")
+        except StopAsyncIteration:
+            pass
+        except Exception as e:
+            print(f"[HEDGE] Background generation failed: {e}")
+
+    task = asyncio.ensure_future(drain())
+    _background_generations[task] = session
+    task.add_done_callback(lambda done: _background_generations.pop(done, None))
 
 
 # Pre-written explanations for instant responses
@@ -304,9 +491,17 @@ Try the interactive visualizer on the right to see how linked list operations wo
 }
 
 
+def _has_static_explanation(ds_name: str) -> bool:
+    """True if there is a real explanation for ``ds_name`` (not just the placeholder line)."""
+    return bool(get_explanation_store().get(ds_name) or DS_EXPLANATIONS.get(ds_name))
+
+
 def _get_static_explanation(ds_name: str, operations: list = None) -> str:
     """Get a pre-written explanation for a data structure."""
-    base_explanation = DS_EXPLANATIONS.get(ds_name, f"Learn about {ds_name} with the interactive visualizer!")
+    base_explanation = (
+        get_explanation_store().get(ds_name)
+        or DS_EXPLANATIONS.get(ds_name, f"Learn about {ds_name} with the interactive visualizer!")
+    )
     
     if operations:
         ops_str = ", ".join(operations)
@@ -315,25 +510,44 @@ def _get_static_explanation(ds_name: str, operations: list = None) -> str:
     return base_explanation
 
 
-async def _stream_general_query(message: str):
+async def _stream_general_query(
+    message: str,
+    http_request: Request,
+    session: GenerationSession,
+    conversation: Optional[Conversation] = None,
+):
     """Stream a general response using LLM."""
-    
-    def generator():
+    lookup = await _lookup_stream(conversation, message, message, session)
+
+    async def generator():
         # Send metadata header first
         metadata = {
             "type": "metadata",
             "response_type": "text_only",
             "data_structure": None,
             "operations": None,
-            "visualizer_code": None
+            "visualizer_code": None,
+            "input_tokens_dropped": session.input_tokens_dropped,
         }
         yield f"__METADATA__{json.dumps(metadata)}__END_METADATA__"
         
         # Try to use LLM
         try:
-            llm = get_llm()
+            llm = await run_in_threadpool(get_llm)
             has_output = False
-            for chunk in llm.stream_generate(message):
+            if lookup is None:
+                model_prompt = await run_in_threadpool(
+                    _in_conversation, llm, conversation, message, message, session
+                )
+            else:
+                model_prompt = lookup.prompt
+            stream = llm.astream_generate(
+                model_prompt,
+                session=session,
+                question=message,
+                lookup=lookup,
+            )
+            async for chunk in stream:
                 has_output = True
                 yield chunk
             
@@ -342,6 +556,13 @@ async def _stream_general_query(message: str):
                 
         except Exception as e:
             print(f"LLM generation error: {e}")
-            yield f"I'm having trouble generating a response right now. For data structure topics, try asking about 'stack', 'queue', or 'linked list' for instant visualizations!"
+            yield "I'm having trouble generating a response right now. For data structure topics, try asking about 'stack', 'queue', or 'linked list' for instant visualizations!"
     
-    return StreamingResponse(generator(), media_type="text/plain")
+    return StreamingResponse(
+        cancel_on_disconnect(
+            http_request,
+            session,
+            with_truncation_trailer(session, _record_stream(conversation, message, session, generator())),
+        ),
+        media_type="text/plain",
+    )
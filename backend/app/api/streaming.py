@@ -0,0 +1,76 @@
+"""
+Streaming helpers shared by the chat endpoints.
+
+Wraps an async chunk generator so StreamingResponse can consume it
+while the client connection is watched. When the client goes away the
+generation session is cancelled immediately instead of decoding the
+rest of the answer for nobody.
+
+A stream whose deadline cut the answer short ends with a trailer block in
+the same framing as the smart-chat metadata header:
+``__METADATA__{"type": "trailer", "truncated": true, ...}__END_METADATA__``.
+"""
+
+import asyncio
+import json
+from typing import AsyncIterable, AsyncIterator
+
+from fastapi import Request
+
+from app.core.llm import GenerationSession
+
+# How often to poll the connection while waiting for tokens (seconds)
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+async def _watch_disconnect(request: Request, session: GenerationSession):
+    """Cancel the session as soon as the client disconnects."""
+    while not session.cancelled:
+        if await request.is_disconnected():
+            print("[DEBUG] Client disconnected, cancelling generation")
+            session.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def cancel_on_disconnect(
+    request: Request,
+    session: GenerationSession,
+    chunks: AsyncIterable[str],
+) -> AsyncIterator[str]:
+    """
+    Stream ``chunks`` and cancel ``session`` if the client disconnects.
+
+    Args:
+        request: The incoming HTTP request (used for disconnect detection).
+        session: Generation session backing the stream.
+        chunks: Async iterator of text chunks.
+
+    Yields:
+        Text chunks from ``chunks``.
+    """
+    watcher = asyncio.create_task(_watch_disconnect(request, session))
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        # Also covers Starlette cancelling the response task on disconnect
+        watcher.cancel()
+        session.cancel()
+
+
+async def with_truncation_trailer(
+    session: GenerationSession,
+    chunks: AsyncIterable[str],
+) -> AsyncIterator[str]:
+    """
+    Stream ``chunks``, then mark the end if the deadline cut the answer short.
+
+    Without the trailer a client can't tell a cut-off answer from a
+    complete one; non-stream responses carry ``truncated`` instead.
+    """
+    async for chunk in chunks:
+        yield chunk
+    if session.truncated:
+        trailer = {"type": "trailer", "truncated": True, "finish_reason": session.finish_reason}
+        yield f"__METADATA__{json.dumps(trailer)}__END_METADATA__"
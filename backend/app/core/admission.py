@@ -0,0 +1,118 @@
+"""
+Admission control for LLM requests.
+
+Before a request is queued, estimate how long it would wait for a batch
+slot: the requests ahead of it (same or higher priority class) each need
+about ``tokens per request`` tokens, and the batch completes about
+``tokens/sec per sequence x running sequences`` tokens per second. Requests
+are rejected straight away when the queue is full or the estimated wait
+is over the limit, with a Retry-After hint, instead of piling up until
+every client times out.
+"""
+
+import math
+import threading
+from typing import Any, Dict, Optional
+
+from app.core.request_queue import PRIORITY_STANDARD, PRIORITY_WEIGHTS
+from app.core.telemetry import GenerationMetrics
+
+
+class OverloadedError(Exception):
+    """Raised when a request is shed by admission control."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code  # 429 (queue full) or 503 (wait too long)
+        self.retry_after = retry_after  # Seconds
+
+
+class AdmissionController:
+    """Bounded queue depth plus a maximum expected queue wait."""
+
+    def __init__(
+        self,
+        metrics: GenerationMetrics,
+        max_queue_depth: int = 32,
+        max_expected_wait_seconds: float = 30.0,
+    ):
+        """
+        Initialize the controller.
+
+        Args:
+            metrics: Source of the recent throughput estimates.
+            max_queue_depth: Maximum requests waiting in the queue (0 disables).
+            max_expected_wait_seconds: Maximum estimated queue wait (0 disables).
+        """
+        self.metrics = metrics
+        self.max_queue_depth = max_queue_depth
+        self.max_expected_wait_seconds = max_expected_wait_seconds
+        self._lock = threading.Lock()
+        self._stats = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_wait": 0,
+        }
+
+    def expected_wait(self, priority: str, load: Dict[str, Any]) -> Optional[float]:
+        """
+        Estimated seconds before a new request of ``priority`` starts prefill.
+
+        Args:
+            priority: The new request's priority class.
+            load: Backend queue state (see ``InferenceBackend.load``).
+
+        Returns:
+            The estimate, or None while there is no throughput data yet.
+        """
+        queued = load["queued_by_priority"]
+        weight = PRIORITY_WEIGHTS.get(priority, PRIORITY_WEIGHTS[PRIORITY_STANDARD])
+        # Classes with at least our weight are served before us
+        ahead = sum(count for p, count in queued.items() if PRIORITY_WEIGHTS.get(p, 0) >= weight)
+        free_slots = max(0, load["capacity"] - load["active"])
+        position = ahead + 1 - free_slots
+        if position <= 0:
+            return 0.0
+
+        tokens_per_second, tokens_per_request = self.metrics.throughput_estimate()
+        if not tokens_per_second or not tokens_per_request:
+            return None
+        running = max(1, load["active"])
+        return position * tokens_per_request / (tokens_per_second * running)
+
+    def check(self, priority: str, load: Dict[str, Any]):
+        """
+        Admit a request or raise ``OverloadedError``.
+
+        Args:
+            priority: The new request's priority class.
+            load: Backend queue state (see ``InferenceBackend.load``).
+        """
+        wait = self.expected_wait(priority, load)
+        retry_after = max(1, math.ceil(wait)) if wait else 1
+
+        depth = sum(load["queued_by_priority"].values())
+        if self.max_queue_depth and depth >= self.max_queue_depth:
+            with self._lock:
+                self._stats["rejected_queue_full"] += 1
+            raise OverloadedError(
+                f"Too many requests queued ({depth}). Please retry shortly.",
+                status_code=429,
+                retry_after=retry_after,
+            )
+
+        if self.max_expected_wait_seconds and wait is not None and wait > self.max_expected_wait_seconds:
+            with self._lock:
+                self._stats["rejected_wait"] += 1
+            raise OverloadedError(
+                f"The assistant is busy (estimated wait {wait:.0f}s). Please retry shortly.",
+                status_code=503,
+                retry_after=retry_after,
+            )
+
+        with self._lock:
+            self._stats["admitted"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
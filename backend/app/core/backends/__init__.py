@@ -0,0 +1,29 @@
+# Inference backends
+from typing import TYPE_CHECKING
+
+from app.core.backends.base import InferenceBackend
+
+if TYPE_CHECKING:
+    from app.core.llm import LLMSettings
+
+BACKENDS = ("hf", "onnx")
+
+
+def create_backend(settings: "LLMSettings", tokenizer) -> InferenceBackend:
+    """
+    Create the inference backend selected by ``settings.backend``.
+
+    Args:
+        settings: LLM settings.
+        tokenizer: The loaded tokenizer (backends need its special token ids).
+
+    Returns:
+        An initialized InferenceBackend.
+    """
+    if settings.backend == "hf":
+        from app.core.backends.hf import HFBackend
+        return HFBackend(settings, tokenizer)
+    if settings.backend == "onnx":
+        from app.core.backends.onnx import ORTBackend
+        return ORTBackend(settings, tokenizer)
+    raise ValueError(f"Unknown LLM backend '{settings.backend}'. Expected one of: {', '.join(BACKENDS)}")
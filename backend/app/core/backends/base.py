@@ -0,0 +1,82 @@
+"""
+Inference backend interface.
+
+The LLM facade (``app.core.llm.LLM``) handles prompting, caching and
+sessions; a backend only turns token ids into token ids. Backends take
+``GenerationRequest`` objects, stream generated tokens to the request's
+streamer and mark the request done when they finish.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List
+
+from app.core.scheduler import GenerationRequest
+
+
+class InferenceBackend(ABC):
+    """Base class for model execution backends."""
+
+    # Short identifier used in settings and the response cache key
+    name: str = "base"
+
+    # "cpu" or "cuda"
+    device_type: str = "cpu"
+
+    @abstractmethod
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        """
+        Start generating for ``request`` without blocking.
+
+        Generated tokens are pushed to ``request.streamer`` (if any) as they
+        are produced; ``request.done`` is set when the sequence finishes.
+
+        Returns:
+            The same request object.
+        """
+
+    def generate(self, request: GenerationRequest) -> List[int]:
+        """Generate to completion and return the generated token ids."""
+        return self.submit(request).wait()
+
+    def stream_generate(self, request: GenerationRequest) -> GenerationRequest:
+        """Start a streaming generation; read tokens from ``request.streamer``."""
+        if request.streamer is None:
+            raise ValueError("stream_generate requires a request with a streamer")
+        return self.submit(request)
+
+    def generate_batch(self, requests: List[GenerationRequest]) -> List[List[int]]:
+        """Generate several requests together and return their token ids in order."""
+        for request in requests:
+            self.submit(request)
+        return [request.wait() for request in requests]
+
+    def generate_padded(self, requests: List[GenerationRequest]) -> List[List[int]]:
+        """
+        Generate several requests as one left-padded batch (offline bulk work).
+
+        Backends that can run a whole batch through a single ``generate()``
+        call override this; the default is ``generate_batch``.
+        """
+        return self.generate_batch(requests)
+
+    def release_conversation(self, conversation_id: str):
+        """Forget the KV state kept for a conversation (no-op if the backend keeps none)."""
+
+    def describe(self) -> Dict[str, Any]:
+        """Properties that change the generated text (part of the response cache key)."""
+        return {"backend": self.name}
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Current queue state, used for admission control.
+
+        Returns:
+            ``queued_by_priority`` (waiting requests per class), ``active``
+            (requests generating) and ``capacity`` (requests that can
+            generate at once).
+        """
+        return {"queued_by_priority": {}, "active": 0, "capacity": 1}
+
+    def stats(self) -> Dict[str, Any]:
+        """Runtime counters for monitoring."""
+        return {}
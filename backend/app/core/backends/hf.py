@@ -0,0 +1,282 @@
+"""
+Hugging Face transformers backend (default).
+
+Loads the model with ``AutoModelForCausalLM`` and runs it through the
+continuous-batching ``GenerationScheduler``.
+"""
+
+from typing import TYPE_CHECKING, Any, Dict, List
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteriaList
+
+from app.core.backends.base import InferenceBackend
+from app.core.conversation_cache import ConversationKVCache
+from app.core.prefix_cache import PrefixCache
+from app.core.scheduler import GenerationRequest, GenerationScheduler, RowStoppingCriteria
+from app.core.static_decoder import StaticCacheDecoder
+from app.core.telemetry import record_generation
+
+if TYPE_CHECKING:
+    from app.core.llm import LLMSettings
+
+
+def select_device(requested: str) -> str:
+    """Resolve the configured device, falling back to CPU when CUDA is missing."""
+    if requested == "cpu":
+        print("[INFO] CPU inference requested.")
+        return "cpu"
+
+    if not torch.cuda.is_available():
+        if requested == "cuda":
+            print("[WARNING] CUDA was requested but is NOT available. Falling back to CPU.")
+        else:
+            print("[WARNING] CUDA/GPU is NOT available. Running on CPU.")
+        return "cpu"
+
+    gpu_name = torch.cuda.get_device_name(0)
+    print(f"[SUCCESS] CUDA/GPU detected: {gpu_name}")
+    print(f"[INFO] VRAM Available: {torch.cuda.get_device_properties(0).total_memory / 1024**3:.2f} GB")
+    return "cuda"
+
+
+def configure_cpu_threads(num_threads: int, num_interop_threads: int):
+    """Apply intra-op/inter-op thread counts (0 keeps the torch default)."""
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            # Can only be set once, before any inter-op work has started
+            print(f"[WARNING] Could not set inter-op threads: {e}")
+    print(f"[INFO] CPU threads: intra-op={torch.get_num_threads()}, inter-op={torch.get_num_interop_threads()}")
+
+
+class HFBackend(InferenceBackend):
+    """Runs the model with PyTorch/transformers and continuous batching."""
+
+    name = "hf"
+
+    def __init__(self, settings: "LLMSettings", tokenizer):
+        self.settings = settings
+
+        # ---------------------------------------------------------
+        # DEVICE CHECK - Use the GPU when there is one, CPU otherwise
+        # ---------------------------------------------------------
+        self.device_type = select_device(settings.device)
+        if self.device_type == "cpu":
+            configure_cpu_threads(settings.cpu_num_threads, settings.cpu_num_interop_threads)
+
+        self.quantization = "none"
+        if self.device_type == "cpu" and settings.cpu_quantization == "int8":
+            self.quantization = "int8"
+
+        self.model = self._load_model(settings.model_name)
+        print(f"[LLM INIT] Model loaded successfully on device: {self.model.device}")
+
+        # Optional draft model for speculative decoding
+        self.draft_model = None
+        if settings.draft_model_name:
+            self.draft_model = self._load_draft_model(settings.draft_model_name, tokenizer)
+
+        # Compiled mode: static KV cache plus a torch.compile'd decode step
+        self.static_decoder = None
+        if settings.decode_mode == "compiled":
+            print(f"[LLM INIT] Compiled decode mode (static KV cache of {settings.static_cache_max_length} tokens)")
+            self.static_decoder = StaticCacheDecoder(
+                self.model,
+                max_cache_len=settings.static_cache_max_length,
+            )
+        elif settings.decode_mode != "eager":
+            print(f"[WARNING] Unknown decode mode '{settings.decode_mode}'. Using eager.")
+
+        self.kv_cache_dtype = settings.kv_cache_dtype
+        if self.kv_cache_dtype not in ("auto", "int8"):
+            print(f"[WARNING] Unknown KV cache dtype '{self.kv_cache_dtype}'. Using auto.")
+            self.kv_cache_dtype = "auto"
+        if self.kv_cache_dtype == "int8" and self.static_decoder is not None:
+            print("[WARNING] The int8 KV cache is not supported in compiled decode mode. Using auto.")
+            self.kv_cache_dtype = "auto"
+        quantize_kv = self.kv_cache_dtype == "int8"
+
+        self.prefix_cache = None
+        if settings.prefix_cache_mb > 0:
+            self.prefix_cache = PrefixCache(
+                max_bytes=settings.prefix_cache_mb * 1024**2,
+                page_tokens=settings.kv_page_tokens,
+                quantized=quantize_kv,
+            )
+
+        self.conversation_cache = None
+        if settings.conversation_cache_mb > 0:
+            self.conversation_cache = ConversationKVCache(
+                max_bytes=settings.conversation_cache_mb * 1024**2,
+                max_tokens=settings.conversation_max_tokens,
+                idle_seconds=settings.conversation_idle_seconds,
+                page_tokens=settings.kv_page_tokens,
+                quantized=quantize_kv,
+            )
+
+        # All generation goes through one scheduler so concurrent requests
+        # share decode steps instead of queueing behind a global lock
+        self.scheduler = GenerationScheduler(
+            self.model,
+            eos_token_id=tokenizer.eos_token_id,
+            max_batch_size=settings.max_batch_size,
+            prefix_cache=self.prefix_cache,
+            num_threads=settings.cpu_num_threads if self.device_type == "cpu" else 0,
+            draft_model=self.draft_model,
+            num_draft_tokens=settings.num_draft_tokens,
+            static_decoder=self.static_decoder,
+            starvation_seconds=settings.starvation_seconds,
+            reserved_interactive_slots=settings.reserved_interactive_slots,
+            conversation_cache=self.conversation_cache,
+            quantize_kv=quantize_kv,
+            prefill_chunk_tokens=max(0, settings.prefill_chunk_tokens),
+        )
+
+    def _load_model(self, model_name: str):
+        """Load a causal LM for this backend's device, dtype and quantization."""
+        load_kwargs = {}
+        attn_implementation = self.settings.attn_implementation
+        if attn_implementation == "auto":
+            # SDPA has fused CPU kernels; on GPU let transformers pick
+            attn_implementation = "sdpa" if self.device_type == "cpu" else None
+        if attn_implementation:
+            load_kwargs["attn_implementation"] = attn_implementation
+
+        print(f"[LLM INIT] Loading Model {model_name} to {self.device_type}...")
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            device_map=self.device_type,
+            torch_dtype=torch.float16 if self.device_type == "cuda" else torch.float32,
+            trust_remote_code=True,
+            **load_kwargs,
+        )
+        model.eval()
+
+        if self.quantization == "int8":
+            print("[LLM INIT] Applying int8 dynamic quantization to Linear layers...")
+            model = torch.ao.quantization.quantize_dynamic(
+                model,
+                {torch.nn.Linear},
+                dtype=torch.qint8,
+                inplace=True,
+            )
+        return model
+
+    def _load_draft_model(self, draft_model_name: str, tokenizer):
+        """Load the speculative decoding draft model, or None if it can't be used."""
+        draft_tokenizer = AutoTokenizer.from_pretrained(draft_model_name, trust_remote_code=True)
+        # Drafted token ids are fed straight to the main model, so the
+        # vocabularies have to be identical
+        if (
+            len(draft_tokenizer) != len(tokenizer)
+            or draft_tokenizer.eos_token_id != tokenizer.eos_token_id
+        ):
+            print(f"[WARNING] Draft model {draft_model_name} uses a different tokenizer. "
+                  "Speculative decoding disabled.")
+            return None
+
+        draft_model = self._load_model(draft_model_name)
+        print(f"[LLM INIT] Speculative decoding enabled with {draft_model_name} "
+              f"({self.settings.num_draft_tokens} draft tokens per step)")
+        return draft_model
+
+    @property
+    def decode_mode(self) -> str:
+        """"compiled" or "eager" (also "eager" after a failed compilation)."""
+        if self.static_decoder is None:
+            return "eager"
+        return self.static_decoder.mode
+
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        return self.scheduler.submit(request)
+
+    def generate_padded(self, requests: List[GenerationRequest]) -> List[List[int]]:
+        """
+        Run all requests in one left-padded ``model.generate()`` call.
+
+        Offline only (bulk jobs such as ``app.core.batch_generate``):
+        prompts are prefilled together, which the scheduler (one prefill at
+        a time) can't do. It runs the model on the calling thread without
+        any coordination with the scheduler's worker, so it refuses to start
+        while the scheduler has requests. Each row stops where the scheduler
+        would have stopped it (EOS, token budget, its stopping criteria) and
+        costs no decode steps after that.
+
+        Raises:
+            RuntimeError: The scheduler is serving requests.
+        """
+        if not requests:
+            return []
+        load = self.scheduler.load()
+        if load["active"] or any(load["queued_by_priority"].values()):
+            raise RuntimeError("generate_padded is for offline jobs; the scheduler is serving requests")
+
+        eos_token_id = self.scheduler.eos_token_id
+        length = max(len(r.input_ids) for r in requests)
+        input_ids = torch.tensor(
+            [[eos_token_id] * (length - len(r.input_ids)) + r.input_ids for r in requests],
+            device=self.model.device,
+        )
+        attention_mask = torch.tensor(
+            [[0] * (length - len(r.input_ids)) + [1] * len(r.input_ids) for r in requests],
+            device=self.model.device,
+        )
+
+        for request in requests:
+            request.trace.mark("started")
+        rows = RowStoppingCriteria(requests, length, eos_token_id)
+        with torch.inference_mode():
+            self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max(r.max_new_tokens for r in requests),
+                do_sample=False,
+                pad_token_id=eos_token_id,
+                eos_token_id=eos_token_id,
+                stopping_criteria=StoppingCriteriaList([rows]),
+                # Same KV representation as the scheduler (int8 changes the
+                # logits, and the response cache key says which one was used)
+                past_key_values=self.scheduler.cache_class(),
+            )
+
+        results = []
+        for row, request in enumerate(requests):
+            generated, reason = rows.generated[row], rows.finish_reasons[row] or "stopped"
+            request.generated = generated
+            request.finish_reason = reason
+            request.position = len(request.input_ids) + len(generated)
+            # No per-token timing inside a batched generate() call
+            request.trace.tokens = len(generated)
+            request.trace.mark("finished")
+            record_generation(request.trace, reason)
+            request.done.set()
+            results.append(generated)
+        return results
+
+    def release_conversation(self, conversation_id: str):
+        if self.conversation_cache is not None:
+            self.conversation_cache.release(conversation_id)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "dtype": "float16" if self.device_type == "cuda" else "float32",
+            # int8 weights change the logits, so their answers are cached separately
+            "quantization": self.quantization,
+            "kv_cache": self.kv_cache_dtype,
+        }
+
+    def load(self) -> Dict[str, Any]:
+        return self.scheduler.load()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"decode_mode": self.decode_mode, "scheduler": self.scheduler.stats()}
+        if self.prefix_cache is not None:
+            stats["prefix_cache"] = self.prefix_cache.stats()
+        if self.conversation_cache is not None:
+            stats["conversation_cache"] = self.conversation_cache.stats()
+        return stats
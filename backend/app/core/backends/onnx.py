@@ -0,0 +1,301 @@
+"""
+ONNX Runtime backend for CPU servers.
+
+Runs a model exported with ``python -m app.core.backends.onnx_export``
+through ``optimum.onnxruntime.ORTModelForCausalLM`` with full graph
+optimizations and IO binding. Requires the optional ``optimum[onnxruntime]``
+dependency.
+"""
+
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List
+
+import torch
+from transformers.generation.streamers import BaseStreamer
+
+from app.core.backends.base import InferenceBackend
+from app.core.request_queue import PRIORITY_INTERACTIVE, RequestQueue
+from app.core.scheduler import GenerationRequest, stop_reason, truncate_at_stop
+from app.core.telemetry import record_generation
+
+if TYPE_CHECKING:
+    from app.core.llm import LLMSettings
+
+# Written by the export CLI next to the model files
+EXPORT_MANIFEST = "codelearn_export.json"
+
+
+class _GeneratedOnlyStreamer(BaseStreamer):
+    """
+    Forwards generated tokens to a request's streamer (if any), dropping the
+    prompt, and stamps each token on the request's trace.
+
+    ``end()`` from generate() is held back until the backend calls ``close()``,
+    so the request's finish reason is set before the consumer sees the end.
+    """
+
+    def __init__(self, request: GenerationRequest):
+        self.request = request
+        self.streamer = request.streamer
+        self.prompt_seen = False
+        self.closed = False
+
+    def put(self, value):
+        # generate() pushes the prompt first; the scheduler never does
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        if self.request.trace.first_token is None:
+            # ONNX Runtime runs prefill inside generate(); it ends with the first token
+            self.request.trace.mark("prefilled")
+        self.request.trace.token()
+        if self.streamer is not None:
+            self.streamer.put(value.reshape(-1).cpu())
+
+    def end(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.streamer is not None:
+                self.streamer.end()
+
+
+class ORTBackend(InferenceBackend):
+    """Runs an exported ONNX model on CPU with ONNX Runtime."""
+
+    name = "onnx"
+    device_type = "cpu"
+
+    def __init__(self, settings: "LLMSettings", tokenizer):
+        try:
+            import onnxruntime as ort
+            from optimum.onnxruntime import ORTModelForCausalLM
+        except ImportError as e:
+            raise ImportError(
+                "The ONNX backend requires optimum with onnxruntime: "
+                "pip install 'optimum[onnxruntime]'"
+            ) from e
+
+        self.settings = settings
+        self.eos_token_id = tokenizer.eos_token_id
+
+        model_dir = settings.onnx_model_dir
+        if not os.path.isdir(model_dir):
+            raise FileNotFoundError(
+                f"ONNX model directory '{model_dir}' not found. "
+                "Export it first: python -m app.core.backends.onnx_export"
+            )
+
+        manifest = {}
+        manifest_path = os.path.join(model_dir, EXPORT_MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        self.file_name = manifest.get("file_name", "model.onnx")
+        self.quantization = manifest.get("quantization", "none")
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if settings.cpu_num_threads > 0:
+            session_options.intra_op_num_threads = settings.cpu_num_threads
+        if settings.cpu_num_interop_threads > 0:
+            session_options.inter_op_num_threads = settings.cpu_num_interop_threads
+
+        print(f"[LLM INIT] Loading ONNX model from {model_dir} ({self.file_name})...")
+        self.model = ORTModelForCausalLM.from_pretrained(
+            model_dir,
+            file_name=self.file_name,
+            provider="CPUExecutionProvider",
+            session_options=session_options,
+            use_cache=True,
+            use_io_binding=True,
+        )
+        print("[LLM INIT] ONNX model loaded successfully")
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._pending = RequestQueue(starvation_seconds=settings.starvation_seconds)
+        self.num_workers = settings.max_batch_size
+        self.reserved_interactive_slots = max(
+            0, min(settings.reserved_interactive_slots, self.num_workers - 1)
+        )
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "generated_tokens": 0,
+            "active": 0,
+        }
+        self._finish_reasons: Dict[str, int] = {}
+
+        # ONNX Runtime sessions are thread-safe, so requests run side by side
+        # on a fixed set of workers that take turns from the priority queue
+        for i in range(self.num_workers):
+            threading.Thread(target=self._worker, name=f"ort-generate-{i}", daemon=True).start()
+
+    # -------------------------
+    # SINGLE REQUESTS
+    # -------------------------
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        with self._cond:
+            self._stats["submitted"] += 1
+            request.trace.priority = self._pending.priority_of(request)
+            request.trace.mark("submitted")
+            self._pending.append(request)
+            self._cond.notify()
+        return request
+
+    def _next_request(self) -> GenerationRequest:
+        """Wait for the next request this worker may run (call with the lock held)."""
+        while True:
+            allowed = None
+            if self.num_workers - self._stats["active"] <= self.reserved_interactive_slots:
+                allowed = (PRIORITY_INTERACTIVE,)
+            request = self._pending.popleft(allowed)
+            if request is not None:
+                return request
+            self._cond.wait()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                request = self._next_request()
+                self._stats["active"] += 1
+            try:
+                self._run(request)
+            finally:
+                with self._cond:
+                    self._stats["active"] -= 1
+                    # A freed worker may unblock requests held back for interactive traffic
+                    self._cond.notify_all()
+
+    def _run(self, request: GenerationRequest):
+        request.trace.mark("started")
+        streamer = _GeneratedOnlyStreamer(request)
+
+        try:
+            input_ids = torch.tensor([request.input_ids])
+            # generate() only checks stopping criteria after the first token;
+            # like the scheduler, don't start requests that are already done
+            # (cancelled or past their deadline while queued)
+            if stop_reason(request.stopping_criteria, input_ids) is not None:
+                self._complete(request, [])
+                return
+            output = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                max_new_tokens=request.max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.eos_token_id,
+                eos_token_id=self.eos_token_id,
+                stopping_criteria=request.stopping_criteria,
+                streamer=streamer,
+            )
+            self._complete(request, output[0, input_ids.shape[-1]:].tolist())
+        except Exception as e:
+            print(f"[ONNX] Generation failed: {e}")
+            request.finish_reason = "error"
+            request.error = e
+            with self._lock:
+                self._stats["failed"] += 1
+                self._finish_reasons["error"] = self._finish_reasons.get("error", 0) + 1
+            record_generation(request.trace, "error")
+            request.done.set()
+        finally:
+            streamer.close()
+
+    def _complete(self, request: GenerationRequest, generated: List[int]):
+        # Match the scheduler: keep tokens up to and including the first EOS
+        if self.eos_token_id in generated:
+            generated = generated[:generated.index(self.eos_token_id) + 1]
+            request.finish_reason = "eos"
+        elif len(generated) >= request.max_new_tokens:
+            request.finish_reason = "length"
+        else:
+            input_ids = torch.tensor([request.input_ids + generated])
+            request.finish_reason = stop_reason(request.stopping_criteria, input_ids) or "stopped"
+
+        request.generated = generated
+        request.position = len(request.input_ids) + len(generated)
+        with self._lock:
+            self._stats["completed"] += 1
+            self._stats["generated_tokens"] += len(generated)
+            self._finish_reasons[request.finish_reason] = (
+                self._finish_reasons.get(request.finish_reason, 0) + 1
+            )
+        request.trace.mark("finished")
+        record_generation(request.trace, request.finish_reason)
+        request.done.set()
+
+    # -------------------------
+    # BATCHES
+    # -------------------------
+    def generate_batch(self, requests: List[GenerationRequest]) -> List[List[int]]:
+        """Run all requests in one left-padded generate() call."""
+        if not requests:
+            return []
+
+        length = max(len(r.input_ids) for r in requests)
+        input_ids = torch.tensor([
+            [self.eos_token_id] * (length - len(r.input_ids)) + r.input_ids
+            for r in requests
+        ])
+        attention_mask = torch.tensor([
+            [0] * (length - len(r.input_ids)) + [1] * len(r.input_ids)
+            for r in requests
+        ])
+
+        with self._lock:
+            self._stats["submitted"] += len(requests)
+        for request in requests:
+            request.trace.mark("started")
+        output = self.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=max(r.max_new_tokens for r in requests),
+            do_sample=False,
+            pad_token_id=self.eos_token_id,
+            eos_token_id=self.eos_token_id,
+        )
+
+        results = []
+        for row, request in enumerate(requests):
+            # Apply the request's stopping criteria, as single requests do
+            generated, _ = truncate_at_stop(request, output[row, length:].tolist(), self.eos_token_id)
+            # No per-token timing inside a batched generate() call
+            request.trace.tokens = len(generated)
+            self._complete(request, generated)
+            results.append(request.generated)
+        return results
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "file_name": self.file_name,
+            "quantization": self.quantization,
+        }
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queued_by_priority": self._pending.depths(),
+                "active": self._stats["active"],
+                "capacity": self.num_workers,
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "onnx": {
+                    **self._stats,
+                    "finish_reasons": dict(self._finish_reasons),
+                    "queued": len(self._pending),
+                    "queued_by_priority": self._pending.depths(),
+                    "oldest_wait_seconds": self._pending.oldest_wait(),
+                    "starvation_promotions": self._pending.promotions,
+                }
+            }
@@ -0,0 +1,143 @@
+"""
+One-time export of the LLM to ONNX for the ONNX Runtime backend.
+
+Exports the model with its KV cache inputs, applies ONNX Runtime graph
+optimizations and, optionally, int8 dynamic quantization. The result is
+written to ``LLM_ONNX_MODEL_DIR`` (default ``./onnx_model``) together with
+a small manifest the backend reads at startup.
+
+Run this script directly:
+    python -m app.core.backends.onnx_export
+    python -m app.core.backends.onnx_export --optimization-level O2 --int8
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../..'))
+
+from app.core.backends.onnx import EXPORT_MANIFEST
+
+
+def export_model(
+    model_name: str,
+    output_dir: str,
+    optimization_level: str = "O2",
+    int8: bool = False,
+) -> str:
+    """
+    Export, optimize and optionally quantize the model.
+
+    Args:
+        model_name: Hugging Face model id to export.
+        output_dir: Directory for the exported model.
+        optimization_level: Optimum ORT optimization level (O1-O3), or "none".
+        int8: Apply int8 dynamic quantization after optimization.
+
+    Returns:
+        File name of the final ONNX model inside ``output_dir``.
+    """
+    try:
+        from optimum.onnxruntime import (
+            ORTModelForCausalLM,
+            ORTOptimizer,
+            ORTQuantizer,
+        )
+        from optimum.onnxruntime.configuration import (
+            AutoOptimizationConfig,
+            AutoQuantizationConfig,
+        )
+        from transformers import AutoTokenizer
+    except ImportError as e:
+        raise ImportError(
+            "Exporting requires optimum with onnxruntime: pip install 'optimum[onnxruntime]'"
+        ) from e
+
+    print(f"Exporting {model_name} to ONNX (this takes a few minutes)...")
+    model = ORTModelForCausalLM.from_pretrained(
+        model_name,
+        export=True,
+        use_cache=True,
+        trust_remote_code=True,
+    )
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_name, trust_remote_code=True).save_pretrained(output_dir)
+    file_name = "model.onnx"
+
+    if optimization_level != "none":
+        print(f"Applying ONNX Runtime graph optimizations ({optimization_level})...")
+        try:
+            optimizer = ORTOptimizer.from_pretrained(model)
+            optimizer.optimize(
+                save_dir=output_dir,
+                optimization_config=AutoOptimizationConfig.with_optimization_level(
+                    optimization_level,
+                    for_gpu=False,
+                ),
+            )
+            file_name = "model_optimized.onnx"
+        except (NotImplementedError, KeyError) as e:
+            # Offline fusions are model-type specific; ORT still applies its
+            # generic graph optimizations when the session is created
+            print(f"Offline optimization not supported for this model ({e}); skipping.")
+
+    quantization = "none"
+    if int8:
+        print("Applying int8 dynamic quantization...")
+        quantizer = ORTQuantizer.from_pretrained(output_dir, file_name=file_name)
+        quantizer.quantize(
+            save_dir=output_dir,
+            quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=True),
+        )
+        file_name = file_name.replace(".onnx", "_quantized.onnx")
+        quantization = "int8"
+
+    with open(os.path.join(output_dir, EXPORT_MANIFEST), "w") as f:
+        json.dump(
+            {
+                "model_name": model_name,
+                "file_name": file_name,
+                "optimization_level": optimization_level,
+                "quantization": quantization,
+            },
+            f,
+            indent=2,
+        )
+
+    return file_name
+
+
+def main():
+    from app.core.llm import LLMSettings
+
+    settings = LLMSettings()
+    parser = argparse.ArgumentParser(description="Export the LLM to ONNX for the onnx backend")
+    parser.add_argument("--model", default=settings.model_name, help="Model id to export")
+    parser.add_argument("--output", default=settings.onnx_model_dir, help="Output directory")
+    parser.add_argument(
+        "--optimization-level",
+        default="O2",
+        choices=["none", "O1", "O2", "O3"],
+        help="ONNX Runtime graph optimization level",
+    )
+    parser.add_argument("--int8", action="store_true", help="Apply int8 dynamic quantization")
+    parser.add_argument("--force", action="store_true", help="Overwrite an existing export")
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        if not args.force:
+            print(f"'{args.output}' already exists. Use --force to overwrite it.")
+            sys.exit(1)
+        shutil.rmtree(args.output)
+
+    file_name = export_model(args.model, args.output, args.optimization_level, args.int8)
+    print(f"✅ Exported to {os.path.join(args.output, file_name)}")
+    print("   Enable it with LLM_BACKEND=onnx")
+
+
+if __name__ == "__main__":
+    main()
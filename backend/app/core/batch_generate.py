@@ -0,0 +1,209 @@
+"""
+Offline batched generation.
+
+Runs a JSONL file of prompts through the model in bulk (curriculum Q&A,
+response-cache warm-up). Prompts are grouped into buckets of similar token
+length and each batch runs as one left-padded ``generate()`` call, so little
+compute goes to padding and prompt prefill is batched too. Results are
+appended to the output JSONL after every batch; rerunning with the same
+output file skips the prompts that are already done.
+
+Input lines:  {"id": "q1", "prompt": "...", "profile": "explanation"}
+              ("id" defaults to the line number, "profile" to "general")
+Output lines: {"id": "q1", "prompt": "...", "response": "..."}
+
+Answers also go into the response cache, so a run over common questions
+warms it up for the server.
+
+Run this script directly:
+    python -m app.core.batch_generate prompts.jsonl answers.jsonl
+    python -m app.core.batch_generate prompts.jsonl answers.jsonl --batch-size 32 --bucket-tokens 32
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Set
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
+
+from app.core.generation_profiles import PROFILES
+
+
+def read_prompts(path: str) -> List[Dict[str, Any]]:
+    """Read and validate the input JSONL (blank lines are skipped)."""
+    records = []
+    seen: Set[str] = set()
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: invalid JSON ({e})") from e
+            if not isinstance(record, dict) or not isinstance(record.get("prompt"), str):
+                raise ValueError(f"{path}:{number}: expected an object with a \"prompt\" string")
+
+            record["id"] = str(record.get("id", number))
+            record.setdefault("profile", "general")
+            if record["profile"] not in PROFILES:
+                raise ValueError(
+                    f"{path}:{number}: unknown profile '{record['profile']}' "
+                    f"(expected one of {', '.join(PROFILES)})"
+                )
+            if record["id"] in seen:
+                raise ValueError(f"{path}:{number}: duplicate id '{record['id']}'")
+            seen.add(record["id"])
+            records.append(record)
+    return records
+
+
+def completed_ids(path: str) -> Set[str]:
+    """Ids already written to the output (the checkpoint of an earlier run)."""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError, TypeError):
+                # A line cut off by a crash; that prompt simply runs again
+                continue
+    return done
+
+
+def length_buckets(
+    records: List[Dict[str, Any]],
+    lengths: List[int],
+    batch_size: int,
+    bucket_tokens: int,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Group records into batches of similar prompt length.
+
+    Records are sorted by token length and split into buckets ``bucket_tokens``
+    wide; each bucket is cut into batches of at most ``batch_size``. Left
+    padding is then at most one bucket width per row.
+    """
+    buckets: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    for record, length in sorted(zip(records, lengths), key=lambda pair: pair[1]):
+        buckets[length // bucket_tokens].append(record)
+
+    batches = []
+    for bucket in buckets.values():
+        for i in range(0, len(bucket), batch_size):
+            batches.append(bucket[i:i + batch_size])
+    return batches
+
+
+def run_batch_file(
+    llm,
+    input_path: str,
+    output_path: str,
+    batch_size: int = 16,
+    bucket_tokens: int = 64,
+) -> Dict[str, Any]:
+    """
+    Generate answers for every prompt in ``input_path`` that isn't in ``output_path`` yet.
+
+    Args:
+        llm: A loaded ``LLM``.
+        input_path: Input JSONL of prompts.
+        output_path: Output JSONL; appended to after every batch.
+        batch_size: Maximum prompts per ``generate()`` call.
+        bucket_tokens: Width of the prompt-length buckets, in tokens.
+
+    Returns:
+        Run summary (counts, time, padding overhead).
+    """
+    records = read_prompts(input_path)
+    done = completed_ids(output_path)
+    todo = [record for record in records if record["id"] not in done]
+    print(f"{len(records)} prompts, {len(records) - len(todo)} already done, {len(todo)} to generate.")
+
+    # Batches never mix profiles (different budgets and stop conditions)
+    by_profile: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for record in todo:
+        by_profile[record["profile"]].append(record)
+
+    # Make sure a line cut off by a crash doesn't swallow the next record
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+        if needs_newline:
+            with open(output_path, "a", encoding="utf-8") as f:
+                f.write("\n")
+
+    generated = 0
+    prompt_tokens = 0
+    padded_tokens = 0
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out:
+        for profile_name, group in by_profile.items():
+            profile = PROFILES[profile_name]
+            lengths = [len(llm._encode(llm._format_prompt(record["prompt"]))) for record in group]
+            length_of = {record["id"]: length for record, length in zip(group, lengths)}
+
+            for batch in length_buckets(group, lengths, batch_size, bucket_tokens):
+                batch_lengths = [length_of[record["id"]] for record in batch]
+                prompt_tokens += sum(batch_lengths)
+                padded_tokens += max(batch_lengths) * len(batch)
+
+                texts = llm.generate_batch(
+                    [record["prompt"] for record in batch],
+                    profile=profile,
+                    padded=True,
+                )
+                for record, text in zip(batch, texts):
+                    out.write(json.dumps(
+                        {"id": record["id"], "prompt": record["prompt"], "response": text},
+                        ensure_ascii=False,
+                    ) + "\n")
+                # Checkpoint: the batch is on disk before the next one starts
+                out.flush()
+                os.fsync(out.fileno())
+
+                generated += len(batch)
+                elapsed = time.perf_counter() - start
+                print(f"  {generated}/{len(todo)} done ({elapsed:.0f}s elapsed, {generated / max(elapsed, 1e-6):.2f} prompts/s)")
+
+    return {
+        "prompts": len(records),
+        "skipped": len(records) - len(todo),
+        "generated": generated,
+        "seconds": round(time.perf_counter() - start, 1),
+        # Share of prefill positions spent on padding
+        "padding_overhead": round(1 - prompt_tokens / padded_tokens, 3) if padded_tokens else 0.0,
+    }
+
+
+def main():
+    from app.core.llm import LLM
+
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the model in batches")
+    parser.add_argument("input", help="Input JSONL (one {\"prompt\": ...} object per line)")
+    parser.add_argument("output", help="Output JSONL (appended to; existing ids are skipped)")
+    parser.add_argument("--batch-size", type=int, default=16, help="Maximum prompts per generate() call")
+    parser.add_argument("--bucket-tokens", type=int, default=64, help="Width of the prompt-length buckets")
+    args = parser.parse_args()
+
+    llm = LLM()
+    summary = run_batch_file(
+        llm,
+        args.input,
+        args.output,
+        batch_size=max(1, args.batch_size),
+        bucket_tokens=max(1, args.bucket_tokens),
+    )
+    print(f"✅ {json.dumps(summary)}")
+
+
+if __name__ == "__main__":
+    main()
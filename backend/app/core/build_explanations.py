@@ -0,0 +1,142 @@
+"""
+Offline build of the precomputed explanation store.
+
+Generates an explanation for every data structure and operation combination
+known to the intent detector with the local model, using the same prompt
+templates and generation profiles as smart chat, and writes the versioned
+store the server loads at startup (``LLM_EXPLANATION_STORE_PATH``).
+
+The store is saved after every batch. Re-running the build resumes where it
+stopped; if the model, profiles or prompts changed, it starts over.
+
+Run this script directly:
+    python -m app.core.build_explanations
+    python -m app.core.build_explanations --batch-size 16 --rebuild
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List, Tuple
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
+
+from app.core.explanation_store import (
+    ExplanationStore,
+    all_explanation_keys,
+    explanation_key,
+    store_fingerprint,
+)
+from app.core.generation_profiles import profile_for_intent
+from app.core.intent_detector import Intent
+from app.utils.prompts import (
+    DS_EXPLANATION_PROMPT,
+    DS_OPERATION_EXPLANATION_PROMPT,
+    build_ds_prompt,
+)
+
+# The stored answers are generated for these canonical questions
+OVERVIEW_QUESTION = "Explain {data_structure}."
+OPERATIONS_QUESTION = "How does {operations} work in {data_structure}?"
+
+
+def build_question(data_structure: str, operations: Tuple[str, ...]) -> str:
+    if not operations:
+        return OVERVIEW_QUESTION.format(data_structure=data_structure)
+    return OPERATIONS_QUESTION.format(data_structure=data_structure, operations=", ".join(operations))
+
+
+def build_store(llm, output: str, batch_size: int, rebuild: bool = False) -> ExplanationStore:
+    """
+    Generate every missing explanation and save the store after each batch.
+
+    Args:
+        llm: A loaded ``LLM``.
+        output: Path of the store file.
+        batch_size: Prompts handed to the backend per batch.
+        rebuild: Regenerate everything even if the store is current.
+
+    Returns:
+        The finished store.
+    """
+    intents = [
+        Intent(is_ds_query=True, data_structure=name, operations=list(ops) or None)
+        for name, ops in all_explanation_keys()
+    ]
+    profiles = {profile_for_intent(intent) for intent in intents}
+    fingerprint = store_fingerprint(
+        llm.model_name,
+        {profile.name: llm._generation_config(profile) for profile in profiles},
+        [DS_EXPLANATION_PROMPT, DS_OPERATION_EXPLANATION_PROMPT, OVERVIEW_QUESTION, OPERATIONS_QUESTION],
+    )
+
+    store = ExplanationStore(output)
+    if rebuild or not store.is_current(fingerprint):
+        if store.entries:
+            print(f"Discarding {len(store.entries)} explanations built with other settings.")
+        store.entries = {}
+    store.fingerprint = fingerprint
+    store.metadata = {
+        "model": llm.model_name,
+        "backend": llm.backend.name,
+        "built": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    todo = [
+        intent for intent in intents
+        if explanation_key(intent.data_structure, intent.operations) not in store.entries
+    ]
+    print(f"{len(intents)} explanations in total, {len(todo)} to generate.")
+
+    # generate_batch takes one profile per call, so batch within each profile
+    done = 0
+    start = time.perf_counter()
+    for profile in sorted(profiles, key=lambda p: p.name):
+        group = [intent for intent in todo if profile_for_intent(intent) == profile]
+        for i in range(0, len(group), batch_size):
+            batch: List[Intent] = group[i:i + batch_size]
+            prompts = [
+                build_ds_prompt(
+                    build_question(intent.data_structure, tuple(intent.operations or ())),
+                    intent.data_structure,
+                    intent.operations,
+                )[0]
+                for intent in batch
+            ]
+            texts = llm.generate_batch(prompts, profile=profile)
+            for intent, text in zip(batch, texts):
+                if text:
+                    store.put(intent.data_structure, intent.operations, text)
+            store.save(output)
+
+            done += len(batch)
+            elapsed = time.perf_counter() - start
+            print(f"  {done}/{len(todo)} generated ({elapsed:.0f}s elapsed)")
+
+    store.save(output)
+    return store
+
+
+def main():
+    from app.core.llm import LLM, LLMSettings
+
+    settings = LLMSettings()
+    parser = argparse.ArgumentParser(description="Precompute smart-chat explanations with the local model")
+    parser.add_argument("--output", default=settings.explanation_store_path, help="Store file to write")
+    parser.add_argument("--batch-size", type=int, default=settings.max_batch_size, help="Prompts per batch")
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate every explanation")
+    args = parser.parse_args()
+
+    if not args.output:
+        print("No output path; set --output or LLM_EXPLANATION_STORE_PATH.")
+        sys.exit(1)
+
+    llm = LLM(settings)
+    store = build_store(llm, args.output, max(1, args.batch_size), args.rebuild)
+    print(f"✅ Wrote {len(store)} explanations to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Per-conversation KV cache.
+
+A multi-turn conversation re-sends its whole transcript every turn. This
+module keeps the ``past_key_values`` of each conversation's last turn
+(prompt plus answer) so the scheduler only has to prefill what was added
+since: the new user message.
+
+Each conversation's entry is capped at a token budget, entries unused for
+longer than the idle timeout are dropped, and the least recently used
+conversations are evicted once all entries together exceed the memory cap.
+
+Entries live in a paged pool (``app.core.paged_kv``). A new turn forks the
+previous turn's page table, so only the new message and answer are
+written, and conversations share the pages of their common preamble.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.paged_kv import LegacyCache, PagedKVPool, PageTable, PoolFullError
+
+
+class ConversationKVCache:
+    """KV states of recent conversation turns, one entry per conversation."""
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_tokens: int,
+        idle_seconds: float,
+        page_tokens: int = 16,
+        quantized: bool = False,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes: Memory cap for all conversations together.
+            max_tokens: Longest sequence kept per conversation.
+            idle_seconds: Entries unused for this long are dropped.
+            page_tokens: Positions per KV page.
+            quantized: Keep the KV states in int8 with per-head scales.
+        """
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.idle_seconds = idle_seconds
+        self.pool = PagedKVPool(max_bytes, page_tokens, quantized)
+        # Stored from the scheduler's worker, released from request handlers
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[PageTable, float]]" = OrderedDict()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "tokens_reused": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "over_budget": 0,
+        }
+
+    def lookup(self, conversation_id: str, input_ids: List[int]) -> Tuple[int, Optional[LegacyCache]]:
+        """
+        Find the part of ``input_ids`` whose KV state the conversation already holds.
+
+        The new prompt normally starts with the last turn's prompt and answer,
+        but the answer may tokenize differently once it is part of the text,
+        so the longest common token prefix is used. At least one prompt token
+        is always left over so the model has something to prefill.
+
+        Returns:
+            Tuple of (reused length, KV for that many tokens) or (0, None) on a miss.
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self._stats["misses"] += 1
+                return 0, None
+
+            table = entry[0]
+            limit = min(len(table), len(input_ids) - 1)
+            length = 0
+            while length < limit and table.token_ids[length] == input_ids[length]:
+                length += 1
+            if not length:
+                self._stats["misses"] += 1
+                return 0, None
+
+            self._entries[conversation_id] = (table, time.monotonic())
+            self._entries.move_to_end(conversation_id)
+            self._stats["hits"] += 1
+            self._stats["tokens_reused"] += length
+            return length, self.pool.gather(table, length)
+
+    def store(self, conversation_id: str, token_ids: List[int], cache: LegacyCache):
+        """Keep the KV state for ``token_ids``, replacing the conversation's previous turn."""
+        with self._lock:
+            if len(token_ids) > self.max_tokens:
+                # The previous turn is still a valid prefix, so leave it
+                self._stats["over_budget"] += 1
+                return
+
+            # Share the pages of the previous turn's common prefix; only the rest is written
+            previous = self._entries.get(conversation_id)
+            while True:
+                try:
+                    table = self.pool.allocate(token_ids, cache, base=previous[0] if previous else None)
+                    break
+                except PoolFullError:
+                    if not self._entries:
+                        self._stats["over_budget"] += 1
+                        return
+                    self._remove(next(iter(self._entries)))
+                    self._stats["evictions"] += 1
+
+            self._remove(conversation_id)
+            self._entries[conversation_id] = (table, time.monotonic())
+
+    def release(self, conversation_id: str):
+        """Drop a conversation's KV state (e.g. when the conversation is closed)."""
+        with self._lock:
+            self._remove(conversation_id)
+
+    def _remove(self, conversation_id: str):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self.pool.free(entry[0])
+
+    def _expire(self):
+        """Drop idle entries (call with the lock held)."""
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._entries:
+            conversation_id, entry = next(iter(self._entries.items()))
+            if entry[1] > cutoff:
+                break
+            self._remove(conversation_id)
+            self._stats["expirations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and memory usage."""
+        with self._lock:
+            self._expire()
+            lookups = self._stats["hits"] + self._stats["misses"]
+            pages = self.pool.stats()
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "conversations": len(self._entries),
+                "bytes": pages["bytes"],
+                "max_bytes": self.max_bytes,
+                "pages": pages,
+            }
+
@@ -0,0 +1,153 @@
+"""
+Multi-turn conversation sessions.
+
+Holds the transcript of each open conversation so a follow-up ("now show me
+deletion") is answered with the earlier turns in context. The KV state of
+those turns is kept by the backend (``app.core.conversation_cache``);
+together they let a new turn prefill only the new message.
+
+Conversations unused for longer than the idle timeout are closed, and the
+least recently used one is closed when the store is full. However a
+conversation is closed, the store's ``on_close`` callback then frees its
+kept KV state.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class Conversation:
+    """Transcript of one conversation: (prompt, answer) pairs in order."""
+    id: str
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+
+    def add_turn(self, prompt: str, answer: str):
+        self.turns.append((prompt, answer))
+
+
+class ConversationStore:
+    """Open conversations, by id."""
+
+    def __init__(
+        self,
+        idle_seconds: float,
+        max_conversations: int,
+        on_close: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        Initialize the store.
+
+        Args:
+            idle_seconds: Conversations unused for this long are closed.
+            max_conversations: Open conversations; the least recently used
+                one is closed to make room for a new one.
+            on_close: Called with the id of every conversation closed,
+                expired or evicted (outside the store's lock).
+        """
+        self.idle_seconds = idle_seconds
+        self.max_conversations = max_conversations
+        self.on_close = on_close
+        self._lock = threading.Lock()
+        self._conversations: "OrderedDict[str, Tuple[Conversation, float]]" = OrderedDict()
+        self._stats = {"created": 0, "closed": 0, "expired": 0, "evicted": 0}
+
+    def create(self) -> Conversation:
+        """Open a new, empty conversation."""
+        conversation = Conversation(id=uuid.uuid4().hex)
+        with self._lock:
+            closed = self._expire()
+            while len(self._conversations) >= self.max_conversations:
+                closed.append(self._conversations.popitem(last=False)[0])
+                self._stats["evicted"] += 1
+            self._conversations[conversation.id] = (conversation, time.monotonic())
+            self._stats["created"] += 1
+        self._closed(closed)
+        return conversation
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        """Return an open conversation (and mark it used), or None if unknown or expired."""
+        with self._lock:
+            closed = self._expire()
+            entry = self._conversations.get(conversation_id)
+            if entry is not None:
+                self._conversations[conversation_id] = (entry[0], time.monotonic())
+                self._conversations.move_to_end(conversation_id)
+        self._closed(closed)
+        return None if entry is None else entry[0]
+
+    def close(self, conversation_id: str) -> bool:
+        """Close a conversation. Returns False if it wasn't open."""
+        with self._lock:
+            if self._conversations.pop(conversation_id, None) is None:
+                return False
+            self._stats["closed"] += 1
+        self._closed([conversation_id])
+        return True
+
+    def _expire(self) -> List[str]:
+        """Close idle conversations (call with the lock held). Returns their ids."""
+        cutoff = time.monotonic() - self.idle_seconds
+        expired = []
+        while self._conversations:
+            conversation_id, (_, last_used) = next(iter(self._conversations.items()))
+            if last_used > cutoff:
+                break
+            del self._conversations[conversation_id]
+            self._stats["expired"] += 1
+            expired.append(conversation_id)
+        return expired
+
+    def _closed(self, conversation_ids: List[str]):
+        """Run ``on_close`` for conversations just closed (call without the lock)."""
+        if self.on_close is None:
+            return
+        for conversation_id in conversation_ids:
+            try:
+                self.on_close(conversation_id)
+            except Exception as e:
+                print(f"[CONVERSATIONS] Releasing {conversation_id} failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            closed = self._expire()
+            stats = {
+                "open": len(self._conversations),
+                **self._stats,
+            }
+        self._closed(closed)
+        return stats
+
+
+# Shared instance (lazy-loaded)
+_store: Optional[ConversationStore] = None
+_store_lock = threading.Lock()
+
+
+def _release_kv_state(conversation_id: str):
+    """Free the KV state the backend kept for a conversation (if the model is loaded)."""
+    from app.core.llm import get_loaded_llm
+
+    llm = get_loaded_llm()
+    if llm is not None:
+        llm.end_conversation(conversation_id)
+
+
+def get_conversation_store() -> ConversationStore:
+    """Get the shared conversation store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            from app.core.llm import LLMSettings
+
+            settings = LLMSettings()
+            _store = ConversationStore(
+                idle_seconds=settings.conversation_idle_seconds,
+                max_conversations=max(1, settings.max_conversations),
+                on_close=_release_kv_state,
+            )
+    return _store
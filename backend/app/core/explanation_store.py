@@ -0,0 +1,174 @@
+"""
+Precomputed explanation store.
+
+Explanations for every data structure and operation combination known to
+``app.core.intent_detector`` are generated offline with the local model
+(``python -m app.core.build_explanations``) and written to a versioned JSON
+file. The server loads it once at startup and answers matching smart-chat
+questions straight from memory, with no LLM call.
+
+Each store records the model, generation profiles and prompt templates it
+was built with (its fingerprint). A store whose fingerprint no longer
+matches is still served, but a rebuild is suggested.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Bump when the file layout changes; older files are ignored
+STORE_FORMAT_VERSION = 1
+
+
+def explanation_key(data_structure: str, operations: Optional[Iterable[str]] = None) -> str:
+    """Store key for a data structure and (order-insensitive) set of operations."""
+    ops = sorted(set(operations or ()))
+    return f"{data_structure}|{'+'.join(ops)}"
+
+
+def store_fingerprint(model_name: str, generation_config: Dict[str, Any], templates: Iterable[str]) -> str:
+    """Hash of everything that determines the stored text."""
+    payload = json.dumps(
+        {"model": model_name, "config": generation_config, "templates": list(templates)},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class ExplanationStore:
+    """In-memory view of a precomputed explanation file."""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Initialize the store.
+
+        Args:
+            path: JSON file to load. Missing or unreadable files give an empty store.
+        """
+        self.path = path
+        self.fingerprint: Optional[str] = None
+        self.metadata: Dict[str, Any] = {}
+        self.entries: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+        if path:
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    # -------------------------
+    # FILE I/O
+    # -------------------------
+    def load(self, path: str):
+        """Replace the contents with the store at ``path``."""
+        if not os.path.exists(path):
+            print(f"[EXPLANATIONS] No store at {path}; build one with python -m app.core.build_explanations")
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[EXPLANATIONS] Could not read {path}: {e}")
+            return
+
+        if data.get("format_version") != STORE_FORMAT_VERSION:
+            print(
+                f"[EXPLANATIONS] {path} has format version {data.get('format_version')}, "
+                f"expected {STORE_FORMAT_VERSION}; ignoring it"
+            )
+            return
+
+        self.fingerprint = data.get("fingerprint")
+        self.metadata = data.get("metadata", {})
+        self.entries = dict(data.get("entries", {}))
+        print(f"[EXPLANATIONS] Loaded {len(self.entries)} explanations from {path}")
+
+    def save(self, path: str):
+        """Write the store to ``path`` atomically (a crash never leaves a half-written file)."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        data = {
+            "format_version": STORE_FORMAT_VERSION,
+            "fingerprint": self.fingerprint,
+            "metadata": self.metadata,
+            "entries": dict(sorted(self.entries.items())),
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def is_current(self, fingerprint: str) -> bool:
+        """True if the store was built with the given fingerprint."""
+        return self.fingerprint == fingerprint
+
+    # -------------------------
+    # LOOKUPS
+    # -------------------------
+    def get(self, data_structure: str, operations: Optional[List[str]] = None) -> Optional[str]:
+        """
+        Look up the explanation for a data structure and operations.
+
+        Returns:
+            The stored text, or None if this combination wasn't built.
+        """
+        text = self.entries.get(explanation_key(data_structure, operations))
+        with self._lock:
+            self._stats["hits" if text is not None else "misses"] += 1
+        return text
+
+    def put(self, data_structure: str, operations: Optional[List[str]], text: str):
+        self.entries[explanation_key(data_structure, operations)] = text
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                **self._stats,
+            }
+
+
+def all_explanation_keys() -> List[Tuple[str, Tuple[str, ...]]]:
+    """
+    Every (data structure, operations) combination the intent detector knows.
+
+    Each data structure gets an overview (no operations) plus one entry for
+    every non-empty subset of its known operations.
+    """
+    from itertools import combinations
+
+    from app.core.intent_detector import DS_NAME_MAPPING, DS_OPERATIONS
+
+    names = list(dict.fromkeys([*DS_NAME_MAPPING.values(), *DS_OPERATIONS]))
+    keys: List[Tuple[str, Tuple[str, ...]]] = []
+    for name in names:
+        keys.append((name, ()))
+        operations = sorted(set(DS_OPERATIONS.get(name, [])))
+        for size in range(1, len(operations) + 1):
+            keys.extend((name, combo) for combo in combinations(operations, size))
+    return keys
+
+
+# Shared instance (loaded at startup)
+_store: Optional[ExplanationStore] = None
+_store_lock = threading.Lock()
+
+
+def get_explanation_store() -> ExplanationStore:
+    """Get the shared explanation store (loads it on first use)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            from app.core.llm import LLMSettings
+
+            _store = ExplanationStore(LLMSettings().explanation_store_path or None)
+    return _store
@@ -0,0 +1,58 @@
+"""
+Generation profiles.
+
+Each route/intent gets its own token budget and end markers instead of
+the same 400-token cap for everything. The DS explanation prompts already
+ask for a fixed number of paragraphs, so those profiles also stop once
+the answer has written them.
+"""
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    from app.core.intent_detector import Intent
+
+# The model sometimes starts a new turn (or echoes the template) after answering
+TURN_STOP_SEQUENCES = ("\nUser:", "\nUser's question:", "\nYour explanation:")
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """Token budget and stop conditions for one kind of request."""
+    name: str
+    max_new_tokens: Optional[int] = None  # None uses LLMSettings.max_new_tokens
+    stop_sequences: Tuple[str, ...] = TURN_STOP_SEQUENCES
+    max_paragraphs: Optional[int] = None  # Stop after this many paragraphs
+
+
+# Open-ended coding questions keep the full budget
+GENERAL_PROFILE = GenerationProfile(name="general")
+
+# DS_EXPLANATION_PROMPT asks for 2-3 paragraphs
+EXPLANATION_PROFILE = GenerationProfile(
+    name="explanation",
+    max_new_tokens=320,
+    max_paragraphs=3,
+)
+
+# DS_OPERATION_EXPLANATION_PROMPT asks for 1-2 paragraphs
+OPERATION_PROFILE = GenerationProfile(
+    name="operation",
+    max_new_tokens=200,
+    max_paragraphs=2,
+)
+
+PROFILES = {
+    profile.name: profile
+    for profile in (GENERAL_PROFILE, EXPLANATION_PROFILE, OPERATION_PROFILE)
+}
+
+
+def profile_for_intent(intent: Optional["Intent"]) -> GenerationProfile:
+    """Pick the generation profile for a detected intent."""
+    if intent is None or not intent.is_ds_query or not intent.data_structure:
+        return GENERAL_PROFILE
+    if intent.operations:
+        return OPERATION_PROFILE
+    return EXPLANATION_PROFILE
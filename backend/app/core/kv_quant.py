@@ -0,0 +1,159 @@
+"""
+Int8 KV-cache quantization.
+
+Keys and values are stored as int8 with one scale per attention head and
+position (the absolute maximum over the head dimension maps to 127). That
+is a quarter of the float32 memory (half of float16) plus a small scale
+overhead, so long answers and kept conversation turns take far less room.
+
+``Int8KVCache`` is a drop-in ``DynamicCache`` for the scheduler's running
+batch: new states are quantized as they are appended, and each layer is
+dequantized on the fly for attention. Sequences join and leave the batch
+through row helpers that work on the int8 tensors and scales directly, so
+the batch never exists as a full-precision copy. The paged pool
+(``app.core.paged_kv``) uses the same functions for the KV it keeps
+between requests.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+
+def quantize_int8(states: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Quantize (..., head_dim) states to int8.
+
+    Returns:
+        The int8 tensor and the scales, shaped (..., 1) in the input dtype.
+    """
+    scales = states.abs().amax(dim=-1, keepdim=True) / 127
+    # All-zero vectors (left padding) would divide by zero
+    quantized = torch.round(states / scales.clamp(min=1e-8)).clamp(-127, 127).to(torch.int8)
+    return quantized, scales
+
+
+def dequantize_int8(quantized: torch.Tensor, scales: torch.Tensor) -> torch.Tensor:
+    """Inverse of ``quantize_int8`` (in the scales' dtype)."""
+    return quantized.to(scales.dtype) * scales
+
+
+def kv_cache_nbytes(cache: DynamicCache) -> int:
+    """Memory held by a dynamic (or int8) KV cache, in bytes."""
+    tensors = [*cache.key_cache, *cache.value_cache]
+    if isinstance(cache, Int8KVCache):
+        tensors += [*cache.key_scales, *cache.value_scales]
+    return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+
+
+def _left_pad_positions(states: torch.Tensor, length: int) -> torch.Tensor:
+    """Zero-pad (batch, heads, seq, dim) states on the left up to ``length`` positions."""
+    missing = length - states.shape[-2]
+    if missing <= 0:
+        return states
+    shape = list(states.shape)
+    shape[-2] = missing
+    return torch.cat([torch.zeros(shape, dtype=states.dtype, device=states.device), states], dim=-2)
+
+
+class Int8KVCache(DynamicCache):
+    """``DynamicCache`` that keeps keys and values as int8 with per-head scales."""
+
+    # Per-layer tensor lists, all laid out as (batch, heads, seq, dim)
+    _STATES = ("key_cache", "value_cache", "key_scales", "value_scales")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Same layout as the states, with a head_dim of 1
+        self.key_scales: List[torch.Tensor] = []
+        self.value_scales: List[torch.Tensor] = []
+
+    def __getitem__(self, layer_idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        if layer_idx >= len(self):
+            raise KeyError(f"Cache only has {len(self)} layers, attempted to access layer with index {layer_idx}")
+        return self._dequantized(layer_idx)
+
+    def __iter__(self):
+        for layer_idx in range(len(self)):
+            yield self._dequantized(layer_idx)
+
+    def _dequantized(self, layer_idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        return (
+            dequantize_int8(self.key_cache[layer_idx], self.key_scales[layer_idx]),
+            dequantize_int8(self.value_cache[layer_idx], self.value_scales[layer_idx]),
+        )
+
+    def update(
+        self,
+        key_states: torch.Tensor,
+        value_states: torch.Tensor,
+        layer_idx: int,
+        cache_kwargs: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Quantize and append new states; return the layer's full (dequantized) states."""
+        if layer_idx == 0:
+            self._seen_tokens += key_states.shape[-2]
+
+        keys, key_scales = quantize_int8(key_states)
+        values, value_scales = quantize_int8(value_states)
+        if len(self.key_cache) <= layer_idx:
+            self.key_cache.append(keys)
+            self.value_cache.append(values)
+            self.key_scales.append(key_scales)
+            self.value_scales.append(value_scales)
+        else:
+            self.key_cache[layer_idx] = torch.cat([self.key_cache[layer_idx], keys], dim=-2)
+            self.value_cache[layer_idx] = torch.cat([self.value_cache[layer_idx], values], dim=-2)
+            self.key_scales[layer_idx] = torch.cat([self.key_scales[layer_idx], key_scales], dim=-2)
+            self.value_scales[layer_idx] = torch.cat([self.value_scales[layer_idx], value_scales], dim=-2)
+
+        return self._dequantized(layer_idx)
+
+    def to_legacy_cache(self) -> Tuple[Tuple[torch.Tensor, torch.Tensor], ...]:
+        """Dequantized copy in the legacy format (re-quantizing it is lossless)."""
+        return tuple(self._dequantized(layer_idx) for layer_idx in range(len(self)))
+
+    @classmethod
+    def cat_rows(cls, caches: List["Int8KVCache"], length: int) -> "Int8KVCache":
+        """Stack the rows of ``caches``, each left-padded to ``length`` positions."""
+        merged = cls()
+        for name in cls._STATES:
+            setattr(merged, name, [
+                torch.cat([_left_pad_positions(states, length) for states in layer], dim=0)
+                for layer in zip(*(getattr(cache, name) for cache in caches))
+            ])
+        merged._seen_tokens = length
+        return merged
+
+    def select_rows(self, index: torch.Tensor, start: int = 0) -> "Int8KVCache":
+        """The rows in ``index``, from position ``start`` on."""
+        selected = type(self)()
+        for name in self._STATES:
+            setattr(selected, name, [
+                states.index_select(0, index)[:, :, start:] for states in getattr(self, name)
+            ])
+        selected._seen_tokens = self.get_seq_length() - start
+        return selected
+
+    def row_legacy_cache(self, row: int, start: int, end: int) -> Tuple[Tuple[torch.Tensor, torch.Tensor], ...]:
+        """Dequantized positions ``start:end`` of one row, in the legacy format."""
+        return tuple(
+            (
+                dequantize_int8(self.key_cache[i][row:row + 1, :, start:end], self.key_scales[i][row:row + 1, :, start:end]),
+                dequantize_int8(self.value_cache[i][row:row + 1, :, start:end], self.value_scales[i][row:row + 1, :, start:end]),
+            )
+            for i in range(len(self))
+        )
+
+    def crop(self, max_length: int):
+        """Drop positions beyond ``max_length`` (negative: drop that many from the end)."""
+        if max_length < 0:
+            max_length = self.get_seq_length() - abs(max_length)
+        if self.get_seq_length() <= max_length:
+            return
+
+        self._seen_tokens = max_length
+        for states in (self.key_cache, self.value_cache, self.key_scales, self.value_scales):
+            for layer_idx in range(len(states)):
+                states[layer_idx] = states[layer_idx][..., :max_length, :]
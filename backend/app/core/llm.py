@@ -1,19 +1,155 @@
-from threading import Thread, Lock, Event
-from typing import Generator, List, Dict, Union, Optional
+from functools import lru_cache
+from collections import deque
+from threading import Event, Lock
+from typing import AsyncGenerator, Generator, List, Dict, NamedTuple, Union, Optional, Any, Tuple
+import re
 import time
 import sys
 
 import torch
+from pydantic_settings import BaseSettings
+from starlette.concurrency import run_in_threadpool
 from transformers import (
-    AutoModelForCausalLM,
     AutoTokenizer,
-    TextIteratorStreamer,
     StoppingCriteria,
     StoppingCriteriaList,
 )
+from transformers.generation.streamers import BaseStreamer
+
+from app.core.admission import AdmissionController
+from app.core.backends import create_backend
+from app.core.generation_profiles import GENERAL_PROFILE, GenerationProfile
+from app.core.request_queue import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_STANDARD
+from app.core.response_cache import ResponseCache, response_cache_key
+from app.core.scheduler import GenerationRequest
+from app.core.semantic_cache import SemanticCache, SemanticKey
+from app.core.streamers import AsyncTextStreamer, TextQueueStreamer
+from app.core.telemetry import GenerationTrace, get_generation_metrics
+
+# Plain text prompting (LOCKED): every prompt starts with this preamble
+PROMPT_PREAMBLE = "You are a helpful coding assistant.\n\nUser: "
+
+# Stands in for the middle of user content cut to fit the input token budget
+ELISION_MARKER = "\n\n[... middle of the input omitted ...]\n\n"
+
+# Finish reasons whose output is the full deterministic answer (safe to cache).
+# A repetition stop is a guess (it may have cut a legitimately repetitive
+# answer), so those answers are not kept
+CACHEABLE_FINISH_REASONS = ("eos", "length", "stop_sequence", "paragraph_limit")
+
+# Paragraphs shorter than this (headings, "**Key Operations:**") don't count
+# towards a profile's paragraph limit
+MIN_PARAGRAPH_CHARS = 40
+
+
+class LLMSettings(BaseSettings):
+    """Configuration settings for the local LLM."""
+    model_name: str = "Qwen/Qwen2.5-Coder-1.5B-Instruct"
+    max_new_tokens: int = 400
+    # Prompt tokens per request. Longer user content keeps its head and tail
+    # around an elision marker, which bounds the prefill cost (0 disables)
+    max_input_tokens: int = 4096
+    backend: str = "hf"  # "hf" (transformers) or "onnx" (ONNX Runtime, CPU)
+    onnx_model_dir: str = "./onnx_model"  # Output of python -m app.core.backends.onnx_export
+    max_batch_size: int = 8  # Sequences decoded together by the scheduler
+    # Prompt tokens prefilled between two decode steps, so a long prompt doesn't
+    # stall the running streams (0 prefills each prompt at once)
+    prefill_chunk_tokens: int = 512
+
+    # Priority classes: interactive streams > non-stream calls > background jobs
+    starvation_seconds: float = 10.0  # Queue wait after which any request goes next
+    reserved_interactive_slots: int = 1  # Batch slots kept free for interactive streams
+
+    # Admission control: reject with 429/503 instead of queueing without limit
+    max_queue_depth: int = 32  # Requests waiting for a batch slot (0 disables)
+    max_expected_wait_seconds: float = 30.0  # Estimated queue wait (0 disables)
+    prefix_cache_mb: int = 256  # KV memory for shared prompt prefixes (0 disables)
+    kv_page_tokens: int = 16  # Positions per page of cached KV memory
+    # "auto" keeps the KV cache in the model dtype; "int8" stores it as int8
+    # with per-head scales (about half of float16, a quarter of float32)
+    kv_cache_dtype: str = "auto"
+
+    # Speculative decoding (hf backend): a small draft model from the same
+    # tokenizer family, e.g. "Qwen/Qwen2.5-Coder-0.5B-Instruct". Empty disables.
+    draft_model_name: str = ""
+    num_draft_tokens: int = 4
+
+    # Device selection and CPU inference
+    device: str = "auto"  # "auto", "cuda" or "cpu"
+    cpu_quantization: str = "int8"  # "int8" (dynamic quantization of Linear layers) or "none"
+    cpu_num_threads: int = 0  # Intra-op threads (0 = torch default)
+    cpu_num_interop_threads: int = 0  # Inter-op threads (0 = torch default)
+    attn_implementation: str = "auto"  # "auto" picks sdpa on CPU, HF default on GPU
+
+    # Decode mode (hf backend): "eager", or "compiled" for a static KV cache plus
+    # a torch.compile'd decode step. Compiled mode decodes one sequence at a
+    # time, trading concurrent throughput for per-token latency.
+    decode_mode: str = "eager"
+    static_cache_max_length: int = 2048  # Prompt + answer tokens in compiled mode
+    warmup_on_startup: bool = True  # Run a short generation before serving
+
+    # Stop generations that loop ("stack stack stack", repeated paragraphs)
+    repetition_detection: bool = True
+    repetition_ngram_size: int = 4  # Tokens per n-gram used to spot a loop
+    repetition_max_repeats: int = 4  # Copies of the loop allowed before stopping
+    repetition_min_tokens: int = 200  # Ignore loops shorter than this in total (zero-filled arrays, table rules)
+
+    log_generation_summary: bool = True  # One [METRICS] line per finished generation
+
+    # Hedged smart-chat streams: if the first token takes longer than this,
+    # send the precomputed explanation instead (0 disables). With cache fill
+    # the model's answer finishes in the background for the response cache
+    # when nothing else is waiting; otherwise it is cancelled.
+    hedge_first_token_seconds: float = 1.5
+    hedge_cache_fill: bool = True
+
+    # Precomputed smart-chat explanations (python -m app.core.build_explanations).
+    # Empty disables.
+    explanation_store_path: str = "./explanation_store/explanations.json"
+
+    # Response cache (greedy decoding is deterministic)
+    response_cache_enabled: bool = True
+    response_cache_memory_mb: int = 32
+    response_cache_path: str = "./llm_cache/responses.sqlite3"  # Empty disables the disk tier
+    response_cache_disk_mb: int = 512
+    response_cache_ttl_hours: float = 24 * 7
+
+    # Semantic cache: answers rephrased questions whose embedding is close
+    # to one already answered with the same prompt template
+    semantic_cache_enabled: bool = True
+    semantic_cache_threshold: float = 0.9
+    semantic_cache_max_entries: int = 4096
+
+    # Conversation sessions (/api/smart-chat/sessions): each conversation's
+    # KV state is kept between turns, so a follow-up only prefills the new
+    # message. The transcript is trimmed to fit the token budget.
+    conversation_cache_mb: int = 512  # KV memory for all conversations (0 disables)
+    conversation_max_tokens: int = 2048  # Transcript plus answer, per conversation
+    conversation_idle_seconds: float = 900  # Conversations unused this long are dropped
+    max_conversations: int = 1000  # Open conversations; the least recently used is closed beyond this
+
+    class Config:
+        env_prefix = "LLM_"
+        env_file = ".env"
+        extra = "ignore"
+
+
+def _unseen_tokens(input_ids: torch.LongTensor, seen: int, **kwargs) -> Tuple[List[int], int]:
+    """
+    Tokens after position ``seen`` and the sequence length.
+
+    The scheduler passes only the tail of the sequence plus its full length
+    (``sequence_length``), so checks don't copy the prompt every step;
+    ``generate()`` passes the whole sequence.
+    """
+    length = kwargs.get("sequence_length") or input_ids.shape[-1]
+    start = max(0, input_ids.shape[-1] - max(0, length - seen))
+    return input_ids[0, start:].tolist(), length
 
 
 class CancellationCriteria(StoppingCriteria):
+    finish_reason = "cancelled"
+
     def __init__(self, cancel_event: Event):
         self.cancel_event = cancel_event
 
@@ -21,28 +157,348 @@ class CancellationCriteria(StoppingCriteria):
         return self.cancel_event.is_set()
 
 
+class DeadlineCriteria(StoppingCriteria):
+    """
+    Stops generation once the request's deadline has passed.
+
+    The deadline is an absolute ``time.perf_counter()`` value fixed when the
+    HTTP request arrived, so time spent queued counts against it. The
+    scheduler checks criteria before prefill too, so a request that expires
+    while queued never starts.
+    """
+    finish_reason = "deadline"
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        return time.perf_counter() >= self.deadline
+
+
+class RepetitionCriteria(StoppingCriteria):
+    """
+    Stops generation that has fallen into a loop.
+
+    Remembers where each n-gram of generated tokens last occurred. When
+    consecutive n-grams keep matching the ones ``period`` tokens earlier,
+    the output is repeating itself; once it has produced ``max_repeats``
+    copies of the loop, generation stops. Each new token costs one dict
+    lookup, however long the output gets.
+
+    Code legitimately repeats short runs of tokens (``[0, 0, 0, ...]``,
+    ``|---|---|``), so a loop only counts once it spans ``min_tokens``
+    tokens, and at least two full lines when it has newlines in it.
+    """
+    finish_reason = "repetition"
+
+    def __init__(
+        self,
+        prompt_length: int,
+        ngram_size: int = 4,
+        max_repeats: int = 4,
+        min_tokens: int = 200,
+        newline_ids: Tuple[int, ...] = (),
+    ):
+        self.seen = prompt_length
+        self.ngram_size = ngram_size
+        self.max_repeats = max_repeats
+        self.min_tokens = min_tokens
+        self.newline_ids = frozenset(newline_ids)
+        self.window = deque(maxlen=ngram_size)
+        self.newlines: List[int] = []  # Positions of the generated newline tokens
+        self.last_position: Dict[Tuple[int, ...], int] = {}
+        self.position = 0
+        self.period = 0
+        self.run = 0  # Consecutive n-grams that matched at the current period
+        self.triggered = False
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        if not self.triggered:
+            new_ids, self.seen = _unseen_tokens(input_ids, self.seen, **kwargs)
+            for token in new_ids:
+                if self._push(token):
+                    self.triggered = True
+                    print(f"[LLM] Repetition loop detected (period {self.period} tokens), stopping early")
+                    break
+        return self.triggered
+
+    def _push(self, token: int) -> bool:
+        self.window.append(token)
+        self.position += 1
+        if token in self.newline_ids:
+            self.newlines.append(self.position)
+        if len(self.window) < self.ngram_size:
+            return False
+
+        ngram = tuple(self.window)
+        previous = self.last_position.get(ngram)
+        self.last_position[ngram] = self.position
+        if previous is None:
+            self.period = 0
+            self.run = 0
+            return False
+
+        period = self.position - previous
+        if period == self.period:
+            self.run += 1
+        else:
+            self.period = period
+            self.run = 1
+
+        # The last run + ngram_size - 1 tokens each equal the token one
+        # period earlier, i.e. the loop has been written (span / period) + 1 times
+        span = self.run + self.ngram_size - 1
+        if span < (self.max_repeats - 1) * period or span + period < self.min_tokens:
+            return False
+        return self._covers_two_lines(span + period)
+
+    def _covers_two_lines(self, length: int) -> bool:
+        """True unless the last ``length`` tokens hold a newline but not two whole lines."""
+        start = self.position - length
+        inside = 0
+        for position in reversed(self.newlines):
+            if position <= start:
+                break
+            inside += 1
+            if inside > 2:
+                return True
+        return inside == 0
+
+
+class _TextStoppingCriteria(StoppingCriteria):
+    """Base for criteria that read the generated text incrementally, token by token."""
+
+    def __init__(self, tokenizer, prompt_length: int):
+        self.tokenizer = tokenizer
+        self.seen = prompt_length
+        self.triggered = False
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        if not self.triggered:
+            new_ids, self.seen = _unseen_tokens(input_ids, self.seen, **kwargs)
+            if new_ids:
+                self.triggered = self.feed(self.tokenizer.decode(new_ids, skip_special_tokens=True))
+        return self.triggered
+
+    def feed(self, text: str) -> bool:
+        """Consume newly generated text. Return True to stop."""
+        raise NotImplementedError
+
+
+class StopSequenceCriteria(_TextStoppingCriteria):
+    """Stops once any of the stop sequences appears in the output."""
+    finish_reason = "stop_sequence"
+
+    def __init__(self, tokenizer, prompt_length: int, stop_sequences: Tuple[str, ...]):
+        super().__init__(tokenizer, prompt_length)
+        self.stop_sequences = stop_sequences
+        self.window = max(len(stop) for stop in stop_sequences)
+        self.tail = ""
+
+    def feed(self, text: str) -> bool:
+        self.tail = (self.tail + text)[-(self.window + len(text)):]
+        found = any(stop in self.tail for stop in self.stop_sequences)
+        self.tail = self.tail[-self.window:]
+        return found
+
+
+class ParagraphLimitCriteria(_TextStoppingCriteria):
+    """Stops once the answer has written ``max_paragraphs`` paragraphs (blank lines inside code fences don't count)."""
+    finish_reason = "paragraph_limit"
+
+    def __init__(self, tokenizer, prompt_length: int, max_paragraphs: int):
+        super().__init__(tokenizer, prompt_length)
+        self.max_paragraphs = max_paragraphs
+        self.paragraphs = 0
+        self.content_chars = 0
+        self.newlines = 0
+        self.backticks = 0
+        self.in_code = False
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if ch == "`":
+                self.backticks += 1
+                if self.backticks == 3:
+                    self.in_code = not self.in_code
+                    self.backticks = 0
+            else:
+                self.backticks = 0
+
+            if ch == "\n":
+                self.newlines += 1
+                if self.newlines == 2 and not self.in_code:
+                    if self.content_chars >= MIN_PARAGRAPH_CHARS:
+                        self.paragraphs += 1
+                        if self.paragraphs >= self.max_paragraphs:
+                            return True
+                    self.content_chars = 0
+            elif not ch.isspace():
+                self.newlines = 0
+                self.content_chars += 1
+        return False
+
+
+def _trim_stop_sequences(text: str, stop_sequences: Tuple[str, ...]) -> str:
+    """Cut ``text`` at the first stop sequence."""
+    cut = len(text)
+    for stop in stop_sequences:
+        index = text.find(stop)
+        if index != -1:
+            cut = min(cut, index)
+    return text[:cut]
+
+
+def _question_embedder():
+    """The RAG store's embedding function (loads it on first use), so the semantic cache doesn't load a second copy."""
+    from app.db.chroma_store import get_chroma_store
+
+    return get_chroma_store().embedding_function
+
+
+def _embed_questions(texts: List[str]) -> List[List[float]]:
+    return _question_embedder()(texts)
+
+
+def _embedder_reads_all(text: str) -> bool:
+    """True if the embedding model sees all of ``text`` (it silently truncates past ``max_seq_length``)."""
+    model = _question_embedder().embedding_model
+    return len(model.tokenizer(text)["input_ids"]) <= model.max_seq_length
+
+
+class _StopSequenceFilter:
+    """
+    Filters streamed text so stop sequences never reach the client.
+
+    Text that could be the start of a stop sequence is held back until the
+    next chunk shows whether it is one. Everything after a stop sequence
+    is dropped.
+    """
+
+    def __init__(self, stop_sequences: Tuple[str, ...]):
+        self.stop_sequences = stop_sequences
+        self.buffer = ""
+        self.stopped = False
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk and return the text that is safe to send."""
+        if self.stopped:
+            return ""
+        self.buffer += chunk
+        trimmed = _trim_stop_sequences(self.buffer, self.stop_sequences)
+        if len(trimmed) < len(self.buffer):
+            self.stopped = True
+            self.buffer = ""
+            return trimmed
+
+        hold = 0
+        for stop in self.stop_sequences:
+            for size in range(min(len(stop) - 1, len(self.buffer)), hold, -1):
+                if self.buffer.endswith(stop[:size]):
+                    hold = size
+                    break
+        ready = self.buffer[:len(self.buffer) - hold]
+        self.buffer = self.buffer[len(self.buffer) - hold:]
+        return ready
+
+    def flush(self) -> str:
+        """Return whatever is still held back once the stream has ended."""
+        text, self.buffer = self.buffer, ""
+        return text
+
+
+class GenerationSession:
+    """
+    Handle for a single in-flight generation.
+
+    Owns the cancellation flag for exactly one request, so cancelling it
+    (e.g. because the client disconnected) never touches anyone else's
+    generation. An optional deadline (``time.perf_counter()`` seconds) stops
+    the generation when it passes; ``truncated`` then reports that the
+    answer was cut short. Setting ``conversation_id`` keeps the KV state of
+    the prompt and answer for that conversation's next turn, and
+    ``turn_prompt`` is then this turn's prompt as the model saw it (to be
+    recorded in the transcript). ``input_tokens_dropped`` counts the prompt
+    tokens cut to fit the input token budget.
+    """
+
+    def __init__(self, deadline: Optional[float] = None, conversation_id: Optional[str] = None):
+        self.cancel_event = Event()
+        self.deadline = deadline
+        self.conversation_id = conversation_id
+        self.finish_reason: Optional[str] = None  # Set once the generation ends
+        self.input_tokens_dropped = 0  # Cut from the prompt to fit the input budget
+        self.turn_prompt: Optional[str] = None  # Set by LLM.conversation_prompt
+        self.request: Optional[GenerationRequest] = None  # Set once the generation is submitted
+
+    @classmethod
+    def with_budget(cls, seconds: Optional[float]) -> "GenerationSession":
+        """A session whose deadline is ``seconds`` from now (None for no deadline)."""
+        return cls(None if seconds is None else time.perf_counter() + seconds)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    @property
+    def truncated(self) -> bool:
+        """True if the deadline cut the answer short (or stopped it from starting)."""
+        return self.finish_reason == DeadlineCriteria.finish_reason
+
+    def cancel(self):
+        """Stop this generation at the next decode step."""
+        self.cancel_event.set()
+
+    def detach(self) -> "GenerationSession":
+        """
+        Hand the running generation over to a new session.
+
+        Cancelling this session afterwards no longer stops the generation
+        (e.g. when a stream stops waiting for it but the answer should
+        still finish for the response cache). Returns the session that now
+        controls it.
+        """
+        detached = GenerationSession(self.deadline, self.conversation_id)
+        detached.cancel_event, self.cancel_event = self.cancel_event, Event()
+        detached.request = self.request
+        return detached
+
+    def drop_conversation(self):
+        """
+        Don't keep this generation's KV state for the conversation's next turn.
+
+        For answers that won't be recorded in the transcript (e.g. when the
+        client was sent other text instead). Works until the request finishes.
+        """
+        self.conversation_id = None
+        if self.request is not None:
+            self.request.conversation_id = None
+
+    def stopping_criteria(self) -> StoppingCriteriaList:
+        criteria = StoppingCriteriaList([CancellationCriteria(self.cancel_event)])
+        if self.deadline is not None:
+            criteria.append(DeadlineCriteria(self.deadline))
+        return criteria
+
+
+class ResponseLookup(NamedTuple):
+    """A prompt fitted to the input budget and what the response caches hold for it."""
+    prompt: str
+    response: Optional[str]  # Cached answer, or None on a miss
+    cache_key: Optional[str]
+    semantic_key: Optional[SemanticKey]
+
+
 class LLM:
-    # Class-level lock to prevent concurrent generations
-    _generation_lock = Lock()
-    _current_thread: Optional[Thread] = None
-    _cancel_event: Optional[Event] = None
-    
-    def __init__(self):
+    def __init__(self, settings: Optional[LLMSettings] = None):
         print("\n[LLM INIT] Initializing Model Loading Process...")
-        
-        # ---------------------------------------------------------
-        # GPU CHECK - Ensure we are actually using the RTX 3050
-        # ---------------------------------------------------------
-        if not torch.cuda.is_available():
-            print("[WARNING] CUDA/GPU is NOT available. Running on CPU will be slow.")
-            self.device_type = "cpu"
-        else:
-            gpu_name = torch.cuda.get_device_name(0)
-            print(f"[SUCCESS] CUDA/GPU detected: {gpu_name}")
-            print(f"[INFO] VRAM Available: {torch.cuda.get_device_properties(0).total_memory / 1024**3:.2f} GB")
-            self.device_type = "cuda"
+        self.settings = settings or LLMSettings()
 
-        self.model_name = "Qwen/Qwen2.5-Coder-1.5B-Instruct"
+        self.model_name = self.settings.model_name
 
         print(f"[LLM INIT] Loading Tokenizer: {self.model_name}")
         self.tokenizer = AutoTokenizer.from_pretrained(
@@ -50,62 +506,580 @@ class LLM:
             trust_remote_code=True,
         )
 
-        print(f"[LLM INIT] Loading Model to {self.device_type}...")
-        self.model = AutoModelForCausalLM.from_pretrained(
+        # Model execution (HF transformers by default, or ONNX Runtime)
+        self.backend = create_backend(self.settings, self.tokenizer)
+        self.device_type = self.backend.device_type
+
+        self._encode_prefix = lru_cache(maxsize=256)(self._encode)
+
+        # Tokens that contain a line break (for the repetition check's line count)
+        self._newline_ids: Tuple[int, ...] = ()
+        if self.settings.repetition_detection:
+            self._newline_ids = tuple(
+                token_id
+                for token_id, text in enumerate(
+                    self.tokenizer.batch_decode([[i] for i in range(len(self.tokenizer))])
+                )
+                if "\n" in text
+            )
+
+        self._input_lock = Lock()
+        self._input_stats = {"truncated_prompts": 0, "tokens_dropped": 0}
+
+        self.response_cache = None
+        if self.settings.response_cache_enabled:
+            self.response_cache = ResponseCache(
+                path=self.settings.response_cache_path or None,
+                memory_max_bytes=self.settings.response_cache_memory_mb * 1024**2,
+                disk_max_bytes=self.settings.response_cache_disk_mb * 1024**2,
+                ttl_seconds=self.settings.response_cache_ttl_hours * 3600,
+            )
+
+        self.semantic_cache = None
+        if self.settings.semantic_cache_enabled:
+            self.semantic_cache = SemanticCache(
+                embed=_embed_questions,
+                threshold=self.settings.semantic_cache_threshold,
+                max_entries=self.settings.semantic_cache_max_entries,
+            )
+
+        get_generation_metrics().log_summaries = self.settings.log_generation_summary
+        self.admission = AdmissionController(
+            get_generation_metrics(),
+            max_queue_depth=self.settings.max_queue_depth,
+            max_expected_wait_seconds=self.settings.max_expected_wait_seconds,
+        )
+        print("---------------------------------------------------------")
+
+    @staticmethod
+    def _format_prompt(prompt: str) -> str:
+        # Enforce plain text prompting (LOCKED)
+        return f"{PROMPT_PREAMBLE}{prompt}\nAssistant:\n"
+
+    def _encode(self, text: str) -> Tuple[int, ...]:
+        return tuple(self.tokenizer(text).input_ids)
+
+    def conversation_prompt(
+        self,
+        turns: List[Tuple[str, str]],
+        prompt: str,
+        question: Optional[str] = None,
+        session: Optional[GenerationSession] = None,
+    ) -> str:
+        """
+        Prompt for the next turn of a conversation.
+
+        Earlier (prompt, answer) turns come first, in the same format the
+        model saw them, so the conversation's kept KV state still matches.
+        ``prompt`` itself is fitted to the input budget first (see
+        ``fit_input``), and the fitted text is left in ``session.turn_prompt``
+        so the transcript records what the KV state was built from. The
+        oldest turns are dropped while the transcript plus an answer would
+        exceed ``conversation_max_tokens``.
+        """
+        prompt = self.fit_input(prompt, question, session)
+        if session is not None:
+            session.turn_prompt = prompt
+        budget = self.settings.conversation_max_tokens - self.settings.max_new_tokens
+        if self.settings.max_input_tokens > 0:
+            budget = min(budget, self.settings.max_input_tokens)
+        turns = list(turns)
+        while True:
+            history = "".join(f"{user}\nAssistant:\n{answer}\n\nUser: " for user, answer in turns)
+            if not turns or len(self._encode(self._format_prompt(history + prompt))) <= budget:
+                return history + prompt
+            turns.pop(0)
+
+    def fit_input(
+        self,
+        prompt: str,
+        question: Optional[str] = None,
+        session: Optional[GenerationSession] = None,
+    ) -> str:
+        """
+        Cut ``prompt`` to ``max_input_tokens`` (preamble included).
+
+        Only the user content is shortened: ``question`` if it is part of the
+        prompt, else the whole prompt. Its head and tail are kept around
+        ``ELISION_MARKER``; the instruction scaffold around it stays intact.
+        Prompts within the budget come back unchanged, so fitting twice is
+        harmless.
+
+        Args:
+            prompt: The user prompt.
+            question: The user's content inside ``prompt`` (e.g. the message
+                inside a template).
+            session: Gets the number of dropped tokens added to its
+                ``input_tokens_dropped``.
+        """
+        budget = self.settings.max_input_tokens
+        length = len(self._encode(self._format_prompt(prompt)))
+        if budget <= 0 or length <= budget:
+            return prompt
+
+        content = question if question and question in prompt else prompt
+        start = prompt.rfind(content)
+        before, after = prompt[:start], prompt[start + len(content):]
+        content_ids = self.tokenizer(content, add_special_tokens=False).input_ids
+        marker_tokens = len(self.tokenizer(ELISION_MARKER, add_special_tokens=False).input_ids)
+
+        # Tokens split differently at the seams, so re-check the fitted prompt
+        keep = len(content_ids) - (length - budget) - marker_tokens
+        while keep > 0:
+            tail = keep // 2
+            fitted = (
+                before
+                + self.tokenizer.decode(content_ids[:keep - tail])
+                + ELISION_MARKER
+                + self.tokenizer.decode(content_ids[len(content_ids) - tail:])
+                + after
+            )
+            length = len(self._encode(self._format_prompt(fitted)))
+            if length <= budget:
+                break
+            keep -= length - budget
+        else:
+            keep = 0
+            fitted = before + ELISION_MARKER.strip("\n") + after
+            print(f"[WARNING] Prompt scaffold alone exceeds max_input_tokens ({budget}); dropped all user content")
+
+        dropped = len(content_ids) - keep
+        print(f"[LLM] Prompt over the input budget: dropped {dropped} of {len(content_ids)} content tokens")
+        with self._input_lock:
+            self._input_stats["truncated_prompts"] += 1
+            self._input_stats["tokens_dropped"] += dropped
+        if session is not None:
+            session.input_tokens_dropped += dropped
+        return fitted
+
+    def end_conversation(self, conversation_id: str):
+        """Free the KV state kept for a conversation."""
+        self.backend.release_conversation(conversation_id)
+
+    def _prefix_lengths(
+        self,
+        input_ids: List[int],
+        prompt: str,
+        cacheable_prefix: Optional[str],
+    ) -> List[int]:
+        """Token lengths of the shared prefixes of ``input_ids`` (preamble, template scaffold)."""
+        prefixes = [PROMPT_PREAMBLE]
+        if cacheable_prefix and prompt.startswith(cacheable_prefix):
+            prefixes.append(PROMPT_PREAMBLE + cacheable_prefix)
+
+        lengths = set()
+        for prefix in prefixes:
+            prefix_ids = self._encode_prefix(prefix)
+            # The prefix may tokenize differently at its boundary on its own,
+            # so only the part that matches the full prompt is shared
+            length = 0
+            for a, b in zip(prefix_ids, input_ids):
+                if a != b:
+                    break
+                length += 1
+            if length:
+                lengths.add(length)
+        return sorted(lengths)
+
+    def _build_request(
+        self,
+        prompt: str,
+        stopping_criteria: Optional[StoppingCriteriaList] = None,
+        streamer: Optional[BaseStreamer] = None,
+        cacheable_prefix: Optional[str] = None,
+        profile: GenerationProfile = GENERAL_PROFILE,
+        priority: str = PRIORITY_STANDARD,
+        session: Optional[GenerationSession] = None,
+    ) -> GenerationRequest:
+        trace = GenerationTrace(label=profile.name)
+        input_ids = self.tokenizer(self._format_prompt(prompt)).input_ids
+        prefix_lengths = self._prefix_lengths(input_ids, prompt, cacheable_prefix)
+        trace.tokenize_seconds = time.perf_counter() - trace.created
+        trace.prompt_tokens = len(input_ids)
+
+        criteria = StoppingCriteriaList(stopping_criteria or [])
+        if self.settings.repetition_detection:
+            criteria.append(RepetitionCriteria(
+                len(input_ids),
+                ngram_size=self.settings.repetition_ngram_size,
+                max_repeats=self.settings.repetition_max_repeats,
+                min_tokens=self.settings.repetition_min_tokens,
+                newline_ids=self._newline_ids,
+            ))
+        if profile.stop_sequences:
+            criteria.append(StopSequenceCriteria(self.tokenizer, len(input_ids), profile.stop_sequences))
+        if profile.max_paragraphs:
+            criteria.append(ParagraphLimitCriteria(self.tokenizer, len(input_ids), profile.max_paragraphs))
+
+        request = GenerationRequest(
+            input_ids=input_ids,
+            max_new_tokens=self._max_new_tokens(profile),
+            stopping_criteria=criteria,
+            streamer=streamer,
+            prefix_lengths=prefix_lengths,
+            priority=priority,
+            conversation_id=session.conversation_id if session is not None else None,
+            trace=trace,
+        )
+        if session is not None:
+            session.request = request
+        return request
+
+    def _max_new_tokens(self, profile: GenerationProfile) -> int:
+        if profile.max_new_tokens is None:
+            return self.settings.max_new_tokens
+        return min(profile.max_new_tokens, self.settings.max_new_tokens)
+
+    def _generation_config(self, profile: GenerationProfile) -> Dict[str, Any]:
+        """Settings that affect the generated text (part of the response cache key)."""
+        return {
+            "max_new_tokens": self._max_new_tokens(profile),
+            "stop_sequences": list(profile.stop_sequences),
+            "max_paragraphs": profile.max_paragraphs,
+            "repetition": (
+                [
+                    self.settings.repetition_ngram_size,
+                    self.settings.repetition_max_repeats,
+                    self.settings.repetition_min_tokens,
+                ]
+                if self.settings.repetition_detection else None
+            ),
+            "do_sample": False,
+            **self.backend.describe(),
+        }
+
+    def _cache_key(self, prompt: str, profile: GenerationProfile) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        return response_cache_key(
             self.model_name,
-            device_map="cuda",  # <--- FORCES GPU OR CRASHES
-            torch_dtype=torch.float16 if self.device_type == "cuda" else torch.float32,
-            trust_remote_code=True,
+            self._generation_config(profile),
+            self._format_prompt(prompt),
         )
 
-        self.model.eval()
-        print(f"[LLM INIT] Model loaded successfully on device: {self.model.device}")
-        print("---------------------------------------------------------")
-    
-    @classmethod
-    def cancel_current_generation(cls):
-        """Cancel any ongoing generation."""
-        # print("[DEBUG] cancel_current_generation called")
-        if cls._cancel_event:
-            # print("[DEBUG] Setting cancel event")
-            cls._cancel_event.set()
-        
-        if cls._current_thread and cls._current_thread.is_alive():
-            print(f"[DEBUG] Waiting for current thread {cls._current_thread.name} to join...")
-            cls._current_thread.join(timeout=2)
-            
-        cls._current_thread = None
-        cls._cancel_event = None
+    def _semantic_key(
+        self,
+        prompt: str,
+        profile: GenerationProfile,
+        question: Optional[str] = None,
+    ) -> Optional[SemanticKey]:
+        """
+        Embed the question inside ``prompt`` for the semantic cache.
+
+        The namespace hashes everything but the question (model, generation
+        config and the formatted prompt around it), so only answers produced
+        from the same template and context can match.
+
+        Only an explicit ``question`` short enough for the embedding model
+        is looked up: a whole prompt (e.g. pasted code) would be cut to its
+        first few hundred tokens, and two pastes that start alike would match.
+        """
+        if self.semantic_cache is None or not question or not question.strip():
+            return None
+        full_prompt = self._format_prompt(prompt)
+        if question not in full_prompt:
+            return None
+        namespace = response_cache_key(
+            self.model_name,
+            self._generation_config(profile),
+            full_prompt.replace(question, "{question}", 1),
+        )
+        try:
+            _question_embedder()
+        except Exception as e:
+            # Without the model there is nothing to look up for the rest of the run
+            print(f"[WARNING] Semantic cache disabled, embedding model failed to load: {e}")
+            self.semantic_cache = None
+            return None
+        try:
+            if not _embedder_reads_all(question):
+                return None
+            return self.semantic_cache.key(namespace, question)
+        except Exception as e:
+            # One bad input (or a transient error) only skips this lookup
+            print(f"[WARNING] Semantic cache skipped, embedding failed: {e}")
+            return None
+
+    def _lookup(
+        self,
+        prompt: str,
+        profile: GenerationProfile,
+        question: Optional[str] = None,
+    ) -> Tuple[Optional[str], Optional[str], Optional[SemanticKey]]:
+        """
+        Check the exact, then the semantic response cache.
+
+        Returns:
+            (cached response or None, exact cache key, semantic key); the keys
+            go to ``_store_response`` once the response is generated.
+        """
+        cache_key = self._cache_key(prompt, profile)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached, cache_key, None
+
+        semantic_key = self._semantic_key(prompt, profile, question)
+        if semantic_key is not None:
+            cached = self.semantic_cache.get(semantic_key)
+            if cached is not None:
+                return cached, cache_key, None
+        return None, cache_key, semantic_key
+
+    def lookup(
+        self,
+        prompt: str,
+        profile: GenerationProfile = GENERAL_PROFILE,
+        question: Optional[str] = None,
+        session: Optional[GenerationSession] = None,
+    ) -> ResponseLookup:
+        """
+        Fit ``prompt`` to the input budget and check the response caches.
+
+        Endpoints call this before admission control, so a request the
+        caches can answer is never shed; pass the result on to the
+        generation call as ``lookup``.
+        """
+        prompt = self.fit_input(prompt, question, session)
+        return ResponseLookup(prompt, *self._lookup(prompt, profile, question))
+
+    async def alookup(
+        self,
+        prompt: str,
+        profile: GenerationProfile = GENERAL_PROFILE,
+        question: Optional[str] = None,
+        session: Optional[GenerationSession] = None,
+    ) -> ResponseLookup:
+        """``lookup`` in the thread pool (embedding and cache reads block)."""
+        return await run_in_threadpool(self.lookup, prompt, profile, question, session)
+
+    def _decode(self, request: GenerationRequest, profile: GenerationProfile) -> str:
+        text = self.tokenizer.decode(request.generated, skip_special_tokens=True)
+        return _trim_stop_sequences(text, profile.stop_sequences)
+
+    def _store_response(
+        self,
+        key: Optional[str],
+        request: GenerationRequest,
+        profile: GenerationProfile,
+        semantic_key: Optional[SemanticKey] = None,
+    ):
+        """Cache a finished response unless it was cut short."""
+        if key is None and semantic_key is None:
+            return
+        if request.finish_reason not in CACHEABLE_FINISH_REASONS:
+            return
+        text = self._decode(request, profile)
+        if key is not None:
+            self.response_cache.put(key, text)
+        if semantic_key is not None and self.semantic_cache is not None:
+            self.semantic_cache.put(semantic_key, text)
+
+    @staticmethod
+    def _replay(text: str, session: GenerationSession) -> Generator[str, None, None]:
+        """Stream a cached response word by word, like a live generation."""
+        for chunk in re.findall(r"\s*\S+|\s+$", text):
+            if session.cancelled:
+                return
+            yield chunk
+
+    @staticmethod
+    def _expired(session: GenerationSession) -> bool:
+        """True (and the session marked truncated) if its deadline passed before generation could start."""
+        if not session.expired:
+            return False
+        print("[LLM] Deadline passed before generation started; skipping")
+        session.finish_reason = DeadlineCriteria.finish_reason
+        return True
+
+    def warmup(self, prompt: str = "Hi", max_new_tokens: int = 8):
+        """
+        Run one short generation before serving traffic.
+
+        Triggers one-time work (torch.compile in compiled mode, allocator and
+        kernel warm-up) so the first real request doesn't pay for it. Bypasses
+        the response cache.
+        """
+        start = time.perf_counter()
+        request = self._build_request(prompt)
+        request.max_new_tokens = min(request.max_new_tokens, max_new_tokens)
+        request.trace.label = "warmup"
+        self.backend.generate(request)
+        print(f"[LLM INIT] Warm-up finished in {time.perf_counter() - start:.1f}s")
+
+    def admit(self, priority: str = PRIORITY_STANDARD):
+        """
+        Check that a new request can be served in time.
+
+        Call before starting a generation for an HTTP request.
+
+        Raises:
+            OverloadedError: The queue is full or the estimated wait is too long.
+        """
+        self.admission.check(priority, self.backend.load())
+
+    def has_spare_capacity(self) -> bool:
+        """True if no request is waiting and the batch has a free slot (for optional work)."""
+        load = self.backend.load()
+        return not any(load["queued_by_priority"].values()) and load["active"] < load["capacity"]
+
+    def stats(self) -> Dict[str, Any]:
+        """Runtime counters for monitoring."""
+        stats = {
+            "backend": self.backend.name,
+            **self.backend.stats(),
+            "admission": self.admission.stats(),
+        }
+        with self._input_lock:
+            stats["input_budget"] = {"max_input_tokens": self.settings.max_input_tokens, **self._input_stats}
+        if self.response_cache is not None:
+            stats["response_cache"] = self.response_cache.stats()
+        if self.semantic_cache is not None:
+            stats["semantic_cache"] = self.semantic_cache.stats()
+        return stats
 
     # -------------------------
     # NON-STREAM GENERATION
     # -------------------------
-    def generate(self, prompt: str) -> str:
-        # Cancel any previous generation first
-        LLM.cancel_current_generation()
-        
-        # Enforce plain text prompting (LOCKED)
-        text = f"You are a helpful coding assistant.\n\nUser: {prompt}\nAssistant:\n"
-
-        with LLM._generation_lock:
-            inputs = self.tokenizer(text, return_tensors="pt").to(self.model.device)
-            input_len = inputs.input_ids.shape[-1]
-
-            with torch.no_grad():
-                output = self.model.generate(
-                    **inputs,
-                    max_new_tokens=400,  # LOCKED
-                    do_sample=False,     # LOCKED
-                    use_cache=True,      # LOCKED
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                )
+    def generate(
+        self,
+        prompt: str,
+        session: Optional[GenerationSession] = None,
+        cacheable_prefix: Optional[str] = None,
+        profile: GenerationProfile = GENERAL_PROFILE,
+        priority: str = PRIORITY_STANDARD,
+        question: Optional[str] = None,
+        lookup: Optional[ResponseLookup] = None,
+    ) -> str:
+        """
+        Generate a complete response.
+
+        Args:
+            prompt: The user prompt.
+            session: Optional session used to cancel the generation or give
+                it a deadline (``session.truncated`` tells if it was hit).
+            cacheable_prefix: Leading part of ``prompt`` shared across requests
+                (e.g. a template scaffold) whose KV state can be reused.
+            profile: Token budget and stop conditions for this kind of request.
+            priority: Queue priority class ("interactive", "standard" or "background").
+            question: The user's question inside ``prompt``, for the semantic
+                cache (no semantic lookup without one).
+            lookup: Result of ``lookup`` for this prompt, if the caller
+                already checked the caches.
+        """
+        session = session or GenerationSession()
+        if lookup is None:
+            lookup = self.lookup(prompt, profile, question, session)
+        prompt, cached, cache_key, semantic_key = lookup
+        if cached is not None:
+            return cached.strip()
+
+        if self._expired(session):
+            return ""
+
+        request = self._build_request(
+            prompt,
+            session.stopping_criteria(),
+            cacheable_prefix=cacheable_prefix,
+            profile=profile,
+            priority=priority,
+            session=session,
+        )
+        self.backend.generate(request)
+        session.finish_reason = request.finish_reason
+        self._store_response(cache_key, request, profile, semantic_key)
+
+        return self._decode(request, profile).strip()
+
+    async def agenerate(
+        self,
+        prompt: str,
+        session: Optional[GenerationSession] = None,
+        cacheable_prefix: Optional[str] = None,
+        profile: GenerationProfile = GENERAL_PROFILE,
+        priority: str = PRIORITY_STANDARD,
+        question: Optional[str] = None,
+        lookup: Optional[ResponseLookup] = None,
+    ) -> str:
+        """Async version of ``generate`` that waits without blocking the event loop."""
+        session = session or GenerationSession()
+        if lookup is None:
+            # Embedding and cache reads (SQLite) block, so keep them off the event loop
+            lookup = await self.alookup(prompt, profile, question, session)
+        prompt, cached, cache_key, semantic_key = lookup
+        if cached is not None:
+            return cached.strip()
+
+        if self._expired(session):
+            return ""
+
+        # The streamer's end marker doubles as the completion signal
+        streamer = AsyncTextStreamer(self.tokenizer, skip_special_tokens=True)
+        request = self.backend.stream_generate(
+            self._build_request(
+                prompt,
+                session.stopping_criteria(),
+                streamer,
+                cacheable_prefix=cacheable_prefix,
+                profile=profile,
+                priority=priority,
+                session=session,
+            )
+        )
+        try:
+            async for _ in streamer:
+                pass
+        finally:
+            session.cancel()
+
+        if request.error is not None:
+            raise request.error
+        session.finish_reason = request.finish_reason
+        # SQLite write and eviction: keep them off the event loop
+        await run_in_threadpool(self._store_response, cache_key, request, profile, semantic_key)
+        return self._decode(request, profile).strip()
+
+    def generate_batch(
+        self,
+        prompts: List[str],
+        profile: GenerationProfile = GENERAL_PROFILE,
+        priority: str = PRIORITY_BACKGROUND,
+        padded: bool = False,
+    ) -> List[str]:
+        """
+        Generate responses for several prompts in one batch.
+
+        Cached responses are returned directly; the rest are handed to the
+        backend together so it can batch them.
+
+        Args:
+            prompts: The user prompts.
+            profile: Token budget and stop conditions for every prompt.
+            priority: Queue priority class (ignored when ``padded``).
+            padded: Run the batch as one left-padded ``generate()`` call
+                instead of through the scheduler (offline bulk jobs, see
+                ``app.core.batch_generate``).
+        """
+        results: List[Optional[str]] = [None] * len(prompts)
+        pending = []
+        for i, prompt in enumerate(prompts):
+            prompt = self.fit_input(prompt)
+            cached, cache_key, semantic_key = self._lookup(prompt, profile)
+            if cached is not None:
+                results[i] = cached.strip()
+            else:
+                request = self._build_request(prompt, profile=profile, priority=priority)
+                pending.append((i, cache_key, semantic_key, request))
 
-            generated = output[0][input_len:]
-            return self.tokenizer.decode(
-                generated,
-                skip_special_tokens=True,
-            ).strip()
+        requests = [request for *_, request in pending]
+        if padded:
+            self.backend.generate_padded(requests)
+        else:
+            self.backend.generate_batch(requests)
+        for i, cache_key, semantic_key, request in pending:
+            self._store_response(cache_key, request, profile, semantic_key)
+            results[i] = self._decode(request, profile).strip()
+        return results
 
     # -------------------------
     # STREAMING GENERATION
@@ -113,63 +1087,148 @@ class LLM:
     def stream_generate(
         self,
         prompt: str,
+        session: Optional[GenerationSession] = None,
+        cacheable_prefix: Optional[str] = None,
+        profile: GenerationProfile = GENERAL_PROFILE,
+        priority: str = PRIORITY_INTERACTIVE,
+        question: Optional[str] = None,
+        lookup: Optional[ResponseLookup] = None,
     ) -> Generator[str, None, None]:
-        # Cancel any previous generation first
-        LLM.cancel_current_generation()
-        
-        # Create new cancel event for this generation
-        LLM._cancel_event = Event()
-        cancel_event = LLM._cancel_event
-        
-        # Enforce plain text prompting (LOCKED)
-        text = f"You are a helpful coding assistant.\n\nUser: {prompt}\nAssistant:\n"
+        # Each stream gets its own session, so stopping it never
+        # affects other in-flight generations
+        session = session or GenerationSession()
+        if lookup is None:
+            lookup = self.lookup(prompt, profile, question, session)
+        prompt, cached, cache_key, semantic_key = lookup
+        if cached is not None:
+            yield from self._replay(cached, session)
+            return
 
-        inputs = self.tokenizer(text, return_tensors="pt").to(self.model.device)
+        if self._expired(session):
+            return
 
-        streamer = TextIteratorStreamer(
+        # Backends only feed generated tokens, decoded incrementally
+        streamer = TextQueueStreamer(
             self.tokenizer,
-            skip_prompt=True,         # LOCKED
             skip_special_tokens=True, # LOCKED
         )
-        
-        stopping_criteria = StoppingCriteriaList([CancellationCriteria(cancel_event)])
 
-        generation_kwargs = dict(
-            **inputs,
-            streamer=streamer,
-            max_new_tokens=400,      # LOCKED
-            do_sample=False,         # LOCKED
-            use_cache=True,          # LOCKED
-            pad_token_id=self.tokenizer.eos_token_id,
-            eos_token_id=self.tokenizer.eos_token_id,
-            stopping_criteria=stopping_criteria,
+        request = self.backend.stream_generate(
+            self._build_request(
+                prompt,
+                session.stopping_criteria(),
+                streamer,
+                cacheable_prefix=cacheable_prefix,
+                profile=profile,
+                priority=priority,
+                session=session,
+            )
+        )
+
+        # Yield chunks while the backend is generating
+        try:
+            # Keep draining after a stop sequence so the request can finish
+            stop_filter = _StopSequenceFilter(profile.stop_sequences)
+            for chunk in streamer:
+                text = stop_filter.feed(chunk)
+                if text:
+                    yield text
+            text = stop_filter.flush()
+            if text:
+                yield text
+            session.finish_reason = request.finish_reason
+            self._store_response(cache_key, request, profile, semantic_key)
+        except Exception as e:
+            print(f"[DEBUG] Streamer loop error: {e}")
+        finally:
+            # Stop generating if the consumer went away early
+            session.cancel()
+
+    async def astream_generate(
+        self,
+        prompt: str,
+        session: Optional[GenerationSession] = None,
+        cacheable_prefix: Optional[str] = None,
+        profile: GenerationProfile = GENERAL_PROFILE,
+        priority: str = PRIORITY_INTERACTIVE,
+        question: Optional[str] = None,
+        lookup: Optional[ResponseLookup] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Async version of ``stream_generate``.
+
+        Tokens arrive from the scheduler's worker thread through an asyncio
+        queue, so waiting for the next chunk holds no thread.
+        """
+        session = session or GenerationSession()
+        if lookup is None:
+            # Embedding and cache reads (SQLite) block, so keep them off the event loop
+            lookup = await self.alookup(prompt, profile, question, session)
+        prompt, cached, cache_key, semantic_key = lookup
+        if cached is not None:
+            for chunk in self._replay(cached, session):
+                yield chunk
+            return
+
+        if self._expired(session):
+            return
+
+        streamer = AsyncTextStreamer(
+            self.tokenizer,
+            skip_special_tokens=True, # LOCKED
         )
 
-        thread = Thread(
-            target=self.model.generate,
-            kwargs=generation_kwargs,
-            daemon=True,
+        request = self.backend.stream_generate(
+            self._build_request(
+                prompt,
+                session.stopping_criteria(),
+                streamer,
+                cacheable_prefix=cacheable_prefix,
+                profile=profile,
+                priority=priority,
+                session=session,
+            )
         )
-        LLM._current_thread = thread
-        thread.start()
 
-        # Yield chunks while thread is running
         try:
-            for chunk in streamer:
-                # Check if cancelled
-                if cancel_event.is_set():
-                    break
-                if chunk:
-                    yield chunk
+            # Keep draining after a stop sequence so the request can finish
+            stop_filter = _StopSequenceFilter(profile.stop_sequences)
+            async for chunk in streamer:
+                text = stop_filter.feed(chunk)
+                if text:
+                    yield text
+            text = stop_filter.flush()
+            if text:
+                yield text
+            session.finish_reason = request.finish_reason
+            # SQLite write and eviction: keep them off the event loop
+            await run_in_threadpool(self._store_response, cache_key, request, profile, semantic_key)
         except Exception as e:
             print(f"[DEBUG] Streamer loop error: {e}")
         finally:
-            # Signal cancellation just in case loop exited otherwise
-            cancel_event.set()
-            # Wait for thread to complete
-            thread.join(timeout=2)
-                
-            # Cleanup if this is still the active thread
-            if LLM._current_thread == thread:
-                LLM._current_thread = None
-                LLM._cancel_event = None
\ No newline at end of file
+            # Stop generating if the consumer went away early
+            session.cancel()
+
+
+# Shared instance (lazy-loaded)
+_llm: Optional[LLM] = None
+_llm_lock = Lock()
+
+
+def preload_llm() -> LLM:
+    """Preload and cache the LLM instance. Call this at startup."""
+    return get_llm()
+
+
+def get_loaded_llm() -> Optional[LLM]:
+    """Get the shared LLM instance if it has been loaded, without loading it."""
+    return _llm
+
+
+def get_llm() -> LLM:
+    """Get the shared LLM instance (loads if not already loaded)."""
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            _llm = LLM()
+    return _llm
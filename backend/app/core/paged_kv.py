@@ -0,0 +1,323 @@
+"""
+Paged KV-cache memory.
+
+The KV states kept between requests (shared prompt prefixes, conversation
+turns) are stored in fixed-size pages of ``page_tokens`` positions instead
+of one contiguous tensor per entry. Entries of any length then draw from
+one pool of interchangeable pages: freeing an entry returns its pages to
+the free list for the next one, so memory doesn't fragment as entries
+come and go, and waste is bounded by one partly filled page per entry.
+
+Each stored sequence has a page table (``PageTable``) listing its pages in
+order. Full pages are indexed by their token ids and the page before
+them, so a sequence starting with tokens that are already stored (the
+system preamble, a template scaffold, the earlier turns of a
+conversation) points at the existing pages instead of copying them.
+Shared pages are reference counted and copied on write: appending to a
+sequence whose last, partly filled page is shared first gives it a
+private copy.
+
+Model steps still run on contiguous caches; ``gather`` assembles one from
+a page table when an entry is reused. With ``quantized`` the pages hold
+int8 keys and values plus per-head scales (``app.core.kv_quant``).
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+from app.core.kv_quant import dequantize_int8, quantize_int8
+
+# Legacy cache layout: one (key, value) pair of tensors per layer
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+class PoolFullError(Exception):
+    """Not enough free pages for an allocation."""
+
+
+@dataclass
+class PageTable:
+    """The pages holding one stored sequence, in order."""
+    token_ids: List[int] = field(default_factory=list)
+    pages: List[int] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.token_ids)
+
+
+class PagedKVPool:
+    """Fixed-size KV pages with a free list, prefix sharing and copy-on-write."""
+
+    def __init__(self, max_bytes: int, page_tokens: int = 16, quantized: bool = False):
+        """
+        Initialize the pool.
+
+        Page geometry (layers, heads, head size, dtype) is taken from the
+        first cache stored; storage grows on demand up to ``max_bytes``.
+
+        Args:
+            max_bytes: Memory cap for all pages.
+            page_tokens: Positions per page.
+            quantized: Store int8 keys and values with per-head scales.
+        """
+        self.max_bytes = max_bytes
+        self.page_tokens = page_tokens
+        self.quantized = quantized
+        self.max_pages = 0
+        self.page_bytes = 0
+
+        # Keys and values (then their scales if quantized), each shaped
+        # (layers, pages, heads, page_tokens, head_dim); allocated on first use
+        self._storage: List[torch.Tensor] = []
+        self._free: List[int] = []
+        self._refcounts: List[int] = []
+        self._filled: List[int] = []  # Positions written per page
+        # Full pages by (previous page, token ids), so equal prefixes share pages
+        self._index: Dict[Tuple[int, Tuple[int, ...]], int] = {}
+        self._page_keys: Dict[int, Tuple[int, Tuple[int, ...]]] = {}
+        self._stats = {
+            "pages_allocated": 0,
+            "pages_reused": 0,
+            "copy_on_write": 0,
+        }
+
+    # -------------------------
+    # PAGE TABLES
+    # -------------------------
+    def allocate(
+        self,
+        token_ids: List[int],
+        cache: LegacyCache,
+        base: Optional[PageTable] = None,
+    ) -> PageTable:
+        """
+        Store ``cache`` (KV for ``token_ids``, batch size 1) in pages.
+
+        The common prefix with ``base`` (e.g. the previous version of the
+        same sequence), or else the leading full pages already stored with
+        the same tokens, is shared rather than copied.
+
+        Raises:
+            PoolFullError: Not enough free pages; nothing was allocated.
+        """
+        if base is not None:
+            length = 0
+            limit = min(len(base), len(token_ids))
+            while length < limit and base.token_ids[length] == token_ids[length]:
+                length += 1
+            table = self.fork(base, length)
+        else:
+            table = PageTable()
+            previous = -1
+            for start in range(0, len(token_ids) - self.page_tokens + 1, self.page_tokens):
+                page = self._index.get((previous, tuple(token_ids[start:start + self.page_tokens])))
+                if page is None:
+                    break
+                self._refcounts[page] += 1
+                self._stats["pages_reused"] += 1
+                table.pages.append(page)
+                table.token_ids.extend(token_ids[start:start + self.page_tokens])
+                previous = page
+
+        try:
+            self.append(table, token_ids, cache)
+        except PoolFullError:
+            self.free(table)
+            raise
+        return table
+
+    def fork(self, table: PageTable, length: int) -> PageTable:
+        """A new page table sharing the first ``length`` positions of ``table`` (no copy)."""
+        length = min(length, len(table))
+        pages = table.pages[:-(-length // self.page_tokens)]
+        for page in pages:
+            self._refcounts[page] += 1
+        self._stats["pages_reused"] += len(pages)
+        return PageTable(token_ids=table.token_ids[:length], pages=list(pages))
+
+    def append(self, table: PageTable, token_ids: List[int], cache: LegacyCache):
+        """
+        Write the positions of ``token_ids`` that ``table`` doesn't hold yet.
+
+        Args:
+            table: Page table to extend; its tokens must be a prefix of ``token_ids``.
+            token_ids: The full sequence.
+            cache: KV for the full sequence (at least ``len(token_ids)`` positions).
+
+        Raises:
+            PoolFullError: Not enough free pages; ``table`` is unchanged.
+        """
+        start = len(table)
+        if start >= len(token_ids):
+            return
+
+        offset = start % self.page_tokens
+        # A shared, partly filled last page is copied before it is written to
+        copy_last = offset > 0 and self._refcounts[table.pages[-1]] > 1
+        needed = -(-(len(token_ids) - start + offset) // self.page_tokens) - (1 if offset else 0)
+        self._reserve(cache, needed + (1 if copy_last else 0))
+
+        if copy_last:
+            page = self._take_page()
+            for storage in self._storage:
+                storage[:, page] = storage[:, table.pages[-1]]
+            self._filled[page] = self._filled[table.pages[-1]]
+            self._release_page(table.pages[-1])
+            table.pages[-1] = page
+            self._stats["copy_on_write"] += 1
+        elif offset:
+            # A private page about to be overwritten no longer matches its index entry
+            key = self._page_keys.pop(table.pages[-1], None)
+            if key is not None:
+                del self._index[key]
+
+        keys = torch.stack([k[0, :, start:len(token_ids)] for k, _ in cache])
+        values = torch.stack([v[0, :, start:len(token_ids)] for _, v in cache])
+        if self.quantized:
+            (keys, key_scales), (values, value_scales) = quantize_int8(keys), quantize_int8(values)
+            chunks = [keys, values, key_scales, value_scales]
+        else:
+            chunks = [keys, values]
+
+        written = 0
+        while start + written < len(token_ids):
+            position = start + written
+            slot = position % self.page_tokens
+            if slot == 0:
+                table.pages.append(self._take_page())
+            page = table.pages[-1]
+            count = min(self.page_tokens - slot, len(token_ids) - position)
+            for storage, chunk in zip(self._storage, chunks):
+                storage[:, page, :, slot:slot + count] = chunk[:, :, written:written + count]
+            self._filled[page] = slot + count
+            written += count
+
+            if slot + count == self.page_tokens:
+                page_start = position + count - self.page_tokens
+                previous = table.pages[-2] if len(table.pages) > 1 else -1
+                key = (previous, tuple(token_ids[page_start:page_start + self.page_tokens]))
+                if key not in self._index:
+                    self._index[key] = page
+                    self._page_keys[page] = key
+        table.token_ids = list(token_ids)
+
+    def gather(self, table: PageTable, length: Optional[int] = None) -> LegacyCache:
+        """Copy the first ``length`` positions (default: all) into a contiguous legacy cache."""
+        length = len(table) if length is None else min(length, len(table))
+        pages = torch.tensor(table.pages[:-(-length // self.page_tokens)], device=self._storage[0].device)
+
+        def assemble(storage: torch.Tensor) -> torch.Tensor:
+            # (layers, pages, heads, page_tokens, dim) -> (layers, heads, positions, dim)
+            selected = storage.index_select(1, pages).permute(0, 2, 1, 3, 4)
+            return selected.reshape(*selected.shape[:2], -1, selected.shape[-1])[:, :, :length]
+
+        keys, values, *scales = [assemble(storage) for storage in self._storage]
+        if self.quantized:
+            keys, values = dequantize_int8(keys, scales[0]), dequantize_int8(values, scales[1])
+        return tuple(
+            (keys[layer].unsqueeze(0), values[layer].unsqueeze(0))
+            for layer in range(keys.shape[0])
+        )
+
+    def free(self, table: PageTable):
+        """Release a page table's pages (shared pages stay until their last user lets go)."""
+        for page in reversed(table.pages):
+            self._release_page(page)
+        table.pages = []
+        table.token_ids = []
+
+    # -------------------------
+    # PAGES
+    # -------------------------
+    def _reserve(self, cache: LegacyCache, count: int):
+        """Make sure ``count`` pages are free, growing the storage up to the cap."""
+        if not self._storage:
+            self._init_storage(cache)
+        if count <= len(self._free):
+            return
+
+        capacity = self._storage[0].shape[1]
+        needed = capacity + count - len(self._free)
+        if needed > self.max_pages:
+            raise PoolFullError(f"{count} pages requested, {len(self._free)} free of {self.max_pages}")
+
+        # Grow geometrically so stores don't copy the pool every time
+        new_capacity = min(self.max_pages, max(needed, capacity * 2))
+        grow = new_capacity - capacity
+        for i, storage in enumerate(self._storage):
+            shape = list(storage.shape)
+            shape[1] = grow
+            self._storage[i] = torch.cat([storage, storage.new_zeros(shape)], dim=1)
+        self._refcounts.extend([0] * grow)
+        self._filled.extend([0] * grow)
+        self._free.extend(range(new_capacity - 1, capacity - 1, -1))
+
+    def _init_storage(self, cache: LegacyCache):
+        k = cache[0][0]
+        _, heads, _, head_dim = k.shape
+        shape = (len(cache), 0, heads, self.page_tokens, head_dim)
+        if self.quantized:
+            scale_shape = shape[:-1] + (1,)
+            self._storage = [
+                torch.zeros(shape, dtype=torch.int8, device=k.device),
+                torch.zeros(shape, dtype=torch.int8, device=k.device),
+                torch.zeros(scale_shape, dtype=k.dtype, device=k.device),
+                torch.zeros(scale_shape, dtype=k.dtype, device=k.device),
+            ]
+        else:
+            self._storage = [
+                torch.zeros(shape, dtype=k.dtype, device=k.device),
+                torch.zeros(shape, dtype=k.dtype, device=k.device),
+            ]
+        positions = len(cache) * heads * self.page_tokens
+        self.page_bytes = sum(
+            positions * storage.shape[-1] * storage.element_size() for storage in self._storage
+        )
+        self.max_pages = self.max_bytes // self.page_bytes
+
+    def _take_page(self) -> int:
+        page = self._free.pop()
+        self._refcounts[page] = 1
+        self._filled[page] = 0
+        self._stats["pages_allocated"] += 1
+        return page
+
+    def _release_page(self, page: int):
+        self._refcounts[page] -= 1
+        if self._refcounts[page]:
+            return
+        key = self._page_keys.pop(page, None)
+        if key is not None:
+            del self._index[key]
+        self._filled[page] = 0
+        self._free.append(page)
+
+    # -------------------------
+    # STATS
+    # -------------------------
+    def stats(self) -> Dict[str, Any]:
+        """
+        Page usage.
+
+        ``utilization`` is the share of the page cap in use; ``fragmentation``
+        is the share of positions in used pages that hold nothing (the
+        unfilled tail of each sequence's last page).
+        """
+        capacity = self._storage[0].shape[1] if self._storage else 0
+        used = capacity - len(self._free)
+        filled = sum(self._filled)
+        return {
+            **self._stats,
+            "page_tokens": self.page_tokens,
+            "quantized": int(self.quantized),
+            "pages_used": used,
+            "pages_free": len(self._free),
+            "pages_reserved": capacity,
+            "max_pages": self.max_pages,
+            "shared_pages": sum(1 for count in self._refcounts if count > 1),
+            "utilization": used / self.max_pages if self.max_pages else 0.0,
+            "fragmentation": 1 - filled / (used * self.page_tokens) if used else 0.0,
+            "bytes": capacity * self.page_bytes,
+        }
@@ -0,0 +1,127 @@
+"""
+Prompt-prefix KV cache.
+
+Every request starts with the same system preamble, and the smart chat
+templates add a long fixed scaffold on top of it. This module keeps the
+``past_key_values`` for those shared prefixes so the scheduler only has
+to prefill the part of the prompt that is actually new.
+
+Entries are keyed by a hash of the prefix token ids and evicted in LRU
+order once the configured memory budget is exceeded. Their KV states live
+in a paged pool (``app.core.paged_kv``), where a longer prefix shares the
+pages of the shorter prefixes it starts with.
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.paged_kv import LegacyCache, PagedKVPool, PageTable, PoolFullError
+
+
+def prefix_key(token_ids: Sequence[int]) -> str:
+    """Hash a token id prefix into a cache key."""
+    data = ",".join(str(t) for t in token_ids).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+class PrefixCache:
+    """LRU cache of KV states for shared prompt prefixes."""
+
+    def __init__(self, max_bytes: int, page_tokens: int = 16, quantized: bool = False):
+        """
+        Initialize the prefix cache.
+
+        Args:
+            max_bytes: Memory budget for cached KV tensors.
+            page_tokens: Positions per KV page.
+            quantized: Keep the KV states in int8 with per-head scales.
+        """
+        self.max_bytes = max_bytes
+        self.pool = PagedKVPool(max_bytes, page_tokens, quantized)
+        self._entries: "OrderedDict[str, PageTable]" = OrderedDict()
+        # Number of entries per prefix length, so lookups only hash lengths that exist
+        self._lengths: Dict[int, int] = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "tokens_reused": 0,
+        }
+
+    def lookup(self, input_ids: List[int], max_length: int) -> Tuple[int, Optional[LegacyCache]]:
+        """
+        Find the longest cached prefix of ``input_ids``.
+
+        Args:
+            input_ids: Full prompt token ids.
+            max_length: Longest prefix worth looking for. At least one prompt
+                token is always left over so the model has something to prefill.
+
+        Returns:
+            Tuple of (prefix length, cached KV) or (0, None) on a miss.
+            The KV is a fresh contiguous copy the caller may extend.
+        """
+        limit = min(max_length, len(input_ids) - 1)
+        for length in sorted(self._lengths, reverse=True):
+            if length > limit:
+                continue
+            key = prefix_key(input_ids[:length])
+            table = self._entries.get(key)
+            if table is None:
+                continue
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            self._stats["tokens_reused"] += length
+            return length, self.pool.gather(table)
+
+        self._stats["misses"] += 1
+        return 0, None
+
+    def store(self, token_ids: List[int], cache: LegacyCache):
+        """Cache the KV state for ``token_ids``."""
+        key = prefix_key(token_ids)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        while True:
+            try:
+                table = self.pool.allocate(list(token_ids), cache)
+                break
+            except PoolFullError:
+                if not self._entries:
+                    return  # Larger than the whole budget
+                self._evict_oldest()
+
+        length = len(token_ids)
+        self._entries[key] = table
+        self._lengths[length] = self._lengths.get(length, 0) + 1
+
+    def _evict_oldest(self):
+        _, table = self._entries.popitem(last=False)
+        self._lengths[len(table)] -= 1
+        if not self._lengths[len(table)]:
+            del self._lengths[len(table)]
+        self.pool.free(table)
+        self._stats["evictions"] += 1
+
+    def clear(self):
+        """Drop every cached prefix."""
+        for table in self._entries.values():
+            self.pool.free(table)
+        self._entries.clear()
+        self._lengths.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and memory usage."""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        pages = self.pool.stats()
+        return {
+            **self._stats,
+            "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": pages["bytes"],
+            "max_bytes": self.max_bytes,
+            "pages": pages,
+        }
@@ -0,0 +1,113 @@
+"""
+Priority classes for queued generation requests.
+
+Requests wait in one FIFO per priority class. The next request is picked
+by weighted-fair (stride) scheduling, so an interactive stream gets
+several turns for every non-stream or background request instead of
+waiting behind them. Background work still makes progress in proportion
+to its weight. Starvation protection: a request that has waited longer
+than the starvation limit goes next, whatever its class.
+"""
+
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Dict, Iterable, Optional
+
+if TYPE_CHECKING:
+    from app.core.scheduler import GenerationRequest
+
+PRIORITY_INTERACTIVE = "interactive"  # Streaming UI requests (time-to-first-token matters)
+PRIORITY_STANDARD = "standard"        # Non-streaming API calls
+PRIORITY_BACKGROUND = "background"    # Offline / batch jobs
+
+# Relative share of queue turns while several classes are waiting
+PRIORITY_WEIGHTS: Dict[str, int] = {
+    PRIORITY_INTERACTIVE: 8,
+    PRIORITY_STANDARD: 3,
+    PRIORITY_BACKGROUND: 1,
+}
+
+
+class RequestQueue:
+    """
+    Per-priority FIFO queues with weighted-fair selection.
+
+    Not thread-safe: callers guard it with their own lock.
+    """
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, int]] = None,
+        starvation_seconds: float = 10.0,
+    ):
+        self.weights = dict(weights or PRIORITY_WEIGHTS)
+        self.starvation_seconds = starvation_seconds
+        self._queues: Dict[str, Deque["GenerationRequest"]] = {p: deque() for p in self.weights}
+        self._enqueued: Dict[int, float] = {}
+        # Virtual time of each class; the class furthest behind goes next
+        self._pass: Dict[str, float] = {p: 0.0 for p in self.weights}
+        self.promotions = 0  # Requests served early by starvation protection
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def priority_of(self, request: "GenerationRequest") -> str:
+        """The request's class, or "standard" for unknown classes."""
+        return request.priority if request.priority in self._queues else PRIORITY_STANDARD
+
+    def append(self, request: "GenerationRequest"):
+        priority = self.priority_of(request)
+        queue = self._queues[priority]
+        if not queue:
+            # A class that was idle doesn't get to cash in turns it never used
+            active = [self._pass[p] for p, q in self._queues.items() if q]
+            if active:
+                self._pass[priority] = max(self._pass[priority], min(active))
+        queue.append(request)
+        self._enqueued[id(request)] = time.perf_counter()
+
+    def popleft(self, allowed: Optional[Iterable[str]] = None) -> Optional["GenerationRequest"]:
+        """
+        Take the next request to run.
+
+        Args:
+            allowed: Only consider these classes (None for all).
+
+        Returns:
+            The next request, or None if no allowed class has one waiting.
+        """
+        allowed = set(allowed) if allowed is not None else None
+        candidates = [
+            p for p, queue in self._queues.items()
+            if queue and (allowed is None or p in allowed)
+        ]
+        if not candidates:
+            return None
+
+        priority = min(candidates, key=lambda p: (self._pass[p], -self.weights[p]))
+
+        oldest = {p: self._enqueued[id(self._queues[p][0])] for p in candidates}
+        now = time.perf_counter()
+        starved = [p for p in candidates if now - oldest[p] >= self.starvation_seconds]
+        if starved:
+            most_starved = min(starved, key=lambda p: oldest[p])
+            if most_starved != priority:
+                priority = most_starved
+                self.promotions += 1
+
+        self._pass[priority] += 1.0 / self.weights[priority]
+        request = self._queues[priority].popleft()
+        del self._enqueued[id(request)]
+        return request
+
+    def depths(self) -> Dict[str, int]:
+        """Requests currently waiting in each class."""
+        return {p: len(queue) for p, queue in self._queues.items()}
+
+    def oldest_wait(self) -> Dict[str, float]:
+        """Seconds the oldest request of each class has been waiting (0 if empty)."""
+        now = time.perf_counter()
+        return {
+            p: now - self._enqueued[id(queue[0])] if queue else 0.0
+            for p, queue in self._queues.items()
+        }
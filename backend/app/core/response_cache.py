@@ -0,0 +1,222 @@
+"""
+Deterministic response cache for greedy generations.
+
+All generation runs with ``do_sample=False``, so the same model, generation
+config and prompt always produce the same text. Responses are cached in two
+tiers:
+
+- an in-memory LRU tier for hot prompts
+- a persistent SQLite tier that survives restarts
+
+Both tiers have a size budget and a TTL, and keep hit/miss/eviction counters.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def response_cache_key(model_name: str, generation_config: Dict[str, Any], prompt: str) -> str:
+    """Build the cache key for a (model, generation config, full prompt) triple."""
+    payload = json.dumps(
+        {"model": model_name, "config": generation_config, "prompt": prompt},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (memory + SQLite) cache of generated responses."""
+
+    def __init__(
+        self,
+        path: Optional[str],
+        memory_max_bytes: int,
+        disk_max_bytes: int,
+        ttl_seconds: float,
+    ):
+        """
+        Initialize the response cache.
+
+        Args:
+            path: SQLite file for the persistent tier. None disables the disk tier.
+            memory_max_bytes: Budget for cached text held in memory.
+            disk_max_bytes: Budget for cached text held on disk.
+            ttl_seconds: How long an entry stays valid after it was stored.
+        """
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        # key -> (response, expires_at, size)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._memory_bytes = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "expired": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)"
+            )
+            self._db.commit()
+
+    # -------------------------
+    # PUBLIC API
+    # -------------------------
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for ``key``, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, expires_at, _ = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return response
+                self._drop_memory(key)
+                self._stats["expired"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, expires_at FROM responses WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None:
+                    response, expires_at = row
+                    if expires_at > now:
+                        self._db.execute(
+                            "UPDATE responses SET last_access = ? WHERE key = ?",
+                            (now, key),
+                        )
+                        self._db.commit()
+                        self._stats["disk_hits"] += 1
+                        # Promote to the memory tier for the next hit
+                        self._put_memory(key, response, expires_at)
+                        return response
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                    self._stats["expired"] += 1
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, response: str):
+        """Store a response in both tiers."""
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._stats["stores"] += 1
+            self._put_memory(key, response, expires_at)
+
+            if self._db is not None:
+                size = len(response.encode("utf-8"))
+                if size > self.disk_max_bytes:
+                    return
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, response, size, expires_at, now),
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def clear(self):
+        """Drop every cached response from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/eviction counters and tier sizes."""
+        with self._lock:
+            stats = {
+                **self._stats,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+            if self._db is not None:
+                count, size = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+                stats["disk_entries"] = count
+                stats["disk_bytes"] = size
+        return stats
+
+    # -------------------------
+    # TIER MAINTENANCE (lock held)
+    # -------------------------
+    def _put_memory(self, key: str, response: str, expires_at: float):
+        size = len(response.encode("utf-8"))
+        if size > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = (response, expires_at, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_max_bytes:
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+            self._stats["memory_evictions"] += 1
+
+    def _drop_memory(self, key: str):
+        _, _, size = self._memory.pop(key)
+        self._memory_bytes -= size
+
+    def _evict_disk(self, now: float):
+        expired = self._db.execute(
+            "DELETE FROM responses WHERE expires_at <= ?", (now,)
+        ).rowcount
+        self._stats["expired"] += max(expired, 0)
+
+        (total,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.disk_max_bytes:
+            return
+
+        # Least recently used rows go first until we are back under budget
+        rows = self._db.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        )
+        victims = []
+        for key, size in rows:
+            if total <= self.disk_max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self._stats["disk_evictions"] += len(victims)
@@ -0,0 +1,857 @@
+"""
+Continuous-batching generation scheduler.
+
+A single worker thread owns the model. Incoming requests are queued,
+prefilled one at a time and then merged into a shared batch whose decode
+steps run together. Each sequence's tokens are pushed to its own streamer,
+so callers only ever see their own output and nobody has to wait for (or
+cancel) somebody else's generation.
+
+Long prompts are prefilled in chunks of ``prefill_chunk_tokens``, one chunk
+between two decode steps, so a pasted file delays the running streams by
+one chunk at a time instead of by its whole prefill.
+"""
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+from app.core.conversation_cache import ConversationKVCache
+from app.core.kv_quant import Int8KVCache
+from app.core.paged_kv import LegacyCache
+from app.core.prefix_cache import PrefixCache
+from app.core.request_queue import PRIORITY_INTERACTIVE, PRIORITY_STANDARD, RequestQueue
+from app.core.static_decoder import StaticCacheDecoder
+from app.core.telemetry import GenerationTrace, record_generation, record_prefill_stall
+
+
+@dataclass
+class GenerationRequest:
+    """A single sequence submitted to the scheduler."""
+    input_ids: List[int]
+    max_new_tokens: int
+    stopping_criteria: StoppingCriteriaList = field(default_factory=StoppingCriteriaList)
+    streamer: Optional[BaseStreamer] = None
+    # Lengths of shared prompt prefixes whose KV state is worth caching
+    prefix_lengths: List[int] = field(default_factory=list)
+    # Queue priority class ("interactive", "standard" or "background")
+    priority: str = PRIORITY_STANDARD
+    # Conversation whose KV state is kept for its next turn
+    conversation_id: Optional[str] = None
+
+    # Filled in by the scheduler
+    generated: List[int] = field(default_factory=list)
+    finish_reason: Optional[str] = None
+    error: Optional[BaseException] = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+    # Number of this sequence's tokens currently held in the KV cache
+    position: int = 0
+    # Draft model KV cache when speculative decoding is enabled
+    draft_cache: Optional[DynamicCache] = None
+    # Timing for telemetry (tokenization is stamped by the caller)
+    trace: GenerationTrace = field(default_factory=GenerationTrace)
+
+    def wait(self, timeout: Optional[float] = None) -> List[int]:
+        """Block until the sequence finishes and return the generated token ids."""
+        self.done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.generated
+
+
+class _Batch:
+    """Left-padded KV cache shared by all sequences currently decoding."""
+
+    def __init__(self):
+        self.requests: List[GenerationRequest] = []
+        self.cache: Optional[DynamicCache] = None
+        self.attention_mask: Optional[torch.Tensor] = None
+        self.next_tokens: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+
+@dataclass
+class _Prefill:
+    """A sequence whose prompt is being run into its own KV cache, chunk by chunk."""
+    request: GenerationRequest
+    cache: Any
+    # Prompt positions already in the cache
+    done: int = 0
+    # Shared prefix lengths still to reach; their KV state goes to the prefix cache
+    store_at: List[int] = field(default_factory=list)
+
+
+# Generated tokens handed to the stopping criteria per check. The criteria
+# keep their own state and only read tokens they haven't seen yet, and the
+# scheduler checks after every token, so a short tail is enough.
+STOP_CHECK_WINDOW = 64
+
+
+def stop_reason(
+    stopping_criteria: StoppingCriteriaList,
+    input_ids: torch.Tensor,
+    sequence_length: Optional[int] = None,
+) -> Optional[str]:
+    """
+    Return why generation should stop, or None to keep going.
+
+    Criteria can set a ``finish_reason`` attribute (e.g. "cancelled") to
+    say why they fired; otherwise the reason is "stopped".
+
+    Args:
+        stopping_criteria: The request's criteria.
+        input_ids: The sequence so far, or only its tail when
+            ``sequence_length`` gives the full length.
+        sequence_length: Length of the whole sequence (prompt plus output).
+    """
+    kwargs = {} if sequence_length is None else {"sequence_length": sequence_length}
+    for criteria in stopping_criteria:
+        if bool(torch.as_tensor(criteria(input_ids, None, **kwargs)).any()):
+            return getattr(criteria, "finish_reason", "stopped")
+    return None
+
+
+def _stop_reason_tail(request: GenerationRequest, generated: List[int]) -> Optional[str]:
+    """Check the request's criteria on the tail of ``generated`` (no copy of the prompt)."""
+    tail = torch.tensor([generated[-STOP_CHECK_WINDOW:]], dtype=torch.long)
+    return stop_reason(request.stopping_criteria, tail, len(request.input_ids) + len(generated))
+
+
+def truncate_at_stop(
+    request: GenerationRequest,
+    generated: List[int],
+    eos_token_id: int,
+) -> Tuple[List[int], str]:
+    """
+    Cut a sequence that was generated in one go where the scheduler would have stopped it.
+
+    Replays ``generated`` token by token through the same checks as
+    ``GenerationScheduler._append_token``: end of sequence, token budget,
+    then the request's stopping criteria.
+
+    Returns:
+        The tokens to keep (including the EOS token, if any) and the finish reason.
+    """
+    tokens: List[int] = []
+    for token in generated[:request.max_new_tokens]:
+        tokens.append(token)
+        if token == eos_token_id:
+            return tokens, "eos"
+        if len(tokens) >= request.max_new_tokens:
+            return tokens, "length"
+        if request.stopping_criteria:
+            reason = _stop_reason_tail(request, tokens)
+            if reason is not None:
+                return tokens, reason
+    return tokens, "stopped"
+
+
+class RowStoppingCriteria(StoppingCriteria):
+    """
+    Per-row stopping for a left-padded ``model.generate()`` batch.
+
+    Applies the scheduler's checks (``GenerationScheduler._append_token``:
+    end of sequence, token budget, then the request's stopping criteria) to
+    each row as its tokens arrive, and reports finished rows to ``generate``
+    so they stop costing decode steps. ``generated`` and ``finish_reasons``
+    hold each row's kept tokens and why it stopped.
+    """
+
+    def __init__(self, requests: List[GenerationRequest], prompt_length: int, eos_token_id: int):
+        self.requests = requests
+        self.prompt_length = prompt_length
+        self.eos_token_id = eos_token_id
+        self.generated: List[List[int]] = [[] for _ in requests]
+        self.finish_reasons: List[Optional[str]] = [None] * len(requests)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if input_ids.shape[1] > self.prompt_length:
+            tokens = input_ids[:, -1].tolist()
+            for row, request in enumerate(self.requests):
+                if self.finish_reasons[row] is None:
+                    self.finish_reasons[row] = self._append(row, request, tokens[row])
+        return torch.tensor([reason is not None for reason in self.finish_reasons], device=input_ids.device)
+
+    def _append(self, row: int, request: GenerationRequest, token: int) -> Optional[str]:
+        generated = self.generated[row]
+        generated.append(token)
+        if token == self.eos_token_id:
+            return "eos"
+        if len(generated) >= request.max_new_tokens:
+            return "length"
+        if request.stopping_criteria:
+            return _stop_reason_tail(request, generated)
+        return None
+
+
+def _left_pad(tensor: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    """Zero-pad ``tensor`` on the left of ``dim`` up to ``length``."""
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    padding = torch.zeros(shape, dtype=tensor.dtype, device=tensor.device)
+    return torch.cat([padding, tensor], dim=dim)
+
+
+class GenerationScheduler:
+    """Queues generation requests and runs them with continuous batching."""
+
+    def __init__(
+        self,
+        model,
+        eos_token_id: int,
+        max_batch_size: int = 8,
+        prefix_cache: Optional[PrefixCache] = None,
+        num_threads: int = 0,
+        draft_model=None,
+        num_draft_tokens: int = 4,
+        static_decoder: Optional[StaticCacheDecoder] = None,
+        starvation_seconds: float = 10.0,
+        reserved_interactive_slots: int = 1,
+        conversation_cache: Optional[ConversationKVCache] = None,
+        quantize_kv: bool = False,
+        prefill_chunk_tokens: int = 512,
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            model: A loaded causal LM (already on its target device, in eval mode).
+            eos_token_id: Token id that ends a sequence.
+            max_batch_size: Maximum number of sequences decoded together.
+            prefix_cache: Optional cache of KV states for shared prompt prefixes.
+            num_threads: Intra-op threads for the worker (0 keeps the torch default).
+            draft_model: Optional small model sharing the tokenizer, used for
+                speculative decoding while a single sequence is decoding.
+            num_draft_tokens: Tokens drafted per speculative step.
+            static_decoder: Decode on a preallocated static cache (compiled
+                mode). Sequences then run one at a time, without speculation.
+            starvation_seconds: Queue wait after which a request goes next
+                regardless of its priority class.
+            reserved_interactive_slots: Batch slots only interactive requests
+                may take, so a stream never waits for a full batch to drain.
+            conversation_cache: Optional cache of each conversation's last
+                turn, so a follow-up only prefills the new message.
+            quantize_kv: Keep the running batch's KV cache in int8 with
+                per-head scales (about half the memory of float16).
+            prefill_chunk_tokens: Prompt tokens prefilled between two decode
+                steps of the running batch (0 prefills each prompt at once).
+        """
+        self.model = model
+        self.eos_token_id = eos_token_id
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = prefix_cache
+        self.conversation_cache = conversation_cache
+        self.num_threads = num_threads
+        self.draft_model = draft_model
+        self.num_draft_tokens = num_draft_tokens
+        self.static_decoder = static_decoder
+        self.prefill_chunk_tokens = prefill_chunk_tokens
+
+        # KV cache class of the running batch
+        self.cache_class = Int8KVCache if quantize_kv else DynamicCache
+
+        if static_decoder is not None:
+            # A static cache holds exactly one sequence and can't be cropped
+            self.max_batch_size = 1
+            if quantize_kv:
+                print("[SCHEDULER] The int8 KV cache is not supported with a static cache; disabled.")
+                self.cache_class = DynamicCache
+            if draft_model is not None:
+                print("[SCHEDULER] Speculative decoding is not supported with a static cache; disabled.")
+                self.draft_model = None
+        # Always leave at least one slot that any request can use
+        self.reserved_interactive_slots = max(0, min(reserved_interactive_slots, self.max_batch_size - 1))
+
+        self._pending = RequestQueue(starvation_seconds=starvation_seconds)
+        self._cond = threading.Condition()
+        self._batch = _Batch()
+        # Admitted sequences still prefilling, oldest first; each holds a batch slot
+        self._prefilling: "deque[_Prefill]" = deque()
+        self._worker: Optional[threading.Thread] = None
+        self._stats: Dict[str, int] = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "decode_steps": 0,
+            "generated_tokens": 0,
+            "peak_batch_size": 0,
+            "prefill_tokens": 0,
+            "prefill_chunks": 0,
+            # Prefill rounds that ran while other sequences were waiting to decode
+            "prefill_stalls": 0,
+            "speculative_steps": 0,
+            "draft_tokens": 0,
+            "accepted_draft_tokens": 0,
+        }
+        # Why requests ended ("eos", "length", "repetition", ...)
+        self._finish_reasons: Dict[str, int] = {}
+
+    @property
+    def device(self) -> torch.device:
+        return self.model.device
+
+    # -------------------------
+    # PUBLIC API
+    # -------------------------
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        """Queue a request for generation. Returns the same request object."""
+        with self._cond:
+            self._ensure_worker()
+            request.trace.priority = self._pending.priority_of(request)
+            request.trace.mark("submitted")
+            self._pending.append(request)
+            self._stats["submitted"] += 1
+            self._cond.notify()
+        return request
+
+    def stats(self) -> Dict[str, Any]:
+        """Return scheduler counters plus the current queue/batch sizes."""
+        with self._cond:
+            drafted = self._stats["draft_tokens"]
+            return {
+                **self._stats,
+                "draft_acceptance_rate": (
+                    self._stats["accepted_draft_tokens"] / drafted if drafted else 0.0
+                ),
+                "finish_reasons": dict(self._finish_reasons),
+                "queued": len(self._pending),
+                "queued_by_priority": self._pending.depths(),
+                "oldest_wait_seconds": self._pending.oldest_wait(),
+                "starvation_promotions": self._pending.promotions,
+                "active": len(self._batch),
+                "prefilling": len(self._prefilling),
+            }
+
+    def load(self) -> Dict[str, Any]:
+        """Queue depth per priority class, running sequences and batch capacity."""
+        with self._cond:
+            return {
+                "queued_by_priority": self._pending.depths(),
+                "active": len(self._batch) + len(self._prefilling),
+                "capacity": self.max_batch_size,
+            }
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(
+                target=self._run,
+                name="llm-scheduler",
+                daemon=True,
+            )
+            self._worker.start()
+
+    # -------------------------
+    # WORKER LOOP
+    # -------------------------
+    def _run(self):
+        # OpenMP thread counts are per-thread, so apply them to the worker too
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+
+        # Grad mode is thread-local, so it has to be set inside the worker
+        with torch.inference_mode():
+            while True:
+                # Whatever goes wrong, fail the affected requests and keep
+                # the worker alive; a dead worker would hang every request
+                try:
+                    self._admit_pending()
+                    if self._prefilling:
+                        self._advance_prefills()
+
+                    if not self._batch.requests:
+                        if not self._prefilling:
+                            with self._cond:
+                                while not self._pending:
+                                    self._cond.wait()
+                        continue
+
+                    try:
+                        self._decode_step()
+                    except Exception as e:
+                        print(f"[SCHEDULER] Decode step failed: {e}")
+                        for request in self._batch.requests:
+                            self._finish(request, "error", error=e)
+                        self._batch = _Batch()
+                except Exception as e:
+                    print(f"[SCHEDULER] Worker loop failed: {e}")
+                    self._fail_all(e)
+
+    def _fail_all(self, error: BaseException):
+        """Fail every running and prefilling request and start over with an empty batch."""
+        requests = self._batch.requests + [prefill.request for prefill in self._prefilling]
+        self._batch = _Batch()
+        self._prefilling.clear()
+        for request in requests:
+            if not request.done.is_set():
+                self._finish(request, "error", error=error)
+
+    def _next_pending(self) -> Optional[GenerationRequest]:
+        free_slots = self.max_batch_size - len(self._batch) - len(self._prefilling)
+        allowed = None
+        if free_slots <= self.reserved_interactive_slots:
+            allowed = (PRIORITY_INTERACTIVE,)
+        with self._cond:
+            return self._pending.popleft(allowed)
+
+    def _admit_pending(self):
+        """Start prefilling queued requests while there is room in the batch."""
+        while len(self._batch) + len(self._prefilling) < self.max_batch_size:
+            request = self._next_pending()
+            if request is None:
+                return
+            request.trace.mark("started")
+
+            try:
+                reason = self._stop_reason(request)
+                if reason is not None:
+                    self._finish(request, reason)
+                    continue
+                self._prefilling.append(self._start_prefill(request))
+            except Exception as e:
+                print(f"[SCHEDULER] Prefill failed: {e}")
+                self._finish(request, "error", error=e)
+
+    def _advance_prefills(self):
+        """
+        Run up to one chunk of prompt tokens, oldest prefill first.
+
+        Sequences whose prompt is done get their first token and join the
+        batch. The time spent here while the batch has sequences is how long
+        their next decode step was held up (the prefill stall).
+        """
+        stalled = bool(self._batch.requests)
+        started = time.perf_counter()
+        budget = self.prefill_chunk_tokens or None
+
+        while self._prefilling and (budget is None or budget > 0):
+            prefill = self._prefilling[0]
+            request = prefill.request
+
+            # A client that went away mid-prompt shouldn't cost the rest of it
+            reason = self._stop_reason(request)
+            if reason is not None:
+                self._prefilling.popleft()
+                self._finish(request, reason)
+                continue
+
+            before = prefill.done
+            try:
+                token = self._prefill_chunk(prefill, budget)
+            except Exception as e:
+                print(f"[SCHEDULER] Prefill failed: {e}")
+                self._prefilling.popleft()
+                self._finish(request, "error", error=e)
+                continue
+            if budget is not None:
+                budget -= prefill.done - before
+            if token is None:
+                continue
+
+            self._prefilling.popleft()
+            try:
+                if self._append_token(request, token):
+                    self._merge(request, prefill.cache, token)
+                else:
+                    self._retain_conversation(request, prefill.cache, 0)
+            except Exception as e:
+                print(f"[SCHEDULER] Adding a prefilled sequence to the batch failed: {e}")
+                if not request.done.is_set():
+                    self._finish(request, "error", error=e)
+
+        if stalled:
+            self._stats["prefill_stalls"] += 1
+            record_prefill_stall(time.perf_counter() - started)
+
+    # -------------------------
+    # MODEL STEPS
+    # -------------------------
+    def _start_prefill(self, request: GenerationRequest) -> _Prefill:
+        """Set up a sequence's KV cache, reusing cached conversation or prefix state."""
+        if self.static_decoder is not None:
+            self._fit_static_cache(request)
+            self.static_decoder.reset()
+            cache = self.static_decoder.cache
+        else:
+            cache = self.cache_class()
+        done = 0
+        store_at: List[int] = []
+
+        # A conversation's last turn covers the shared prefixes as well
+        if self.conversation_cache is not None and request.conversation_id:
+            done, cached = self.conversation_cache.lookup(request.conversation_id, request.input_ids)
+            if cached is not None:
+                cache = self._restore(cached, done, cache)
+
+        if self.prefix_cache is not None and request.prefix_lengths and not done:
+            done, cached = self.prefix_cache.lookup(request.input_ids, max(request.prefix_lengths))
+            if cached is not None:
+                cache = self._restore(cached, done, cache)
+
+            # Shared prefixes that were not cached yet are stored once reached
+            store_at = sorted(
+                length for length in request.prefix_lengths if done < length < len(request.input_ids)
+            )
+
+        return _Prefill(request=request, cache=cache, done=done, store_at=store_at)
+
+    def _prefill_chunk(self, prefill: _Prefill, budget: Optional[int]) -> Optional[int]:
+        """
+        Run the next (at most ``budget``) prompt tokens of a sequence.
+
+        A chunk also ends at the next shared prefix to cache.
+
+        Returns:
+            The first generated token once the whole prompt is in, else None.
+        """
+        request = prefill.request
+        total = len(request.input_ids)
+        end = total if budget is None else min(total, prefill.done + budget)
+        if prefill.store_at and prefill.store_at[0] < end:
+            end = prefill.store_at[0]
+
+        input_ids = torch.tensor([request.input_ids[prefill.done:end]], device=self.device)
+        outputs = self._forward_prompt(input_ids, prefill.done, prefill.cache)
+        self._stats["prefill_tokens"] += end - prefill.done
+        self._stats["prefill_chunks"] += 1
+        prefill.done = end
+
+        if prefill.store_at and prefill.store_at[0] == end:
+            prefill.store_at.pop(0)
+            if self.static_decoder is not None:
+                self.prefix_cache.store(request.input_ids[:end], self.static_decoder.to_legacy(end))
+            else:
+                self.prefix_cache.store(request.input_ids[:end], prefill.cache.to_legacy_cache())
+
+        if end < total:
+            return None
+        prefill.cache = outputs.past_key_values
+        request.position = total
+        request.trace.mark("prefilled")
+        return int(outputs.logits[0, -1].argmax())
+
+    def _restore(self, cached: LegacyCache, length: int, cache):
+        """Start from ``length`` cached positions; returns the cache to prefill into."""
+        if self.static_decoder is not None:
+            self.static_decoder.load(cached, length)
+            return cache
+        return self.cache_class.from_legacy_cache(cached)
+
+    def _forward_prompt(self, input_ids: torch.Tensor, start: int, cache):
+        """Run prompt tokens that start at position ``start`` into ``cache``."""
+        if self.static_decoder is not None:
+            return self.static_decoder.forward(input_ids, start)
+        return self.model(
+            input_ids=input_ids,
+            past_key_values=cache,
+            use_cache=True,
+            num_logits_to_keep=1,
+        )
+
+    def _fit_static_cache(self, request: GenerationRequest):
+        """Make sure the prompt plus its token budget fits the static cache."""
+        room = self.static_decoder.max_cache_len - len(request.input_ids)
+        if room < 1:
+            raise ValueError(
+                f"Prompt of {len(request.input_ids)} tokens does not fit the static KV cache "
+                f"({self.static_decoder.max_cache_len} tokens)"
+            )
+        request.max_new_tokens = min(request.max_new_tokens, room)
+
+    def _decode_step(self):
+        """Advance every sequence in the batch by one token."""
+        if self.static_decoder is not None:
+            self._static_decode_step()
+            return
+
+        batch = self._batch
+        size = len(batch)
+
+        # Speculation pays off when decoding is latency bound; with several
+        # sequences the batch already keeps the hardware busy
+        if self.draft_model is not None and size == 1:
+            remaining = batch.requests[0].max_new_tokens - len(batch.requests[0].generated)
+            if remaining > 1:
+                self._speculative_step(min(self.num_draft_tokens, remaining - 1))
+                return
+
+        input_ids = torch.tensor([[t] for t in batch.next_tokens], device=self.device)
+        position_ids = torch.tensor([[r.position] for r in batch.requests], device=self.device)
+        attention_mask = torch.cat(
+            [batch.attention_mask, batch.attention_mask.new_ones((size, 1))],
+            dim=1,
+        )
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=batch.cache,
+            use_cache=True,
+        )
+        batch.cache = outputs.past_key_values
+        batch.attention_mask = attention_mask
+        tokens = outputs.logits[:, -1, :].argmax(dim=-1).tolist()
+
+        self._stats["decode_steps"] += 1
+        self._stats["peak_batch_size"] = max(self._stats["peak_batch_size"], size)
+
+        keep = []
+        for row, (request, token) in enumerate(zip(batch.requests, tokens)):
+            request.position += 1
+            if self._append_token(request, token):
+                batch.next_tokens[row] = token
+                keep.append(row)
+
+        if len(keep) != size:
+            self._drop_finished(keep)
+
+    def _speculative_step(self, num_draft: int):
+        """
+        Draft ``num_draft`` tokens with the small model and verify them with the
+        main model in one forward pass.
+
+        Only drafts that match the main model's greedy choice are kept, plus the
+        main model's own next token, so the output is identical to plain greedy
+        decoding.
+        """
+        batch = self._batch
+        request = batch.requests[0]
+        next_token = batch.next_tokens[0]
+
+        drafts = self._draft(request, num_draft)
+
+        length = len(drafts) + 1
+        input_ids = torch.tensor([[next_token] + drafts], device=self.device)
+        position_ids = torch.arange(
+            request.position, request.position + length, device=self.device
+        ).unsqueeze(0)
+        attention_mask = torch.cat(
+            [batch.attention_mask, batch.attention_mask.new_ones((1, length))],
+            dim=1,
+        )
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=batch.cache,
+            use_cache=True,
+        )
+        targets = outputs.logits[0].argmax(dim=-1).tolist()
+
+        accepted = 0
+        while accepted < len(drafts) and drafts[accepted] == targets[accepted]:
+            accepted += 1
+
+        # Keep the cache for next_token and the accepted drafts; the main
+        # model's token after them becomes the next input
+        keep = batch.attention_mask.shape[1] + accepted + 1
+        batch.cache = outputs.past_key_values
+        batch.cache.crop(keep)
+        batch.attention_mask = attention_mask[:, :keep]
+        request.position += accepted + 1
+        if request.draft_cache is not None:
+            request.draft_cache.crop(len(request.input_ids) + len(request.generated) + accepted)
+
+        self._stats["decode_steps"] += 1
+        self._stats["speculative_steps"] += 1
+        self._stats["draft_tokens"] += len(drafts)
+        self._stats["accepted_draft_tokens"] += accepted
+        self._stats["peak_batch_size"] = max(self._stats["peak_batch_size"], 1)
+
+        emitted = targets[:accepted + 1]
+        for token in emitted:
+            if not self._append_token(request, token):
+                self._drop_finished([])
+                return
+        batch.next_tokens[0] = emitted[-1]
+
+    def _static_decode_step(self):
+        """Advance the single sequence on the static cache by one token."""
+        batch = self._batch
+        request = batch.requests[0]
+        token = self.static_decoder.decode(batch.next_tokens[0], request.position)
+
+        self._stats["decode_steps"] += 1
+        self._stats["peak_batch_size"] = max(self._stats["peak_batch_size"], 1)
+
+        request.position += 1
+        if self._append_token(request, token):
+            batch.next_tokens[0] = token
+        else:
+            self._drop_finished([])
+
+    def _draft(self, request: GenerationRequest, num_draft: int) -> List[int]:
+        """Greedily draft tokens after the sequence's current last token."""
+        tokens = request.input_ids + request.generated
+        cache = request.draft_cache if request.draft_cache is not None else DynamicCache()
+
+        # Bring the draft cache up to date with everything before the last token
+        # (it falls behind while other sequences share the batch)
+        have = cache.get_seq_length()
+        if have > len(tokens) - 1:
+            cache.crop(len(tokens) - 1)
+            have = len(tokens) - 1
+
+        input_ids = torch.tensor([tokens[have:]], device=self.device)
+        drafts = []
+        for _ in range(num_draft):
+            outputs = self.draft_model(
+                input_ids=input_ids,
+                past_key_values=cache,
+                use_cache=True,
+                num_logits_to_keep=1,
+            )
+            token = int(outputs.logits[0, -1].argmax())
+            drafts.append(token)
+            input_ids = torch.tensor([[token]], device=self.device)
+
+        request.draft_cache = cache
+        return drafts
+
+    # -------------------------
+    # BATCH BOOKKEEPING
+    # -------------------------
+    def _merge(self, request: GenerationRequest, cache: DynamicCache, token: int):
+        """Add a freshly prefilled sequence to the running batch."""
+        batch = self._batch
+        mask = torch.ones((1, request.position), dtype=torch.long, device=self.device)
+
+        if batch.requests:
+            # Build the merged state first so a failure leaves the batch as it was
+            length = max(batch.attention_mask.shape[1], request.position)
+            if isinstance(batch.cache, Int8KVCache):
+                # Stays int8: a dequantized copy of the batch would double peak memory
+                cache = Int8KVCache.cat_rows([batch.cache, cache], length)
+            else:
+                layers = []
+                for (k, v), (new_k, new_v) in zip(batch.cache.to_legacy_cache(), cache.to_legacy_cache()):
+                    layers.append((
+                        torch.cat([_left_pad(k, length, 2), _left_pad(new_k, length, 2)], dim=0),
+                        torch.cat([_left_pad(v, length, 2), _left_pad(new_v, length, 2)], dim=0),
+                    ))
+                cache = self.cache_class.from_legacy_cache(tuple(layers))
+            mask = torch.cat(
+                [_left_pad(batch.attention_mask, length, 1), _left_pad(mask, length, 1)],
+                dim=0,
+            )
+
+        batch.cache = cache
+        batch.attention_mask = mask
+
+        batch.requests.append(request)
+        batch.next_tokens.append(token)
+
+    def _drop_finished(self, keep: List[int]):
+        """Remove finished rows from the batch and trim padding nobody needs."""
+        batch = self._batch
+        for row, request in enumerate(batch.requests):
+            if row not in keep:
+                self._retain_conversation(request, batch.cache, row)
+        if not keep:
+            self._batch = _Batch()
+            return
+
+        index = torch.tensor(keep, device=self.device)
+        attention_mask = batch.attention_mask.index_select(0, index)
+        # Columns that are padding for every remaining row can go
+        start = int(attention_mask.sum(dim=0).nonzero()[0])
+        attention_mask = attention_mask[:, start:]
+
+        if isinstance(batch.cache, Int8KVCache):
+            batch.cache = batch.cache.select_rows(index, start)
+        else:
+            layers = tuple(
+                (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+                for k, v in batch.cache.to_legacy_cache()
+            )
+            batch.cache = self.cache_class.from_legacy_cache(layers)
+        batch.attention_mask = attention_mask
+        batch.requests = [batch.requests[i] for i in keep]
+        batch.next_tokens = [batch.next_tokens[i] for i in keep]
+
+    def _retain_conversation(self, request: GenerationRequest, cache, row: int):
+        """Keep a finished turn's KV state (prompt plus answer) for the conversation's next turn."""
+        if self.conversation_cache is None or not request.conversation_id or request.error is not None:
+            return
+
+        # The last generated token was never fed back, so it has no KV yet
+        tokens = (request.input_ids + request.generated)[:request.position]
+        try:
+            if self.static_decoder is not None:
+                layers = self.static_decoder.to_legacy(len(tokens))
+            else:
+                # Rows are left-padded: the sequence ends at the last column
+                start = cache.get_seq_length() - request.position
+                end = start + len(tokens)
+                if isinstance(cache, Int8KVCache):
+                    # Only this row is dequantized, not the whole batch
+                    layers = cache.row_legacy_cache(row, start, end)
+                else:
+                    layers = tuple(
+                        (k[row:row + 1, :, start:end].clone(), v[row:row + 1, :, start:end].clone())
+                        for k, v in cache.to_legacy_cache()
+                    )
+            self.conversation_cache.store(request.conversation_id, tokens, layers)
+        except Exception as e:
+            # The answer is already out; only the next turn's head start is lost
+            print(f"[SCHEDULER] Keeping conversation KV state failed: {e}")
+
+    # -------------------------
+    # PER-SEQUENCE STATE
+    # -------------------------
+    def _stop_reason(self, request: GenerationRequest) -> Optional[str]:
+        if not request.stopping_criteria:
+            return None
+        return _stop_reason_tail(request, request.generated)
+
+    def _append_token(self, request: GenerationRequest, token: int) -> bool:
+        """Record a new token. Returns True if the sequence should keep going."""
+        request.generated.append(token)
+        request.trace.token()
+        self._stats["generated_tokens"] += 1
+
+        if token == self.eos_token_id:
+            self._finish(request, "eos")
+            return False
+
+        if request.streamer is not None:
+            request.streamer.put(torch.tensor([token]))
+
+        if len(request.generated) >= request.max_new_tokens:
+            self._finish(request, "length")
+            return False
+
+        reason = self._stop_reason(request)
+        if reason is not None:
+            self._finish(request, reason)
+            return False
+
+        return True
+
+    def _finish(self, request: GenerationRequest, reason: str, error: Optional[BaseException] = None):
+        request.finish_reason = reason
+        request.draft_cache = None
+        request.error = error
+        self._finish_reasons[reason] = self._finish_reasons.get(reason, 0) + 1
+        if error is not None:
+            self._stats["failed"] += 1
+        else:
+            self._stats["completed"] += 1
+        request.trace.mark("finished")
+        record_generation(request.trace, reason)
+        if request.streamer is not None:
+            request.streamer.end()
+        request.done.set()
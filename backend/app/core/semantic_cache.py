@@ -0,0 +1,171 @@
+"""
+Semantic response cache.
+
+Learners ask the same question in many phrasings ("what is a stack",
+"explain stacks to me", "stack data structure?"). The exact response cache
+only matches identical prompts; this cache embeds the normalized question
+(all-MiniLM-L6-v2, the same model the RAG store uses) and serves the answer
+of a previously answered question whose embedding is close enough.
+
+Entries live in an in-memory vector index with a fixed number of slots;
+the least recently used entry is evicted when it is full. Every entry
+belongs to a namespace, a hash of the model, generation config and prompt
+template around the question, so a lookup only ever matches answers
+produced the same way (and an explanation of stacks never answers a
+question about queues). The index lives in memory only, so a restart with
+a different model or prompts starts empty; within a process, stale
+namespaces just age out through the LRU.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# Cosine similarity above which two entries count as the same question
+DUPLICATE_SIMILARITY = 0.99
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return " ".join(text.lower().split()).strip(" ?!.")
+
+
+@dataclass
+class SemanticKey:
+    """A question embedded for lookups within one namespace."""
+    namespace: str
+    question: str
+    vector: np.ndarray
+
+
+class SemanticCache:
+    """Bounded in-memory nearest-neighbour cache of answers."""
+
+    def __init__(
+        self,
+        embed: Callable[[List[str]], List[List[float]]],
+        threshold: float = 0.9,
+        max_entries: int = 4096,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            embed: Embedding function (e.g. ``CodeLearnEmbeddingFunction``).
+            threshold: Minimum cosine similarity for a hit.
+            max_entries: Index slots; the least recently used entry is evicted beyond this.
+        """
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # (max_entries, dim), unit length
+        self._namespace_ids = np.full(max_entries, -1, dtype=np.int64)  # -1 marks a free slot
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._answers: List[Optional[str]] = [None] * max_entries
+        self._questions: List[Optional[str]] = [None] * max_entries
+        self._namespaces: Dict[str, int] = {}
+        self._next_namespace_id = 0
+        self._clock = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    def key(self, namespace: str, question: str) -> SemanticKey:
+        """Embed ``question`` (normalized) for lookups in ``namespace``."""
+        question = normalize_question(question)
+        vector = np.asarray(self.embed([question])[0], dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm > 0:
+            vector = vector / norm
+        return SemanticKey(namespace, question, vector)
+
+    def _best_match(self, key: SemanticKey):
+        """Slot and similarity of the closest entry in the key's namespace (call with the lock held)."""
+        namespace_id = self._namespaces.get(key.namespace)
+        if namespace_id is None or self._vectors is None:
+            return None, -1.0
+        similarities = self._vectors @ key.vector
+        similarities[self._namespace_ids != namespace_id] = -np.inf
+        slot = int(np.argmax(similarities))
+        return slot, float(similarities[slot])
+
+    def get(self, key: SemanticKey) -> Optional[str]:
+        """Return the answer to the most similar cached question, if it is similar enough."""
+        with self._lock:
+            slot, similarity = self._best_match(key)
+            if slot is None or similarity < self.threshold:
+                self._stats["misses"] += 1
+                return None
+            self._clock += 1
+            self._last_used[slot] = self._clock
+            self._stats["hits"] += 1
+            matched = self._questions[slot]
+            answer = self._answers[slot]
+        print(f"[SEMANTIC CACHE] '{key.question}' matched '{matched}' (similarity {similarity:.3f})")
+        return answer
+
+    def put(self, key: SemanticKey, answer: str):
+        """Store the answer for ``key``, replacing a near-identical question or the least recently used entry."""
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, key.vector.shape[0]), dtype=np.float32)
+
+            slot, similarity = self._best_match(key)
+            if slot is None or similarity < DUPLICATE_SIMILARITY:
+                free = np.flatnonzero(self._namespace_ids < 0)
+                if len(free):
+                    slot = int(free[0])
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    self._stats["evictions"] += 1
+
+            namespace_id = self._namespaces.get(key.namespace)
+            if namespace_id is None:
+                namespace_id = self._namespaces[key.namespace] = self._next_namespace_id
+                self._next_namespace_id += 1
+            self._clock += 1
+            self._vectors[slot] = key.vector
+            self._namespace_ids[slot] = namespace_id
+            self._last_used[slot] = self._clock
+            self._answers[slot] = answer
+            self._questions[slot] = key.question
+            self._stats["stores"] += 1
+
+    def invalidate(self, namespace: Optional[str] = None):
+        """
+        Drop cached answers: those of one namespace, or all of them.
+
+        Nothing in the server calls this; it is for maintenance scripts and
+        interactive use.
+        """
+        with self._lock:
+            if namespace is None:
+                dropped = self._namespace_ids >= 0
+                self._namespaces.clear()
+            else:
+                namespace_id = self._namespaces.pop(namespace, None)
+                if namespace_id is None:
+                    return
+                dropped = self._namespace_ids == namespace_id
+            for slot in np.flatnonzero(dropped):
+                self._answers[slot] = None
+                self._questions[slot] = None
+            self._namespace_ids[dropped] = -1
+            self._last_used[dropped] = 0
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": int(np.count_nonzero(self._namespace_ids >= 0)),
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,121 @@
+"""
+Static-shape decoding for the "compiled" decode mode.
+
+Keeps one sequence's KV state in a preallocated ``StaticCache`` sized for the
+maximum context length, so every decode step has exactly the same tensor
+shapes. That lets ``torch.compile`` trace the decode step once and reuse the
+compiled graph for every token. If compilation isn't supported (no
+compiler toolchain, unsupported ops such as dynamically quantized layers)
+the decoder falls back to running the same step eagerly.
+"""
+
+from typing import Tuple
+
+import torch
+from transformers import StaticCache
+
+
+class StaticCacheDecoder:
+    """Single-sequence prefill/decode on a preallocated static KV cache."""
+
+    def __init__(self, model, max_cache_len: int, compile: bool = True):
+        self.model = model
+        self.max_cache_len = max_cache_len
+        self.cache = StaticCache(
+            config=model.config,
+            max_batch_size=1,
+            max_cache_len=max_cache_len,
+            device=model.device,
+            dtype=model.dtype,
+        )
+
+        self.mode = "eager"
+        self._compiled_step = None
+        if compile:
+            self._compile()
+
+    def _compile(self):
+        if not hasattr(torch, "compile"):
+            print("[LLM INIT] torch.compile is not available; using eager decoding.")
+            return
+        try:
+            # CUDA graphs remove per-step launch overhead on GPU; on CPU the
+            # default mode fuses the small decode-step kernels
+            mode = "reduce-overhead" if self.model.device.type == "cuda" else "default"
+            self._compiled_step = torch.compile(self._step, mode=mode, dynamic=False)
+            self.mode = "compiled"
+        except Exception as e:
+            print(f"[WARNING] torch.compile failed ({e}); using eager decoding.")
+
+    def _step(
+        self,
+        input_ids: torch.Tensor,
+        position_ids: torch.Tensor,
+        cache_position: torch.Tensor,
+    ) -> torch.Tensor:
+        return self.model(
+            input_ids=input_ids,
+            position_ids=position_ids,
+            cache_position=cache_position,
+            past_key_values=self.cache,
+            use_cache=True,
+        ).logits
+
+    # -------------------------
+    # CACHE CONTENTS
+    # -------------------------
+    def reset(self):
+        """Forget the current sequence (zeroes the cache in place)."""
+        self.cache.reset()
+
+    def load(self, legacy_cache: Tuple, length: int):
+        """Copy ``length`` positions of a legacy-format cache into the static cache."""
+        for layer, (k, v) in enumerate(legacy_cache):
+            self.cache.key_cache[layer][:, :, :length] = k[:, :, :length]
+            self.cache.value_cache[layer][:, :, :length] = v[:, :, :length]
+
+    def to_legacy(self, length: int) -> Tuple:
+        """Copy out the first ``length`` positions as a legacy-format cache."""
+        return tuple(
+            (
+                self.cache.key_cache[layer][:, :, :length].clone(),
+                self.cache.value_cache[layer][:, :, :length].clone(),
+            )
+            for layer in range(len(self.cache.key_cache))
+        )
+
+    # -------------------------
+    # MODEL STEPS
+    # -------------------------
+    def forward(self, input_ids: torch.Tensor, start: int):
+        """Run prompt tokens starting at position ``start`` (eager; prompt lengths vary)."""
+        end = start + input_ids.shape[-1]
+        cache_position = torch.arange(start, end, device=self.model.device)
+        return self.model(
+            input_ids=input_ids,
+            position_ids=cache_position.unsqueeze(0),
+            cache_position=cache_position,
+            past_key_values=self.cache,
+            use_cache=True,
+            num_logits_to_keep=1,
+        )
+
+    def decode(self, token: int, position: int) -> int:
+        """Feed ``token`` at ``position`` and return the greedy next token."""
+        input_ids = torch.tensor([[token]], device=self.model.device)
+        cache_position = torch.tensor([position], device=self.model.device)
+        position_ids = cache_position.unsqueeze(0)
+
+        if self._compiled_step is not None:
+            try:
+                logits = self._compiled_step(input_ids, position_ids, cache_position)
+                return int(logits[0, -1].argmax())
+            except Exception as e:
+                # Compilation happens on the first call; the cache writes are
+                # positional, so re-running the step eagerly is safe
+                print(f"[WARNING] Compiled decode step failed ({e}); falling back to eager decoding.")
+                self._compiled_step = None
+                self.mode = "eager"
+
+        logits = self._step(input_ids, position_ids, cache_position)
+        return int(logits[0, -1].argmax())
@@ -0,0 +1,151 @@
+"""
+Token streamers used by the LLM.
+
+Backends push generated token ids into a streamer one step at a time; the
+streamers here turn them into text with an incremental detokenizer and
+hand it to the consumer:
+
+- ``TextQueueStreamer``: blocking iterator for sync callers
+- ``AsyncTextStreamer``: ``async for`` on an event loop, fed through an
+  ``asyncio.Queue`` so async endpoints can await tokens without holding
+  a thread
+"""
+
+import asyncio
+from queue import Queue
+from typing import List, Optional
+
+from transformers.generation.streamers import BaseStreamer
+
+
+class IncrementalDetokenizer:
+    """
+    Turns a stream of token ids into text, decoding only a small window per token.
+
+    ``TextStreamer`` re-decodes every token since the last line break on each
+    step, so the cost per token grows with the line length. Here each step
+    decodes just the previously emitted chunk (as look-back context, so
+    merges and leading-space rules come out the same as a full decode)
+    plus the new tokens, and the text is the difference between the two.
+    Tokens that end in the middle of a multi-byte character decode to
+    U+FFFD and are held back until the character is complete.
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.tokens: List[int] = []
+        self.prefix_offset = 0  # Start of the look-back window
+        self.read_offset = 0    # Tokens before this have been emitted
+
+    def _decode(self, tokens: List[int]) -> str:
+        return self.tokenizer.decode(tokens, skip_special_tokens=self.skip_special_tokens)
+
+    def push(self, token_ids: List[int]) -> str:
+        """Add tokens and return the text they complete (may be empty)."""
+        self.tokens.extend(token_ids)
+        prefix_text = self._decode(self.tokens[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.tokens[self.prefix_offset:])
+        if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+            return ""
+
+        # Only the last emitted chunk is needed as context from now on
+        del self.tokens[:self.read_offset]
+        self.prefix_offset = 0
+        self.read_offset = len(self.tokens)
+        return new_text[len(prefix_text):]
+
+    def flush(self) -> str:
+        """Return any held-back text once the stream has ended."""
+        prefix_text = self._decode(self.tokens[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.tokens[self.prefix_offset:])
+        self.tokens = []
+        self.prefix_offset = self.read_offset = 0
+        return new_text[len(prefix_text):]
+
+
+class _DetokenizingStreamer(BaseStreamer):
+    """Base for streamers that emit text chunks from generated tokens."""
+
+    def __init__(self, tokenizer, skip_special_tokens: bool = True):
+        self.detokenizer = IncrementalDetokenizer(tokenizer, skip_special_tokens)
+
+    def put(self, value):
+        text = self.detokenizer.push(value.reshape(-1).tolist())
+        if text:
+            self.on_text(text)
+
+    def end(self):
+        text = self.detokenizer.flush()
+        if text:
+            self.on_text(text)
+        self.on_end()
+
+    def on_text(self, text: str):
+        raise NotImplementedError
+
+    def on_end(self):
+        raise NotImplementedError
+
+
+class TextQueueStreamer(_DetokenizingStreamer):
+    """Streamer consumed with a plain (blocking) ``for`` loop."""
+
+    def __init__(self, tokenizer, skip_special_tokens: bool = True, timeout: Optional[float] = None):
+        super().__init__(tokenizer, skip_special_tokens)
+        self.text_queue: Queue = Queue()
+        self.stop_signal = None
+        self.timeout = timeout
+
+    def on_text(self, text: str):
+        self.text_queue.put(text, timeout=self.timeout)
+
+    def on_end(self):
+        self.text_queue.put(self.stop_signal, timeout=self.timeout)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        value = self.text_queue.get(timeout=self.timeout)
+        if value is self.stop_signal:
+            raise StopIteration
+        return value
+
+
+class AsyncTextStreamer(_DetokenizingStreamer):
+    """
+    Streamer consumed with ``async for``.
+
+    Must be created on the event loop that will consume it. Tokens are
+    decoded on the producing thread and queued onto that loop with
+    ``call_soon_threadsafe``.
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens: bool = True):
+        super().__init__(tokenizer, skip_special_tokens)
+        self.loop = asyncio.get_running_loop()
+        self.text_queue: asyncio.Queue = asyncio.Queue()
+        self.stop_signal = None
+
+    def on_text(self, text: str):
+        self._push(text)
+
+    def on_end(self):
+        self._push(self.stop_signal)
+
+    def _push(self, value: Optional[str]):
+        try:
+            self.loop.call_soon_threadsafe(self.text_queue.put_nowait, value)
+        except RuntimeError:
+            # The loop was closed (server shutting down); nobody is listening
+            pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        value = await self.text_queue.get()
+        if value is self.stop_signal:
+            raise StopAsyncIteration
+        return value
@@ -0,0 +1,333 @@
+"""
+Generation telemetry.
+
+Every ``GenerationRequest`` carries a ``GenerationTrace`` that is stamped as
+the request moves through tokenization, the queue, prefill and decoding.
+When the request finishes, the backend records the trace: it is folded
+into process-wide histograms (served at ``/metrics`` in the Prometheus text
+format) and a one-line summary is logged.
+"""
+
+import itertools
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+METRIC_PREFIX = "codelearn_llm"
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+INTER_TOKEN_BUCKETS = (0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200)
+TOKEN_COUNT_BUCKETS = (16, 32, 64, 128, 256, 400, 512, 1024, 2048)
+
+# Smoothing for the recent-throughput estimates (weight of the newest request)
+EWMA_ALPHA = 0.2
+
+_trace_ids = itertools.count(1)
+
+
+@dataclass
+class GenerationTrace:
+    """Timestamps (``time.perf_counter``) and counters for one generation."""
+    id: int = field(default_factory=lambda: next(_trace_ids))
+    label: str = "general"  # Generation profile name
+    priority: str = "standard"  # Queue priority class
+    created: float = field(default_factory=time.perf_counter)
+    prompt_tokens: int = 0
+    tokenize_seconds: float = 0.0
+
+    submitted: Optional[float] = None    # Handed to the backend
+    started: Optional[float] = None      # Left the queue, prefill starts
+    prefilled: Optional[float] = None    # Prompt processed
+    first_token: Optional[float] = None
+    last_token: Optional[float] = None
+    finished: Optional[float] = None
+
+    tokens: int = 0
+    inter_token: List[float] = field(default_factory=list)
+
+    def mark(self, name: str):
+        """Stamp ``name`` (e.g. "submitted") with the current time."""
+        setattr(self, name, time.perf_counter())
+
+    def token(self):
+        """Record a token produced just now."""
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        else:
+            self.inter_token.append(now - self.last_token)
+        self.last_token = now
+        self.tokens += 1
+
+    # -------------------------
+    # DERIVED TIMINGS
+    # -------------------------
+    @property
+    def queue_wait(self) -> Optional[float]:
+        if self.submitted is None or self.started is None:
+            return None
+        return self.started - self.submitted
+
+    @property
+    def prefill(self) -> Optional[float]:
+        if self.started is None or self.prefilled is None:
+            return None
+        return self.prefilled - self.started
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """Time to first token, from the moment the request was created."""
+        if self.first_token is None:
+            return None
+        return self.first_token - self.created
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.finished is None:
+            return None
+        return self.finished - self.created
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """Generation speed once the request was running (excludes queue wait)."""
+        if self.started is None or self.finished is None or not self.tokens:
+            return None
+        elapsed = self.finished - self.started
+        return self.tokens / elapsed if elapsed > 0 else None
+
+    def summary(self, finish_reason: Optional[str]) -> Dict[str, Any]:
+        """Compact per-request summary for logs."""
+        def ms(seconds: Optional[float]) -> Optional[float]:
+            return None if seconds is None else round(seconds * 1000, 1)
+
+        gaps = sorted(self.inter_token)
+        tokens_per_second = self.tokens_per_second
+        return {
+            "id": self.id,
+            "profile": self.label,
+            "priority": self.priority,
+            "finish": finish_reason,
+            "prompt_tokens": self.prompt_tokens,
+            "tokens": self.tokens,
+            "tokenize_ms": ms(self.tokenize_seconds),
+            "queue_ms": ms(self.queue_wait),
+            "prefill_ms": ms(self.prefill),
+            "ttft_ms": ms(self.ttft),
+            "itl_p50_ms": ms(_percentile(gaps, 0.50)),
+            "itl_p95_ms": ms(_percentile(gaps, 0.95)),
+            "tokens_per_sec": None if tokens_per_second is None else round(tokens_per_second, 1),
+            "total_ms": ms(self.duration),
+        }
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class _Series:
+    """Bucket counts, sum and count for one histogram series."""
+
+    def __init__(self, num_buckets: int):
+        self.counts = [0] * (num_buckets + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus style (not thread-safe).
+
+    With ``label`` set, observations are split into one series per label
+    value (e.g. per priority class).
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], label: Optional[str] = None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self.series: Dict[str, _Series] = {}
+
+    def observe(self, value: float, label_value: str = ""):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = _Series(len(self.buckets))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series.counts[i] += 1
+                break
+        else:
+            series.counts[-1] += 1
+        series.sum += value
+        series.count += 1
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for label_value, series in sorted(self.series.items()):
+            labels = f'{self.label}="{label_value}"' if self.label else ""
+            prefix = labels + "," if labels else ""
+            suffix = "{" + labels + "}" if labels else ""
+
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series.count}')
+            lines.append(f"{self.name}_sum{suffix} {series.sum}")
+            lines.append(f"{self.name}_count{suffix} {series.count}")
+        return lines
+
+
+class GenerationMetrics:
+    """Process-wide generation histograms and counters."""
+
+    def __init__(self, log_summaries: bool = True):
+        self.log_summaries = log_summaries
+        self._lock = threading.Lock()
+
+        def histogram(
+            name: str,
+            help_text: str,
+            buckets: Sequence[float],
+            label: Optional[str] = None,
+        ) -> Histogram:
+            return Histogram(f"{METRIC_PREFIX}_{name}", help_text, buckets, label)
+
+        self.tokenize = histogram("tokenize_seconds", "Prompt tokenization time", LATENCY_BUCKETS)
+        self.queue_wait = histogram(
+            "queue_wait_seconds", "Time spent queued before prefill", LATENCY_BUCKETS, label="priority"
+        )
+        self.prefill = histogram("prefill_seconds", "Prompt prefill time", LATENCY_BUCKETS)
+        self.prefill_stall = histogram(
+            "prefill_stall_seconds", "Decode steps held up by a round of prefill chunks", LATENCY_BUCKETS
+        )
+        self.ttft = histogram(
+            "time_to_first_token_seconds", "Request creation to first token", LATENCY_BUCKETS, label="priority"
+        )
+        self.inter_token = histogram("inter_token_seconds", "Gap between consecutive tokens", INTER_TOKEN_BUCKETS)
+        self.tokens_per_second = histogram(
+            "tokens_per_second", "Generation speed per request (excludes queue wait)", TOKENS_PER_SECOND_BUCKETS
+        )
+        self.duration = histogram("generation_seconds", "Total request time", LATENCY_BUCKETS)
+        self.generated_tokens = histogram("generated_tokens", "Tokens generated per request", TOKEN_COUNT_BUCKETS)
+        self.finish_reasons: Dict[str, int] = {}
+
+        # Recent per-sequence speed and answer length (None until measured)
+        self.recent_tokens_per_second: Optional[float] = None
+        self.recent_tokens_per_request: Optional[float] = None
+
+    def record(self, trace: GenerationTrace, finish_reason: Optional[str]):
+        """Fold a finished trace into the histograms and log its summary."""
+        if trace.finished is None:
+            trace.mark("finished")
+
+        observations: List[Tuple[Histogram, Optional[float]]] = [
+            (self.tokenize, trace.tokenize_seconds),
+            (self.queue_wait, trace.queue_wait),
+            (self.prefill, trace.prefill),
+            (self.ttft, trace.ttft),
+            (self.tokens_per_second, trace.tokens_per_second),
+            (self.duration, trace.duration),
+            (self.generated_tokens, trace.tokens),
+        ]
+        reason = finish_reason or "unknown"
+        with self._lock:
+            for histogram, value in observations:
+                if value is not None:
+                    histogram.observe(value, trace.priority if histogram.label else "")
+            for gap in trace.inter_token:
+                self.inter_token.observe(gap)
+            self.finish_reasons[reason] = self.finish_reasons.get(reason, 0) + 1
+            # Cut-short and warm-up runs say nothing about typical requests
+            if trace.label != "warmup" and reason not in ("cancelled", "error"):
+                self._update_recent(trace)
+
+        if self.log_summaries:
+            summary = trace.summary(finish_reason)
+            print("[METRICS] " + " ".join(f"{key}={value}" for key, value in summary.items()))
+
+    def record_prefill_stall(self, seconds: float):
+        """Record how long running sequences waited for other sequences' prefill."""
+        with self._lock:
+            self.prefill_stall.observe(seconds)
+
+    def _update_recent(self, trace: GenerationTrace):
+        def ewma(previous: Optional[float], value: float) -> float:
+            return value if previous is None else previous + EWMA_ALPHA * (value - previous)
+
+        if trace.tokens_per_second is not None:
+            self.recent_tokens_per_second = ewma(self.recent_tokens_per_second, trace.tokens_per_second)
+        if trace.tokens:
+            self.recent_tokens_per_request = ewma(self.recent_tokens_per_request, trace.tokens)
+
+    def throughput_estimate(self) -> Tuple[Optional[float], Optional[float]]:
+        """Recent (tokens/sec per sequence, tokens per request), or None before any data."""
+        with self._lock:
+            return self.recent_tokens_per_second, self.recent_tokens_per_request
+
+    def render(self) -> str:
+        """Prometheus text exposition of all generation metrics."""
+        name = f"{METRIC_PREFIX}_finished_total"
+        with self._lock:
+            lines = []
+            for histogram in (
+                self.tokenize,
+                self.queue_wait,
+                self.prefill,
+                self.prefill_stall,
+                self.ttft,
+                self.inter_token,
+                self.tokens_per_second,
+                self.duration,
+                self.generated_tokens,
+            ):
+                lines.extend(histogram.render())
+            lines.append(f"# HELP {name} Finished generations by stop reason")
+            lines.append(f"# TYPE {name} counter")
+            for reason, count in sorted(self.finish_reasons.items()):
+                lines.append(f'{name}{{reason="{reason}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def render_gauges(stats: Dict[str, Any], prefix: str = METRIC_PREFIX) -> str:
+    """Render the numeric values of a (nested) stats dict as Prometheus gauges."""
+    lines = []
+
+    def walk(value: Any, name: str):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(item, f"{name}_{key}")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+
+    walk(stats, prefix)
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+# Shared instance
+_metrics = GenerationMetrics()
+
+
+def get_generation_metrics() -> GenerationMetrics:
+    """Get the process-wide generation metrics."""
+    return _metrics
+
+
+def record_generation(trace: GenerationTrace, finish_reason: Optional[str]):
+    """Record a finished generation in the shared metrics."""
+    _metrics.record(trace, finish_reason)
+
+
+def record_prefill_stall(seconds: float):
+    """Record a prefill stall in the shared metrics."""
+    _metrics.record_prefill_stall(seconds)
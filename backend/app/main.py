@@ -2,7 +2,12 @@ from typing import Dict, Any
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.api import chat, rag, smart_chat
+from app.core.conversations import get_conversation_store
+from app.core.explanation_store import get_explanation_store
+from app.core.llm import get_loaded_llm
+from app.core.telemetry import get_generation_metrics, render_gauges
 
 
 @asynccontextmanager
@@ -12,13 +17,20 @@ async def lifespan(app: FastAPI):
     print("=" * 50)
     print("🚀 Starting CodeLearn AI...")
     print("=" * 50)
+    print("📚 Loading precomputed explanations...")
+    get_explanation_store()
     print("📦 Preloading LLM model (this takes 30-60 seconds)...")
     
     try:
         # Use preload_llm to ensure the shared instance is created
-        from app.api.smart_chat import preload_llm
-        preload_llm()
+        from app.core.llm import preload_llm
+        llm = preload_llm()
         print("✅ LLM model loaded successfully!")
+
+        if llm.settings.warmup_on_startup:
+            # Compiles the decode step in compiled mode
+            print("🔥 Warming up the LLM...")
+            llm.warmup()
     except Exception as e:
         print(f"⚠️ Warning: Failed to preload LLM: {e}")
         print("   LLM will be loaded on first request instead.")
@@ -31,6 +43,7 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     print("👋 Shutting down CodeLearn AI...")
+    smart_chat.cancel_background_generations()
 
 
 app = FastAPI(
@@ -62,6 +75,24 @@ async def health_check() -> Dict[str, str]:
     """Health check endpoint for monitoring."""
     return {"status": "healthy", "service": "codelearn-ai"}
 
+# Metrics endpoint (Prometheus text format)
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    """
+    Generation latency histograms plus the LLM's runtime counters.
+
+    Plain ``def``: the stats take locks and query the response cache's
+    SQLite table, so FastAPI runs this in the thread pool rather than on
+    the event loop that serves the streams.
+    """
+    body = get_generation_metrics().render()
+    llm = get_loaded_llm()  # Don't load the model just to report on it
+    if llm is not None:
+        body += render_gauges(llm.stats())
+    body += render_gauges(get_explanation_store().stats(), prefix="codelearn_explanation_store")
+    body += render_gauges(get_conversation_store().stats(), prefix="codelearn_conversations")
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 # Include API routers
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 app.include_router(rag.router, prefix="/api/rag", tags=["rag"])
@@ -3,6 +3,8 @@ System prompts for different AI assistant roles.
 These prompts define the behavior and output format for the LLM.
 """
 
+from typing import Optional
+
 # General Coding Assistant Prompt
 GENERAL_CODING_ASSISTANT = """You are an expert coding assistant with deep knowledge of programming concepts, best practices, and clean code principles.
 
@@ -76,6 +78,37 @@ If the retrieved content contains explanations along with code:
 Your output should be a faithful representation of the retrieved code, formatted only for basic readability."""
 
 
+# Prompt for generating explanations about data structures
+DS_EXPLANATION_PROMPT = """You are an expert teacher explaining data structures.
+
+The user wants to learn about: {data_structure}
+{operations_context}
+
+Provide a clear, concise explanation that:
+1. Explains what this data structure is
+2. Describes how the operations work
+3. Mentions time complexity if relevant
+4. Keep it brief (2-3 paragraphs max)
+
+User's question: {user_message}
+
+Your explanation:"""
+
+DS_OPERATION_EXPLANATION_PROMPT = """You are an expert teacher explaining data structures.
+
+The user wants to learn specifically about the {operations} operation(s) in {data_structure}.
+
+Provide a focused explanation that:
+1. Explains how these specific operations work
+2. Describes the step-by-step process
+3. Mentions time complexity
+4. Keep it concise (1-2 paragraphs)
+
+User's question: {user_message}
+
+Your explanation:"""
+
+
 # Helper function to format prompts with user input
 def format_general_prompt(user_query: str) -> list[dict[str, str]]:
     """
@@ -130,3 +163,39 @@ def format_rag_prompt(retrieved_content: str) -> list[dict[str, str]]:
         {"role": "system", "content": RAG_RESPONSE_FORMATTER},
         {"role": "user", "content": f"Format the following content:\n\n{retrieved_content}"}
     ]
+
+
+def build_ds_prompt(
+    message: str,
+    data_structure: str,
+    operations: Optional[list[str]] = None,
+) -> tuple[str, str]:
+    """
+    Build the explanation prompt for a data structure question.
+
+    Args:
+        message: The user's question.
+        data_structure: Data structure name (e.g., "Stack").
+        operations: Specific operations asked about, or None for an overview.
+
+    Returns:
+        Tuple of (prompt, cacheable prefix). The prefix is the template
+        scaffold before the user's question, which is identical for every
+        question about the same data structure and can reuse cached KV state.
+    """
+    if operations:
+        template = DS_OPERATION_EXPLANATION_PROMPT
+        fields = {
+            "data_structure": data_structure,
+            "operations": ", ".join(operations),
+        }
+    else:
+        template = DS_EXPLANATION_PROMPT
+        fields = {
+            "data_structure": data_structure,
+            "operations_context": "",
+        }
+
+    prompt = template.format(user_message=message, **fields)
+    prefix = template.split("{user_message}")[0].format(**fields)
+    return prompt, prefix
@@ -0,0 +1,132 @@
+"""
+Decode-mode benchmark: eager vs compiled (static KV cache + torch.compile) on CPU.
+
+Generates the same prompts in each mode and reports the per-token decode
+latency (the gap between consecutive tokens, from the generation trace),
+time to first token and the one-off warm-up cost. Each mode runs in its
+own subprocess so compilation caches don't leak between them.
+
+Usage (from the backend directory):
+    python benchmark_compiled.py
+    python benchmark_compiled.py --threads 8 --max-new-tokens 200 --quantization int8
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Add backend directory to path
+sys.path.append(os.getcwd())
+
+PROMPTS = [
+    "what is a stack",
+    "Explain how insertion works in a singly linked list.",
+    "Write a Python function that reverses a string.",
+    "What is the time complexity of binary search and why?",
+]
+
+MODES = ("eager", "compiled")
+
+
+def run_mode(mode: str, threads: int, max_new_tokens: int, quantization: str) -> dict:
+    """Benchmark a single decode mode in this process."""
+    from app.core.llm import LLM, LLMSettings
+
+    settings = LLMSettings(
+        device="cpu",
+        cpu_num_threads=threads,
+        cpu_quantization=quantization,
+        max_new_tokens=max_new_tokens,
+        decode_mode=mode,
+        # Same batching for both modes; measure the model, not the caches
+        max_batch_size=1,
+        prefix_cache_mb=0,
+        response_cache_enabled=False,
+        repetition_detection=False,
+    )
+    llm = LLM(settings)
+
+    warmup_start = time.perf_counter()
+    llm.warmup()
+    warmup_seconds = time.perf_counter() - warmup_start
+
+    gaps = []
+    ttfts = []
+    tokens = 0
+    for prompt in PROMPTS:
+        request = llm._build_request(prompt)
+        llm.backend.generate(request)
+        gaps.extend(request.trace.inter_token)
+        ttfts.append(request.trace.ttft)
+        tokens += request.trace.tokens
+
+    gaps.sort()
+    return {
+        "mode": mode,
+        # Reports "eager" if compilation failed and the decoder fell back
+        "effective_mode": llm.backend.stats().get("decode_mode", mode),
+        "warmup_seconds": round(warmup_seconds, 2),
+        "tokens": tokens,
+        "ms_per_token": round(sum(gaps) / len(gaps) * 1000, 2) if gaps else 0.0,
+        "p50_ms": round(gaps[len(gaps) // 2] * 1000, 2) if gaps else 0.0,
+        "p95_ms": round(gaps[int(len(gaps) * 0.95)] * 1000, 2) if gaps else 0.0,
+        "ttft_ms": round(sum(ttfts) / len(ttfts) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark eager vs compiled decoding on CPU")
+    parser.add_argument("--mode", choices=MODES, help="Run a single mode (used internally)")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads (0 = torch default)")
+    parser.add_argument("--max-new-tokens", type=int, default=200)
+    parser.add_argument(
+        "--quantization",
+        default="none",
+        choices=["none", "int8"],
+        help="CPU weight quantization for both modes",
+    )
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.threads, args.max_new_tokens, args.quantization)))
+        return
+
+    results = []
+    for mode in MODES:
+        print(f"Running {mode} benchmark...")
+        proc = subprocess.run(
+            [
+                sys.executable, __file__,
+                "--mode", mode,
+                "--threads", str(args.threads),
+                "--max-new-tokens", str(args.max_new_tokens),
+                "--quantization", args.quantization,
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # The model prints while loading; the result is the last line
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print("\n" + "=" * 76)
+    print(f"{'Mode':<10}{'Effective':>10}{'Tokens':>8}{'ms/tok':>9}{'p50':>8}{'p95':>8}{'TTFT ms':>10}{'Warm-up s':>12}")
+    print("-" * 76)
+    for result in results:
+        print(
+            f"{result['mode']:<10}{result['effective_mode']:>10}{result['tokens']:>8}"
+            f"{result['ms_per_token']:>9}{result['p50_ms']:>8}{result['p95_ms']:>8}"
+            f"{result['ttft_ms']:>10}{result['warmup_seconds']:>12}"
+        )
+    print("=" * 76)
+
+    eager, compiled = results
+    if compiled["ms_per_token"]:
+        print(f"compiled vs eager: {eager['ms_per_token'] / compiled['ms_per_token']:.2f}x faster per token")
+
+
+if __name__ == "__main__":
+    main()
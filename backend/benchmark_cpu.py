@@ -0,0 +1,141 @@
+"""
+CPU inference benchmark: fp32 vs int8 dynamic quantization vs ONNX Runtime.
+
+Runs the same prompts through each variant on CPU and reports tokens/sec
+and peak RSS. Each variant runs in its own subprocess so the peak RSS
+numbers don't leak into each other.
+
+Variants:
+    fp32  - transformers backend, no quantization
+    int8  - transformers backend, int8 dynamic quantization
+    onnx  - ONNX Runtime backend (export first: python -m app.core.backends.onnx_export)
+
+Usage (from the backend directory):
+    python benchmark_cpu.py
+    python benchmark_cpu.py --variants fp32,int8,onnx --threads 8 --max-new-tokens 200
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+# Add backend directory to path
+sys.path.append(os.getcwd())
+
+PROMPTS = [
+    "what is a stack",
+    "Explain how insertion works in a singly linked list.",
+    "Write a Python function that reverses a string.",
+    "What is the time complexity of binary search and why?",
+]
+
+
+VARIANTS = {
+    "fp32": {"backend": "hf", "cpu_quantization": "none"},
+    "int8": {"backend": "hf", "cpu_quantization": "int8"},
+    "onnx": {"backend": "onnx"},
+}
+
+
+def run_variant(variant: str, threads: int, max_new_tokens: int) -> dict:
+    """Benchmark a single variant in this process."""
+    from app.core.llm import LLM, LLMSettings
+
+    settings = LLMSettings(
+        device="cpu",
+        cpu_num_threads=threads,
+        max_new_tokens=max_new_tokens,
+        # Measure the model, not the caches
+        prefix_cache_mb=0,
+        response_cache_enabled=False,
+        **VARIANTS[variant],
+    )
+
+    load_start = time.perf_counter()
+    llm = LLM(settings)
+    load_time = time.perf_counter() - load_start
+
+    # Warm-up so one-time allocations don't skew the first prompt
+    llm.generate("Hi")
+
+    total_tokens = 0
+    total_time = 0.0
+    per_prompt = []
+    for prompt in PROMPTS:
+        # Go straight to the backend so every variant is measured the same way
+        request = llm._build_request(prompt)
+        start = time.perf_counter()
+        tokens = len(llm.backend.generate(request))
+        elapsed = time.perf_counter() - start
+
+        total_tokens += tokens
+        total_time += elapsed
+        per_prompt.append({"prompt": prompt, "tokens": tokens, "seconds": round(elapsed, 3)})
+
+    # ru_maxrss is in KB on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    return {
+        "variant": variant,
+        "load_seconds": round(load_time, 2),
+        "tokens": total_tokens,
+        "seconds": round(total_time, 2),
+        "tokens_per_sec": round(total_tokens / total_time, 2) if total_time else 0.0,
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "prompts": per_prompt,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CPU inference variants")
+    parser.add_argument("--variants", default="fp32,int8", help=f"Comma-separated: {', '.join(VARIANTS)}")
+    parser.add_argument("--variant", choices=list(VARIANTS), help="Run a single variant (used internally)")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads (0 = torch default)")
+    parser.add_argument("--max-new-tokens", type=int, default=400)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.threads, args.max_new_tokens)))
+        return
+
+    results = []
+    for variant in args.variants.split(","):
+        print(f"Running {variant} benchmark...")
+        proc = subprocess.run(
+            [
+                sys.executable, __file__,
+                "--variant", variant,
+                "--threads", str(args.threads),
+                "--max-new-tokens", str(args.max_new_tokens),
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # The model prints while loading; the result is the last line
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print("\n" + "=" * 60)
+    print(f"{'Variant':<8}{'Tokens':>10}{'Seconds':>10}{'Tok/s':>10}{'Peak RSS (MB)':>16}")
+    print("-" * 60)
+    for result in results:
+        print(
+            f"{result['variant']:<8}{result['tokens']:>10}{result['seconds']:>10}"
+            f"{result['tokens_per_sec']:>10}{result['peak_rss_mb']:>16}"
+        )
+    print("=" * 60)
+
+    baseline = results[0]
+    for result in results[1:]:
+        if baseline["tokens_per_sec"]:
+            speedup = result["tokens_per_sec"] / baseline["tokens_per_sec"]
+            print(f"{result['variant']} vs {baseline['variant']}: {speedup:.2f}x tokens/sec, "
+                  f"{result['peak_rss_mb'] / baseline['peak_rss_mb'] * 100:.0f}% peak RSS")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+KV-cache dtype benchmark: model dtype ("auto") vs int8 with per-head scales.
+
+Quality check: generates the same prompts greedily with each cache dtype and
+compares the token ids, reporting how many answers match exactly and how
+far the int8 answers follow the unquantized ones before diverging.
+
+Memory: measures the KV bytes per token of a prefill with each cache, and
+from that the memory per sequence at the conversation token budget and the
+number of such sequences that fit in 1 GiB. The stored size is not the
+whole story, so it also runs all prompts as one continuous batch
+(sequences joining and leaving) and reports the peak process memory above
+the loaded model while doing so (Linux). Each dtype runs in its own
+subprocess.
+
+Usage (from the backend directory):
+    python benchmark_kv_cache.py
+    python benchmark_kv_cache.py --threads 8 --max-new-tokens 200 --sequence-tokens 4096
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Optional
+
+# Add backend directory to path
+sys.path.append(os.getcwd())
+
+PROMPTS = [
+    "what is a stack",
+    "Explain how insertion works in a singly linked list.",
+    "Write a Python function that reverses a string.",
+    "What is the time complexity of binary search and why?",
+    "Compare a queue and a deque, with an example of each.",
+    "How does a hash table handle collisions?",
+]
+
+DTYPES = ("auto", "int8")
+
+
+def _rss_field(name: str) -> Optional[int]:
+    """A memory field of /proc/self/status (e.g. VmRSS), in bytes."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(name + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> Optional[int]:
+    """Reset the process's peak RSS (Linux only). Returns the current RSS in bytes."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return None
+    return _rss_field("VmRSS")
+
+
+def run_dtype(kv_cache_dtype: str, threads: int, max_new_tokens: int) -> dict:
+    """Generate the prompts greedily and measure KV memory with one cache dtype in this process."""
+    import torch
+
+    from app.core.kv_quant import kv_cache_nbytes
+    from app.core.llm import LLM, LLMSettings
+
+    settings = LLMSettings(
+        device="cpu",
+        cpu_num_threads=threads,
+        max_new_tokens=max_new_tokens,
+        kv_cache_dtype=kv_cache_dtype,
+        # Greedy, one sequence at a time, no caches: only the KV dtype differs
+        max_batch_size=1,
+        prefix_cache_mb=0,
+        conversation_cache_mb=0,
+        response_cache_enabled=False,
+        semantic_cache_enabled=False,
+        repetition_detection=False,
+    )
+    llm = LLM(settings)
+    backend = llm.backend
+
+    outputs = []
+    for prompt in PROMPTS:
+        request = llm._build_request(prompt)
+        backend.generate(request)
+        outputs.append(request.generated)
+
+    # Bytes per position, from a prefill of the longest prompt
+    input_ids = max((llm._build_request(prompt).input_ids for prompt in PROMPTS), key=len)
+    cache = backend.scheduler.cache_class()
+    with torch.inference_mode():
+        backend.model(
+            input_ids=torch.tensor([input_ids], device=backend.model.device),
+            past_key_values=cache,
+            use_cache=True,
+        )
+
+    bytes_per_token = kv_cache_nbytes(cache) / len(input_ids)
+    del cache
+
+    # Peak while the prompts share one batch (joins, leaves, retained rows)
+    backend.scheduler.max_batch_size = len(PROMPTS)
+    baseline = reset_peak_rss()
+    llm.generate_batch(PROMPTS)
+    peak = _rss_field("VmHWM")
+
+    return {
+        "dtype": kv_cache_dtype,
+        "outputs": outputs,
+        "tokens": sum(len(output) for output in outputs),
+        "bytes_per_token": bytes_per_token,
+        "batch_peak_bytes": peak - baseline if baseline is not None and peak is not None else None,
+    }
+
+
+def matching_prefix(reference: list, candidate: list) -> float:
+    """Share of ``reference`` that ``candidate`` reproduces before the first difference."""
+    length = 0
+    while length < min(len(reference), len(candidate)) and reference[length] == candidate[length]:
+        length += 1
+    return length / len(reference) if reference else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the int8 KV cache against the model dtype")
+    parser.add_argument("--dtype", choices=DTYPES, help="Run a single cache dtype (used internally)")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads (0 = torch default)")
+    parser.add_argument("--max-new-tokens", type=int, default=200)
+    parser.add_argument(
+        "--sequence-tokens",
+        type=int,
+        default=0,
+        help="Sequence length for the memory estimate (0 = conversation_max_tokens)",
+    )
+    args = parser.parse_args()
+
+    if args.dtype:
+        print(json.dumps(run_dtype(args.dtype, args.threads, args.max_new_tokens)))
+        return
+
+    sequence_tokens = args.sequence_tokens
+    if not sequence_tokens:
+        from app.core.llm import LLMSettings
+
+        sequence_tokens = LLMSettings().conversation_max_tokens
+
+    results = []
+    for kv_cache_dtype in DTYPES:
+        print(f"Running {kv_cache_dtype} benchmark...")
+        proc = subprocess.run(
+            [
+                sys.executable, __file__,
+                "--dtype", kv_cache_dtype,
+                "--threads", str(args.threads),
+                "--max-new-tokens", str(args.max_new_tokens),
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # The model prints while loading; the result is the last line
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    auto, int8 = results
+    print("\n" + "=" * 80)
+    print(
+        f"{'KV dtype':<10}{'Tokens':>8}{'KB/token':>10}{f'MB/{sequence_tokens} tok':>18}{'Seqs/GiB':>12}"
+        f"{'Batch peak MB':>16}"
+    )
+    print("-" * 80)
+    for result in results:
+        sequence_bytes = result["bytes_per_token"] * sequence_tokens
+        peak = result["batch_peak_bytes"]
+        print(
+            f"{result['dtype']:<10}{result['tokens']:>8}{result['bytes_per_token'] / 1024:>10.1f}"
+            f"{sequence_bytes / 1024**2:>18.1f}{int(1024**3 // sequence_bytes):>12}"
+            f"{peak / 1024**2 if peak is not None else float('nan'):>16.1f}"
+        )
+    print("=" * 80)
+    print("Batch peak: process memory above the loaded model while all prompts share one batch")
+
+    exact = sum(a == b for a, b in zip(auto["outputs"], int8["outputs"]))
+    prefixes = [matching_prefix(a, b) for a, b in zip(auto["outputs"], int8["outputs"])]
+    print(f"greedy outputs identical: {exact}/{len(PROMPTS)}")
+    print(f"mean share of each answer reproduced before diverging: {sum(prefixes) / len(prefixes):.1%}")
+    print(f"int8 vs auto: {auto['bytes_per_token'] / int8['bytes_per_token']:.2f}x sequences per unit of KV memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Streaming detokenizer benchmark: TextIteratorStreamer vs TextQueueStreamer.
+
+Feeds the same 400-token answers into both streamers one token at a time,
+the way the scheduler does, and reports the streaming overhead per token.
+No model is needed; the token ids come from tokenizing sample answers.
+The per-token time is also reported for the first and last 100 tokens,
+which shows whether the cost grows with the answer length.
+
+Usage (from the backend directory):
+    python benchmark_streaming.py
+    python benchmark_streaming.py --tokens 400 --rounds 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+from transformers import AutoTokenizer, TextIteratorStreamer
+
+# Add backend directory to path
+sys.path.append(os.getcwd())
+
+from app.core.llm import LLMSettings
+from app.core.streamers import TextQueueStreamer
+
+# Long-line prose, code and non-ASCII text, repeated to fill the answer
+SAMPLE_ANSWERS = [
+    "A **stack** is a linear data structure that follows the LIFO (Last In, First Out) "
+    "principle, which means that the element added most recently is always the first one "
+    "to be removed, exactly like a pile of plates where you can only take the top plate "
+    "off and only put a new plate on top of the pile, never in the middle of it. ",
+    "```python\nclass Stack:\n    def __init__(self):\n        self.items = []\n\n"
+    "    def push(self, item):\n        self.items.append(item)\n\n"
+    "    def pop(self):\n        return self.items.pop()\n```\n",
+    "Complexité : O(1) pour push → pop, 栈 (stack) と キュー (queue) — ✓ done. ",
+]
+
+
+def build_answer(tokenizer, text: str, num_tokens: int) -> list:
+    """Repeat ``text`` until it tokenizes to at least ``num_tokens`` tokens."""
+    token_ids = []
+    while len(token_ids) < num_tokens:
+        token_ids += tokenizer(text, add_special_tokens=False).input_ids
+    return token_ids[:num_tokens]
+
+
+def stream(streamer, token_ids: list) -> tuple:
+    """Push tokens one by one, draining the text queue after each, like a consumer would."""
+    per_token = []
+    chunks = []
+    for token in token_ids:
+        start = time.perf_counter()
+        streamer.put(torch.tensor([token]))
+        per_token.append(time.perf_counter() - start)
+        while not streamer.text_queue.empty():
+            chunks.append(streamer.text_queue.get())
+    streamer.end()
+    while not streamer.text_queue.empty():
+        chunk = streamer.text_queue.get()
+        if chunk is not streamer.stop_signal:
+            chunks.append(chunk)
+    return "".join(chunks), per_token
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming detokenizers")
+    parser.add_argument("--model", default=LLMSettings().model_name, help="Tokenizer to use")
+    parser.add_argument("--tokens", type=int, default=400, help="Tokens per answer")
+    parser.add_argument("--rounds", type=int, default=10, help="Repetitions per answer")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
+    answers = [build_answer(tokenizer, text, args.tokens) for text in SAMPLE_ANSWERS]
+
+    streamers = {
+        "TextIteratorStreamer": lambda: TextIteratorStreamer(tokenizer, skip_special_tokens=True),
+        "TextQueueStreamer": lambda: TextQueueStreamer(tokenizer, skip_special_tokens=True),
+    }
+
+    results = {}
+    for name, make_streamer in streamers.items():
+        per_token = [[] for _ in range(args.tokens)]
+        texts = []
+        for token_ids in answers:
+            for _ in range(args.rounds):
+                text, timings = stream(make_streamer(), token_ids)
+                for i, seconds in enumerate(timings):
+                    per_token[i].append(seconds)
+            texts.append(text)
+        mean = [sum(times) / len(times) * 1e6 for times in per_token]
+        results[name] = {"mean": mean, "texts": texts}
+
+    # Both streamers have to produce exactly the same text
+    reference = [tokenizer.decode(token_ids, skip_special_tokens=True) for token_ids in answers]
+    for name, result in results.items():
+        matches = sum(text == ref for text, ref in zip(result["texts"], reference))
+        print(f"{name}: {matches}/{len(reference)} answers match a full decode")
+
+    print("\n" + "=" * 72)
+    print(f"{'Streamer':<24}{'us/token':>12}{'first 100':>12}{'last 100':>12}{'total ms':>12}")
+    print("-" * 72)
+    for name, result in results.items():
+        mean = result["mean"]
+        print(
+            f"{name:<24}{sum(mean) / len(mean):>12.1f}"
+            f"{sum(mean[:100]) / 100:>12.1f}{sum(mean[-100:]) / 100:>12.1f}"
+            f"{sum(mean) / 1000:>12.2f}"
+        )
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
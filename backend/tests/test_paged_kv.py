@@ -0,0 +1,141 @@
+"""Tests for the paged KV pool's reference counting and copy-on-write (app.core.paged_kv)."""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.core.paged_kv import PagedKVPool, PoolFullError  # noqa: E402
+
+PAGE_TOKENS = 4
+LAYERS, HEADS, HEAD_DIM = 2, 2, 3
+
+
+def make_cache(length: int, seed: int = 0):
+    """Legacy cache (batch size 1) with distinct values per layer and position."""
+    generator = torch.Generator().manual_seed(seed)
+    return tuple(
+        (
+            torch.randn(1, HEADS, length, HEAD_DIM, generator=generator),
+            torch.randn(1, HEADS, length, HEAD_DIM, generator=generator),
+        )
+        for _ in range(LAYERS)
+    )
+
+
+def make_pool(**kwargs) -> PagedKVPool:
+    return PagedKVPool(max_bytes=1 << 20, page_tokens=PAGE_TOKENS, **kwargs)
+
+
+def refcounts(pool: PagedKVPool, table):
+    return [pool._refcounts[page] for page in table.pages]
+
+
+def assert_cache_equal(actual, expected, length: int):
+    for (k, v), (expected_k, expected_v) in zip(actual, expected):
+        assert torch.equal(k, expected_k[:, :, :length])
+        assert torch.equal(v, expected_v[:, :, :length])
+
+
+def test_allocate_and_gather_round_trip():
+    pool = make_pool()
+    cache = make_cache(10)
+    table = pool.allocate(list(range(10)), cache)
+
+    assert len(table.pages) == 3
+    assert refcounts(pool, table) == [1, 1, 1]
+    assert_cache_equal(pool.gather(table), cache, 10)
+    assert_cache_equal(pool.gather(table, 5), cache, 5)
+
+
+def test_fork_shares_pages_until_freed():
+    pool = make_pool()
+    table = pool.allocate(list(range(10)), make_cache(10))
+    fork = pool.fork(table, 6)
+
+    assert fork.pages == table.pages[:2]
+    assert refcounts(pool, table) == [2, 2, 1]
+
+    pool.free(fork)
+    assert refcounts(pool, table) == [1, 1, 1]
+    assert fork.pages == [] and len(fork) == 0
+
+
+def test_append_copies_a_shared_partial_page():
+    pool = make_pool()
+    cache = make_cache(6)
+    table = pool.allocate(list(range(6)), cache)
+    fork = pool.fork(table, 6)
+    shared_last = table.pages[-1]
+
+    extended = make_cache(9, seed=1)
+    pool.append(fork, list(range(6)) + [100, 101, 102], extended)
+
+    assert pool.stats()["copy_on_write"] == 1
+    assert fork.pages[0] == table.pages[0]
+    assert fork.pages[1] != shared_last
+    assert refcounts(pool, table) == [2, 1]
+    # The original sequence still reads its own values
+    assert_cache_equal(pool.gather(table), cache, 6)
+
+
+def test_append_to_private_page_writes_in_place():
+    pool = make_pool()
+    table = pool.allocate(list(range(6)), make_cache(6))
+    last = table.pages[-1]
+
+    pool.append(table, list(range(8)), make_cache(8))
+
+    assert table.pages[-1] == last
+    assert pool.stats()["copy_on_write"] == 0
+    assert len(table) == 8
+
+
+def test_equal_prefixes_reuse_full_pages():
+    pool = make_pool()
+    cache = make_cache(10)
+    first = pool.allocate(list(range(10)), cache)
+    second = pool.allocate(list(range(8)) + [50, 51], cache)
+
+    assert second.pages[:2] == first.pages[:2]
+    assert second.pages[2] != first.pages[2]
+    assert refcounts(pool, first) == [2, 2, 1]
+    assert pool.stats()["pages_reused"] == 2
+
+
+def test_free_returns_every_page():
+    pool = make_pool()
+    first = pool.allocate(list(range(10)), make_cache(10))
+    second = pool.fork(first, 7)
+    pool.append(second, list(range(7)) + [9, 9], make_cache(9, seed=2))
+
+    pool.free(first)
+    pool.free(second)
+
+    stats = pool.stats()
+    assert stats["pages_used"] == 0
+    assert stats["pages_free"] == stats["pages_reserved"]
+    assert stats["shared_pages"] == 0
+    assert pool._index == {}
+
+
+def test_pool_full_leaves_nothing_allocated():
+    cache = make_cache(8)
+    pool = make_pool()
+    pool.allocate(list(range(4)), make_cache(4))
+    pool.max_pages = 2  # Room for one more page only
+    free_before = pool.stats()["pages_free"]
+
+    with pytest.raises(PoolFullError):
+        pool.allocate([7] * 8, cache)
+    assert pool.stats()["pages_used"] == 1
+    assert pool.stats()["pages_free"] == free_before
+
+
+def test_quantized_round_trip_is_close():
+    pool = make_pool(quantized=True)
+    cache = make_cache(10)
+    table = pool.allocate(list(range(10)), cache)
+
+    for (k, v), (expected_k, expected_v) in zip(pool.gather(table), cache):
+        assert torch.allclose(k, expected_k, atol=0.05)
+        assert torch.allclose(v, expected_v, atol=0.05)
@@ -0,0 +1,108 @@
+"""Tests for the weighted-fair request queue (app.core.request_queue)."""
+
+from types import SimpleNamespace
+
+import pytest
+
+from app.core import request_queue
+from app.core.request_queue import PRIORITY_STANDARD, RequestQueue
+
+
+def make_request(priority: str, label: str = ""):
+    return SimpleNamespace(priority=priority, label=label)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable ``time.perf_counter`` for the queue module."""
+    now = [0.0]
+    monkeypatch.setattr(request_queue.time, "perf_counter", lambda: now[0])
+    return now
+
+
+def drain(queue: RequestQueue, count: int):
+    return [queue.popleft() for _ in range(count)]
+
+
+def test_fifo_within_a_class():
+    queue = RequestQueue(weights={"a": 1})
+    requests = [make_request("a", str(i)) for i in range(5)]
+    for request in requests:
+        queue.append(request)
+
+    assert drain(queue, 5) == requests
+    assert queue.popleft() is None
+
+
+def test_turns_follow_the_weights(clock):
+    queue = RequestQueue(weights={"a": 3, "b": 1}, starvation_seconds=1e9)
+    for _ in range(40):
+        queue.append(make_request("a"))
+        queue.append(make_request("b"))
+
+    served = [request.priority for request in drain(queue, 40)]
+    assert abs(served.count("a") - 30) <= 1
+    assert abs(served.count("b") - 10) <= 1
+    # Interleaved, not one class after the other
+    assert "b" in served[:5]
+
+
+def test_idle_class_does_not_cash_in_unused_turns(clock):
+    queue = RequestQueue(weights={"a": 1, "b": 1}, starvation_seconds=1e9)
+    for _ in range(10):
+        queue.append(make_request("a"))
+    drain(queue, 10)
+
+    for _ in range(5):
+        queue.append(make_request("a"))
+        queue.append(make_request("b"))
+    served = [request.priority for request in drain(queue, 4)]
+    assert served.count("a") == 2
+    assert served.count("b") == 2
+
+
+def test_starved_request_is_promoted(clock):
+    queue = RequestQueue(weights={"hi": 100, "lo": 1}, starvation_seconds=10.0)
+    first, starving = make_request("lo"), make_request("lo")
+    queue.append(first)
+    queue.append(starving)
+    clock[0] = 5.0
+    for _ in range(200):
+        queue.append(make_request("hi"))
+
+    # After its first turn "lo" is far ahead in virtual time...
+    assert [request.priority for request in drain(queue, 2)] == ["hi", "lo"]
+    assert queue.popleft().priority == "hi"
+    assert queue.promotions == 0
+
+    # ...until its next request has waited past the starvation limit
+    clock[0] = 10.0
+    assert queue.popleft() is starving
+    assert queue.promotions == 1
+
+
+def test_allowed_classes_only():
+    queue = RequestQueue(weights={"a": 1, "b": 1})
+    queue.append(make_request("a"))
+
+    assert queue.popleft(allowed=("b",)) is None
+    assert queue.popleft(allowed=("a", "b")).priority == "a"
+
+
+def test_unknown_priority_counts_as_standard():
+    queue = RequestQueue()
+    request = make_request("urgent!!")
+    queue.append(request)
+
+    assert queue.priority_of(request) == PRIORITY_STANDARD
+    assert queue.depths()[PRIORITY_STANDARD] == 1
+    assert queue.popleft() is request
+    assert len(queue) == 0
+
+
+def test_oldest_wait(clock):
+    queue = RequestQueue(weights={"a": 1, "b": 1})
+    queue.append(make_request("a"))
+    clock[0] = 2.5
+
+    assert queue.oldest_wait() == {"a": 2.5, "b": 0.0}
@@ -0,0 +1,65 @@
+"""Tests for incremental detokenization (app.core.streamers)."""
+
+import pytest
+
+pytest.importorskip("transformers")
+
+from app.core.streamers import IncrementalDetokenizer  # noqa: E402
+
+
+class ByteTokenizer:
+    """One token per UTF-8 byte, so multi-byte characters span several tokens."""
+
+    def encode(self, text: str):
+        return list(text.encode("utf-8"))
+
+    def decode(self, token_ids, skip_special_tokens: bool = True) -> str:
+        return bytes(token_ids).decode("utf-8", errors="replace")
+
+
+def stream(detokenizer: IncrementalDetokenizer, chunks):
+    pieces = [detokenizer.push(chunk) for chunk in chunks]
+    return pieces, detokenizer.flush()
+
+
+def test_token_by_token_matches_full_decode():
+    tokenizer = ByteTokenizer()
+    text = "def push(x):\n    stack.append(x)  # O(1)\n"
+    pieces, tail = stream(IncrementalDetokenizer(tokenizer), [[t] for t in tokenizer.encode(text)])
+
+    assert "".join(pieces) + tail == text
+
+
+def test_split_multibyte_characters_are_held_back():
+    tokenizer = ByteTokenizer()
+    text = "pé → 🙂 ok"
+    detokenizer = IncrementalDetokenizer(tokenizer)
+
+    pieces, tail = stream(detokenizer, [[t] for t in tokenizer.encode(text)])
+
+    assert all("\ufffd" not in piece for piece in pieces)
+    assert "".join(pieces) + tail == text
+    # The first byte of "é" alone completes nothing
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    assert detokenizer.push(tokenizer.encode("p")) == "p"
+    assert detokenizer.push(tokenizer.encode("é")[:1]) == ""
+    assert detokenizer.push(tokenizer.encode("é")[1:]) == "é"
+
+
+def test_several_tokens_per_push():
+    tokenizer = ByteTokenizer()
+    data = tokenizer.encode("naïve €5")
+    chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+    pieces, tail = stream(IncrementalDetokenizer(tokenizer), chunks)
+
+    assert "".join(pieces) + tail == "naïve €5"
+
+
+def test_flush_returns_an_unfinished_character():
+    tokenizer = ByteTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    detokenizer.push(tokenizer.encode("a"))
+
+    assert detokenizer.push(tokenizer.encode("€")[:2]) == ""
+    # The stream ended mid-character: what's left comes out as-is
+    assert detokenizer.flush() == "\ufffd"
@@ -1,5 +1,6 @@
 import { useState, useRef, useEffect } from 'react'
 import { Send, Loader2, Trash2 } from 'lucide-react'
+import { parseStreamResponse } from '../streamMetadata'
 
 interface Message {
   id: string
@@ -92,13 +93,17 @@ function Chat() {
 
       // Stream decoder
       const decoder = new TextDecoder()
+      let fullResponse = ''
       while (true) {
         const { done, value } = await reader.read()
         if (done) break
 
         const chunk = decoder.decode(value, { stream: true })
+        fullResponse += chunk
+        // Strips the trailer the server adds when its time limit cut the answer short
+        const { text } = parseStreamResponse(fullResponse)
 
-        // Update the last message with the new chunk
+        // Update the last message with the text so far
         setMessages((prev) => {
           const newMessages = [...prev]
           const lastMessageIdx = newMessages.findIndex(m => m.id === assistantMessage.id)
@@ -106,7 +111,7 @@ function Chat() {
           if (lastMessageIdx !== -1) {
             newMessages[lastMessageIdx] = {
               ...newMessages[lastMessageIdx],
-              content: newMessages[lastMessageIdx].content + chunk
+              content: text
             }
           }
           return newMessages
@@ -1,5 +1,6 @@
 import { useState, useRef, useEffect } from 'react'
 import { Send, Loader2 } from 'lucide-react'
+import { parseStreamResponse } from '../streamMetadata'
 
 interface Message {
   id: string
@@ -73,11 +74,15 @@ function DSChat() {
       setMessages((prev) => [...prev, assistantMessage])
 
       const decoder = new TextDecoder()
+      let fullResponse = ''
       while (true) {
         const { done, value } = await reader.read()
         if (done) break
 
         const chunk = decoder.decode(value, { stream: true })
+        fullResponse += chunk
+        // Strips the trailer the server adds when its time limit cut the answer short
+        const { text } = parseStreamResponse(fullResponse)
 
         setMessages((prev) => {
           const newMessages = [...prev]
@@ -85,7 +90,7 @@ function DSChat() {
           if (lastMessageIdx >= 0 && newMessages[lastMessageIdx].role === 'assistant') {
             newMessages[lastMessageIdx] = {
               ...newMessages[lastMessageIdx],
-              content: newMessages[lastMessageIdx].content + chunk
+              content: text
             }
           }
           return newMessages
@@ -1,5 +1,6 @@
 import { useState, useRef, useEffect } from 'react'
 import { Send, Loader2, Trash2, Code2, MessageSquare, Sparkles } from 'lucide-react'
+import { parseStreamResponse } from '../streamMetadata'
 
 interface Message {
   id: string
@@ -14,24 +15,6 @@ interface Message {
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000'
 const STORAGE_KEY = 'codeviz-smart-chat-history'
 
-// Parse streaming response with metadata
-function parseStreamResponse(fullResponse: string): {
-  metadata: any | null
-  text: string
-} {
-  const metadataMatch = fullResponse.match(/__METADATA__(.*?)__END_METADATA__/)
-  if (metadataMatch) {
-    try {
-      const metadata = JSON.parse(metadataMatch[1])
-      const text = fullResponse.replace(/__METADATA__.*?__END_METADATA__/, '')
-      return { metadata, text }
-    } catch (e) {
-      return { metadata: null, text: fullResponse }
-    }
-  }
-  return { metadata: null, text: fullResponse }
-}
-
 function SmartChat() {
   const [messages, setMessages] = useState<Message[]>(() => {
     const saved = localStorage.getItem(STORAGE_KEY)
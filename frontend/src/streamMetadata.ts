@@ -0,0 +1,31 @@
+// Stream framing shared by the chat endpoints: metadata blocks
+// (__METADATA__{json}__END_METADATA__) mixed into the text. Smart chat opens
+// with a header block; any stream ends with a trailer block when the
+// server's time limit cut the answer short.
+
+const METADATA_BLOCK = /__METADATA__(.*?)__END_METADATA__/g
+
+export const TRUNCATED_NOTE = '\n\n(Answer cut short: the time limit was reached.)'
+
+export function parseStreamResponse(fullResponse: string): {
+  metadata: any | null
+  text: string
+  truncated: boolean
+} {
+  let metadata: any | null = null
+  let truncated = false
+  const text = fullResponse.replace(METADATA_BLOCK, (block: string, json: string) => {
+    try {
+      const parsed = JSON.parse(json)
+      if (parsed.type === 'trailer') {
+        truncated = Boolean(parsed.truncated)
+      } else {
+        metadata = parsed
+      }
+      return ''
+    } catch (e) {
+      return block
+    }
+  })
+  return { metadata, text: truncated ? text + TRUNCATED_NOTE : text, truncated }
+}